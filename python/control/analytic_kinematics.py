@@ -0,0 +1,190 @@
+"""
+Implements AnalyticKinematics class, closed-form NumPy kinematics of all fingers
+for one or a batch of joint configurations, as a backend of CustomPinocchioUtils
+"""
+
+import numpy as np
+
+GRAVITY = 9.81
+GRAVITY_SCALE = 0.33 # As in CustomPinocchioUtils.get_lambda_and_g_matrix
+
+# Linear map from vector a to its flattened cross product matrix, a x b = (a @ _SKEW).reshape(3, 3) @ b
+_SKEW = np.zeros((3, 9))
+_SKEW[2, 1] = _SKEW[1, 6] = _SKEW[0, 5] = -1
+_SKEW[1, 2] = _SKEW[2, 3] = _SKEW[0, 7] = 1
+
+_AXES = {"RX": np.array([1., 0., 0.]), "RY": np.array([0., 1., 0.]), "RZ": np.array([0., 0., 1.])}
+
+
+"""
+Closed-form forward kinematics, frame Jacobians and gravity torques of the
+TriFinger, vectorized over fingers and over a batch of configurations
+
+Each finger is a serial chain of revolute joints. The joint placements, axes
+and frame offsets are read once from the pinocchio model (so they always match
+the URDF in use), after which nothing calls pinocchio. Joint rotations use
+Rodrigues' formula, and Jacobian columns are z_k x (p - p_k) for the joint
+axes z_k and joint origins p_k in the chain, expressed like pinocchio's
+LOCAL_WORLD_ALIGNED frame Jacobians.
+
+robot_model: pinocchio.Model
+tip_link_ids: frame ids of fingertips
+gravity_frame_ids: list, per finger, of frame ids whose masses give gravity torques
+masses: link masses for gravity_frame_ids of each finger
+"""
+class AnalyticKinematics:
+    def __init__(self, robot_model, tip_link_ids, gravity_frame_ids, masses):
+        self.nq = robot_model.nq
+
+        # Joint chains, one per finger, ordered by configuration index of their root
+        roots = [j for j in range(1, robot_model.njoints) if robot_model.parents[j] == 0]
+        roots.sort(key=lambda j: robot_model.joints[j].idx_q)
+        chains = []
+        for root in roots:
+            chain = [root]
+            while True:
+                children = [j for j in range(1, robot_model.njoints) if robot_model.parents[j] == chain[-1]]
+                if not children:
+                    break
+                assert len(children) == 1, "AnalyticKinematics only supports serial chains"
+                chain.append(children[0])
+            chains.append(chain)
+        depth = len(chains[0])
+        assert all(len(chain) == depth for chain in chains), "all fingers must have the same number of joints"
+        self.fnum = len(chains)
+        self.depth = depth
+
+        self.joint_chain_pos = {} # joint id -> (chain index, depth in chain)
+        self.T_pl = np.zeros((self.fnum, depth, 4, 4)) # Joint placements in parent joint frame
+        axes = np.zeros((self.fnum, depth, 3))
+        self.q_index = np.zeros((self.fnum, depth), dtype=int)
+        for f, chain in enumerate(chains):
+            for d, j in enumerate(chain):
+                joint = robot_model.joints[j]
+                shortname = joint.shortname()
+                assert shortname[-2:] in _AXES, "unsupported joint type {}".format(shortname)
+                self.joint_chain_pos[j] = (f, d)
+                self.T_pl[f, d] = robot_model.jointPlacements[j].homogeneous
+                axes[f, d] = _AXES[shortname[-2:]]
+                self.q_index[f, d] = joint.idx_q
+        self.axes = axes[..., None] # Column vectors
+        # Joints are usually numbered finger by finger, then chain arrays reshape
+        # to configuration index order without a gather
+        self.q_ordered = np.array_equal(self.q_index.flatten(), np.arange(self.nq))
+
+        # Rodrigues' formula terms of joint rotations, R(q) = I + sin(q) K + (1 - cos(q)) K^2,
+        # premultiplied by joint placements
+        self.I4 = np.eye(4)
+        K = np.zeros((self.fnum, depth, 4, 4))
+        K[..., 0, 1] = -axes[..., 2]
+        K[..., 0, 2] = axes[..., 1]
+        K[..., 1, 0] = axes[..., 2]
+        K[..., 1, 2] = -axes[..., 0]
+        K[..., 2, 0] = -axes[..., 1]
+        K[..., 2, 1] = axes[..., 0]
+        self.T_pl_K = self.T_pl @ K
+        self.T_pl_KK = self.T_pl @ K @ K
+
+        # Tip and gravity frames are computed together, tips first
+        self.n_tips = len(tip_link_ids)
+        flat_gravity_ids = [i for ids in gravity_frame_ids for i in ids]
+        self.frames = self._get_frame_info(robot_model, list(tip_link_ids) + flat_gravity_ids)
+        self.frames["lin_mask"] = self.frames["mask"].T[:, None, :] # (nq, 1, nFrames)
+        self.frames["tip_mask"] = self.frames["mask"][:self.n_tips, None, :] # (nTips, 1, nq)
+        # Gravity torques of each finger are the mass weighted sum over its frames
+        self.gravity_weights = np.zeros((len(gravity_frame_ids), len(flat_gravity_ids)))
+        i = 0
+        for f, ids in enumerate(gravity_frame_ids):
+            for j in range(len(ids)):
+                self.gravity_weights[f, i] = GRAVITY_SCALE * GRAVITY * masses[j]
+                i += 1
+
+    """
+    Get chain, depth, placement and Jacobian column mask of frames in frame_ids
+    Depth is number of chain joints the frame moves with (0 if attached to universe)
+    """
+    def _get_frame_info(self, robot_model, frame_ids):
+        n = len(frame_ids)
+        info = {
+            "chain": np.zeros(n, dtype=int),
+            "depth": np.zeros(n, dtype=int),
+            "T": np.zeros((n, 4, 4)), # Placement in parent joint frame
+            "mask": np.zeros((n, self.nq)), # 1 for configuration indices of joints frame moves with
+        }
+        for i, frame_id in enumerate(frame_ids):
+            frame = robot_model.frames[frame_id]
+            parent = frame.parentJoint if hasattr(frame, "parentJoint") else frame.parent
+            if parent != 0:
+                f, d = self.joint_chain_pos[parent]
+                info["chain"][i] = f
+                info["depth"][i] = d + 1
+                info["mask"][i, self.q_index[f, :d + 1]] = 1
+            info["T"][i] = frame.placement.homogeneous
+        return info
+
+    """
+    Compute kinematics at joint positions q, (9,) or batch (N, 9)
+    Return dict of arrays, with leading N dimension only if q is a batch:
+    tip_pos:       (N, 3, 3)    fingertip positions
+    tip_R:         (N, 3, 3, 3) fingertip frame orientations
+    tip_jacobians: (N, 3, 6, 9) fingertip Jacobians (LOCAL_WORLD_ALIGNED)
+    g:             (N, 3, 9)    gravity compensation torques for each finger
+    """
+    def compute(self, q):
+        q = np.asarray(q, dtype=float)
+        single = q.ndim == 1
+        Q = q.reshape(-1, self.nq)
+        N = Q.shape[0]
+
+        # Joint placements times joint rotations, (N, fnum, depth, 4, 4)
+        qs = Q[:, self.q_index]
+        s = np.sin(qs)[..., None, None]
+        c = np.cos(qs)[..., None, None]
+        M = self.T_pl + s * self.T_pl_K + (1 - c) * self.T_pl_KK
+
+        # World frame transforms of joints, after joint rotation, index 0 is the universe
+        T = np.empty((N, self.fnum, self.depth + 1, 4, 4))
+        T[:, :, 0] = self.I4
+        T[:, :, 1] = M[:, :, 0]
+        for d in range(1, self.depth):
+            T[:, :, d+1] = T[:, :, d] @ M[:, :, d]
+
+        # Joint axes and origins in configuration index order. Rotating about an
+        # axis leaves it and the origin unchanged, so they are the same after rotation
+        Zq = (T[:, :, 1:, :3, :3] @ self.axes).reshape(N, self.nq, 3)
+        Pq = T[:, :, 1:, :3, 3].reshape(N, self.nq, 3)
+        if not self.q_ordered:
+            Zq[:, self.q_index.flatten()] = Zq.copy()
+            Pq[:, self.q_index.flatten()] = Pq.copy()
+
+        # Frame transforms, (N, nFrames, 4, 4)
+        frames = self.frames
+        T_frame = T[:, frames["chain"], frames["depth"]] @ frames["T"]
+
+        # Linear Jacobian columns z_k x (p - p_k) of all frames, as z_k x p - z_k x p_k,
+        # with one matrix product per configuration, (N, nq, 3, nFrames)
+        S = (Zq @ _SKEW).reshape(N, self.nq * 3, 3) # Stacked cross product matrices of z_k
+        n_frames = T_frame.shape[1]
+        lin = (S @ T_frame[:, :, :3, 3].transpose(0, 2, 1)).reshape(N, self.nq, 3, n_frames)
+        lin -= S.reshape(N, self.nq, 3, 3) @ Pq[..., None]
+        lin *= frames["lin_mask"] # Zero columns of joints a frame does not move with
+
+        # Gravity torques, -m J_v^T g_vec with g_vec = [0, 0, -GRAVITY] only uses
+        # z rows of Jacobians, weights include m * GRAVITY
+        nt = self.n_tips
+        g = (lin[:, :, 2, nt:] @ self.gravity_weights.T).transpose(0, 2, 1)
+
+        # Fingertip Jacobians
+        J = np.empty((N, nt, 6, self.nq))
+        J[:, :, 0:3] = lin[..., :nt].transpose(0, 3, 2, 1)
+        J[:, :, 3:6] = Zq.transpose(0, 2, 1)[:, None] * frames["tip_mask"]
+
+        result = {
+            "tip_pos": T_frame[:, :nt, :3, 3],
+            "tip_R": T_frame[:, :nt, :3, :3],
+            "tip_jacobians": J,
+            "g": g,
+        }
+        if single:
+            result = {k: v[0] for k, v in result.items()}
+        return result
@@ -0,0 +1,142 @@
+"""
+Implements AsyncPlanner class, which runs ImpedanceControllerPolicy trajectory
+planning in a background worker process so the control loop never waits on IPOPT
+"""
+
+import multiprocessing
+import time
+import traceback
+
+from rrc_iprl_package.logging_utils import get_logger
+
+logger = get_logger("control.async_planner")
+
+
+"""
+Plan trajectories in a worker process
+
+The worker builds its own planning copy of the policy with make_policy(),
+including its own traj opt solvers, and keeps it across requests. A request is
+an observation plus a snapshot of the policy attributes in state_attrs. When
+done, the worker sends back the policy attributes in result_attrs, which the
+control loop swaps in with poll(). The worker is a process and not a thread,
+because the IPOPT solve holds the GIL.
+
+The worker is started with forkserver rather than forked from the control
+process, which already runs logging and log writer threads by then: a lock
+held by one of them at fork time could deadlock the child. make_policy must
+therefore be picklable.
+
+After a failed request, the next request is refused for RETRY_DELAY seconds,
+doubled on each failure in a row up to MAX_RETRY_DELAY.
+"""
+class AsyncPlanner:
+    RETRY_DELAY = 0.1
+    MAX_RETRY_DELAY = 5.0
+
+    def __init__(self, make_policy, state_attrs, result_attrs):
+        self.state_attrs = list(state_attrs)
+        self.result_attrs = list(result_attrs)
+        self.busy = False # True while the last request is being planned
+        self.failures = 0 # Failed requests in a row
+        self._request_id = 0
+        self._retry_time = 0
+
+        ctx = multiprocessing.get_context("forkserver")
+        self._conn, child_conn = ctx.Pipe()
+        self._process = ctx.Process(target=_worker_loop,
+                                    args=(make_policy, child_conn, self.result_attrs),
+                                    daemon=True)
+        self._process.start()
+        child_conn.close()
+
+    """
+    Send planning request with current state of policy
+    Return False, without sending, if the previous request is still being
+    planned, or if retrying too soon after a failure
+    """
+    def request(self, policy, observation):
+        if self.busy or time.monotonic() < self._retry_time:
+            return False
+        self._request_id += 1
+        state = {k: getattr(policy, k, None) for k in self.state_attrs}
+        self._conn.send((self._request_id, observation, state))
+        self.busy = True
+        return True
+
+    """
+    Drop the request being planned, if any, e.g. at the start of a new episode
+    """
+    def cancel(self):
+        self.busy = False
+        self.failures = 0
+        self._retry_time = 0
+
+    """
+    Get dict of planned attributes of finished request, or None if not finished
+    Never blocks on planning
+    """
+    def poll(self):
+        while self._conn.poll():
+            request_id, result = self._conn.recv()
+            # Results of cancelled requests are dropped
+            if request_id != self._request_id or not self.busy:
+                continue
+            self.busy = False
+            if "error" in result:
+                self.failures += 1
+                delay = min(self.RETRY_DELAY * 2 ** (self.failures - 1), self.MAX_RETRY_DELAY)
+                self._retry_time = time.monotonic() + delay
+                if self.failures == 1:
+                    logger.warning("AsyncPlanner: planning failed, retrying in %.1f s\n%s",
+                                   delay, result["error"])
+                else:
+                    logger.warning("AsyncPlanner: planning failed %d times in a row, retrying in %.1f s",
+                                   self.failures, delay)
+                return None
+            self.failures = 0
+            return result
+        return None
+
+    def close(self):
+        if self._process.is_alive():
+            try:
+                self._conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+            self._process.join(timeout=1)
+            if self._process.is_alive():
+                self._process.terminate()
+        self._conn.close()
+
+
+def _worker_loop(make_policy, conn, result_attrs):
+    # Report failure to build the policy as failure of every request
+    policy = None
+    init_error = None
+    try:
+        policy = make_policy()
+    except Exception:
+        init_error = traceback.format_exc()
+
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            break
+        if request is None:
+            break
+
+        request_id, observation, state = request
+        if init_error is not None:
+            conn.send((request_id, {"error": init_error}))
+            continue
+        try:
+            for k, v in state.items():
+                setattr(policy, k, v)
+            policy.plan_trajectory(observation)
+            result = {k: getattr(policy, k, None) for k in result_attrs}
+        except Exception:
+            result = {"error": traceback.format_exc()}
+        conn.send((request_id, result))
+    conn.close()
@@ -0,0 +1,112 @@
+"""
+Implements ColumnLog class, a columnar log with fixed schema that writes each
+channel through a preallocated chunk buffer to its own raw binary file, and
+load_column_log to read it back
+"""
+
+import json
+import os
+import os.path as osp
+
+import numpy as np
+
+SCHEMA_FILENAME = "schema.json"
+
+
+"""
+Columnar log stored in directory path
+
+schema: dict of channel name -> (row shape, dtype)
+
+Each channel has its own preallocated buffer of chunk_rows rows and its own row
+count, so channels can be appended at different rates. When a buffer is full,
+it is appended to <path>/<name>.bin and reused, so memory stays bounded by
+chunk_rows and flush() only writes the rows since the last flush.
+"""
+class ColumnLog:
+    def __init__(self, path, schema, chunk_rows=1024):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.columns = {name: _Column(osp.join(path, "{}.bin".format(name)), shape, dtype, chunk_rows)
+                        for name, (shape, dtype) in schema.items()}
+
+        with open(osp.join(path, SCHEMA_FILENAME), "w") as f:
+            json.dump({name: {"shape": list(c.buf.shape[1:]), "dtype": c.buf.dtype.str}
+                       for name, c in self.columns.items()}, f, indent=2)
+
+    """
+    Append value as the next row of channel name
+    """
+    def append(self, name, value):
+        self.columns[name].append(value)
+
+    """
+    Number of rows logged to channel name
+    """
+    def rows(self, name):
+        c = self.columns[name]
+        return c.rows + c.n
+
+    """
+    Write buffered rows of all channels to disk
+    """
+    def flush(self):
+        for c in self.columns.values():
+            c.flush()
+
+    def close(self):
+        for c in self.columns.values():
+            c.close()
+
+
+class _Column:
+    def __init__(self, filepath, shape, dtype, chunk_rows):
+        self.buf = np.empty((chunk_rows,) + tuple(shape), dtype=dtype)
+        self.n = 0 # Rows in buffer
+        self.rows = 0 # Rows written to file
+        # Unbuffered, so a forked process never writes out a copy of pending data
+        self.f = open(filepath, "wb", buffering=0)
+
+    def append(self, value):
+        self.buf[self.n] = value
+        self.n += 1
+        if self.n == self.buf.shape[0]:
+            self.flush()
+
+    def flush(self):
+        if self.n == 0 or self.f.closed:
+            return
+        self.f.write(self.buf[:self.n].tobytes())
+        self.rows += self.n
+        self.n = 0
+
+    def close(self):
+        self.flush()
+        self.f.close()
+
+
+"""
+Load log written by ColumnLog as dict of channel name -> read-only array
+Arrays are memory mapped, so only the parts that are used are read from disk.
+Also loads logs saved as a single npz file.
+"""
+def load_column_log(path):
+    if not osp.isdir(path):
+        return dict(np.load(path))
+
+    with open(osp.join(path, SCHEMA_FILENAME), "r") as f:
+        schema = json.load(f)
+
+    data = {}
+    for name, info in schema.items():
+        shape = tuple(info["shape"])
+        dtype = np.dtype(info["dtype"])
+        filepath = osp.join(path, "{}.bin".format(name))
+        row_bytes = dtype.itemsize * int(np.prod(shape))
+        # Ignore a partially written last row
+        rows = osp.getsize(filepath) // row_bytes
+        if rows == 0:
+            data[name] = np.empty((0,) + shape, dtype=dtype)
+        else:
+            data[name] = np.memmap(filepath, dtype=dtype, mode="r", shape=(rows,) + shape)
+    return data
@@ -6,28 +6,49 @@ with Gym environment
 import os
 import os.path as osp
 import numpy as np
-import joblib
 import enum
-import copy
+import functools
 import time
-from scipy.interpolate import interp1d
-from scipy.spatial.transform import Rotation
-import csv
-
 import datetime
+
 from trifinger_simulation import TriFingerPlatform
 from trifinger_simulation.tasks import move_cube
-from trifinger_simulation import pinocchio_utils
-from trifinger_simulation import visual_objects
 
+from rrc_iprl_package.control.async_planner import AsyncPlanner
+from rrc_iprl_package.control.column_log import ColumnLog
 from rrc_iprl_package.control.custom_pinocchio_utils import CustomPinocchioUtils
+from rrc_iprl_package.control.object_state_estimator import ObjectStateEstimator
+from rrc_iprl_package.control.trajectory import Trajectory
 from rrc_iprl_package.control import controller_utils as c_utils
+from rrc_iprl_package.control import timing
 from rrc_iprl_package.control.controller_utils import PolicyMode
-
-try:
-    import torch
-except ImportError:
-    torch = None
+from rrc_iprl_package.logging_utils import get_logger
+
+# RL stack (torch, joblib, stable_baselines) is imported in load_policy(), only
+# if HierarchicalControllerPolicy is given a load_dir
+
+logger = get_logger("control.control_policy")
+
+
+# Channels of control policy log: (row shape, dtype)
+# Rows correspond to step_count / timestamp, except for debugging channels
+CONTROL_POLICY_LOG_SCHEMA = {
+    "step_count":             ((), np.int64),
+    "timestamp":              ((), np.float64),
+    "desired_ft_pos":         ((9,), np.float32), # fingertip positions - desired
+    "desired_ft_vel":         ((9,), np.float32), # fingertip velocities - desired
+    "actual_ft_pos":          ((9,), np.float32), # fingertip positions - actual (computed from observation)
+    "desired_obj_pose":       ((7,), np.float32), # object pose - desired
+    "desired_obj_vel":        ((6,), np.float32), # object velocity - desired
+    "observed_obj_pose":      ((7,), np.float32), # object pose - observed
+    "observed_filt_obj_pose": ((7,), np.float32), # object pose - observed, filtered
+    "observed_obj_vel":       ((6,), np.float32), # object velocity - observed
+    "desired_ft_force":       ((9,), np.float32), # fingertip forces - desired
+    "desired_torque":         ((9,), np.float32),
+    # Debugging object pose feedback controller
+    "dquat":                  ((4,), np.float32), # quaternion derivatives
+    "desired_obj_w":          ((6,), np.float32),
+}
 
 
 class TrajMode(enum.Enum):
@@ -39,6 +60,24 @@ class TrajMode(enum.Enum):
 
 class ImpedanceControllerPolicy:
     USE_FILTERED_POSE = True
+    WARM_START_TRAJ_OPT = False # Warm start finger traj opt re-solves from previous solution, no fewer iterations so far
+    CODEGEN_TRAJ_OPT = False # Use traj opt NLP functions compiled to C, cached on disk
+    ASYNC_PLANNING = True # Replan in background process, holding last waypoint until done
+    KINEMATICS_BACKEND = "pinocchio" # "pinocchio" or "analytic", see CustomPinocchioUtils
+
+    # Policy state sent to async planner, and planned attributes swapped in when done
+    PLAN_STATE_ATTRS = ["mode", "goal_pose", "difficulty", "filtered_obj_pose", "cp_params",
+                        "step_count", "traj_start_time", "use_wall_clock",
+                        "grasp_trajopt_filepath", "lift_trajopt_filepath"]
+    PLAN_RESULT_ATTRS = ["mode", "cp_params", "traj", "x_soln", "dx_soln"]
+
+    CONTROL_DT = 0.001 # Robot control period, seconds, used as clock in simulation
+
+    # Deadline-aware degradation of predict(), counted in timing.TIMER.counts
+    DEADLINE_AWARE = True
+    TICK_BUDGET = 0.001 # Time budget of one predict() call, seconds
+    FT_FORCES_RESERVE = 0.0004 # Reuse previous forces if less time than this is left before get_ft_forces
+    LOG_RESERVE = 0.0001 # Skip log write if less time than this is left
 
     KP = [300, 300, 400,
           300, 300, 400,
@@ -82,6 +121,10 @@ class ImpedanceControllerPolicy:
         self.init_face = None
         self.goal_face = None
         self.platform = None
+        self.async_planner = None
+        # Trajectories are tracked in wall clock time on the real robot, and in
+        # simulated time (step_count * CONTROL_DT) in simulation
+        self.use_wall_clock = osp.exists("/output")
         print("USE_FILTERED_POSE: {}".format(self.USE_FILTERED_POSE))
         print("KP: {}".format(self.KP))
         print("KV: {}".format(self.KV))
@@ -99,6 +142,7 @@ class ImpedanceControllerPolicy:
             self.grasp_trajopt_filepath = "/output/grasp_trajopt_data"
             self.lift_trajopt_filepath  = "/output/lift_trajopt_data"
             self.control_policy_log_filepath = "/output/control_policy_log"
+            self.timing_filepath        = "/output/control_policy_timing.json"
         else:
             time_str = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
             if not osp.exists("./output/{}".format(time_str)):
@@ -107,85 +151,88 @@ class ImpedanceControllerPolicy:
             self.grasp_trajopt_filepath = "./output/{}/grasp_trajopt_data".format(time_str)
             self.lift_trajopt_filepath  = "./output/{}/lift_trajopt_data".format(time_str)
             self.control_policy_log_filepath = "./output/{}/control_policy_log".format(time_str)
+            self.timing_filepath        = "./output/{}/control_policy_timing.json".format(time_str)
 
-        # Lists for logging data
-        # Rows correspond to step_count / timestamp
-        self.l_step_count       = [] # step_count
-        self.l_timestamp        = [] # time
-        self.l_desired_ft_pos   = [] # fingertip positions - desired
-        self.l_actual_ft_pos    = [] # fingertip positions - actual (computed from observation)
-        self.l_desired_ft_vel   = [] # fingertip velocities - desired
-        self.l_desired_obj_pose = [] # object position - desired
-        self.l_desired_obj_vel = [] # object position - desired
-        self.l_observed_obj_pose = [] # object position - observed
-        self.l_observed_filt_obj_pose = [] # object position - observed
-        self.l_observed_obj_vel = [] # object velocity - observed
-        self.l_desired_ft_force = [] # fingerip forces - desired
-        self.l_desired_torque = []
-
-        # Logs for debugging object pose feedback controller
+        # Columnar log, flushed to control_policy_log_filepath directory in chunks
+        # Read with column_log.load_column_log()
+        self.log = ColumnLog(self.control_policy_log_filepath, CONTROL_POLICY_LOG_SCHEMA)
+
+        # Log channels for debugging object pose feedback controller
         self.DEBUG = True
-        self.l_dquat = [] # quaternion derivatives
-        self.l_desired_obj_w = []
 
     """
-    Store logs in npz file
+    Write logged rows not yet flushed to disk, and control loop timing summary if enabled
     """
     def save_log(self):
-        np.savez(self.control_policy_log_filepath,
-                 step_count       = np.asarray(self.l_step_count),
-                 timestamp        = np.asarray(self.l_timestamp),
-                 desired_ft_pos   = np.asarray(self.l_desired_ft_pos),
-                 desired_ft_vel   = np.asarray(self.l_desired_ft_vel),
-                 actual_ft_pos    = np.asarray(self.l_actual_ft_pos),
-                 desired_obj_pose = np.squeeze(np.asarray(self.l_desired_obj_pose)),
-                 desired_obj_vel = np.squeeze(np.asarray(self.l_desired_obj_vel)),
-                 observed_obj_pose = np.squeeze(np.asarray(self.l_observed_obj_pose)),
-                 observed_filt_obj_pose = np.squeeze(np.asarray(self.l_observed_filt_obj_pose)),
-                 observed_obj_vel = np.squeeze(np.asarray(self.l_observed_obj_vel)),
-                 desired_ft_force = np.squeeze(np.asarray(self.l_desired_ft_force)),
-                 desired_torque   = np.squeeze(np.asarray(self.l_desired_torque)),
-                 dquat            = np.squeeze(np.asarray(self.l_dquat)),
-                 desired_obj_w    = np.squeeze(np.asarray(self.l_desired_obj_w)),
-                )
+        self.log.flush()
+        timing.TIMER.write_summary(self.timing_filepath)
 
-    def reset_policy(self, observation, platform=None):
-        if platform:
-            self.platform = platform
+    """
+    Stop the async planner worker, if any
+    A later reset_policy() starts a new one
+    """
+    def close(self):
+        if self.async_planner is not None:
+            self.async_planner.close()
+            self.async_planner = None
+
+    """
+    Set up kinematics and finger traj opt, which plan_trajectory() needs
+    """
+    def init_planning(self, finger_urdf_path, tip_link_names):
         self.custom_pinocchio_utils = CustomPinocchioUtils(
-                self.platform.simfinger.finger_urdf_path,
-                self.platform.simfinger.tip_link_names)
+                finger_urdf_path,
+                tip_link_names,
+                backend=self.KINEMATICS_BACKEND)
 
         # Define nlp for finger traj opt
         nGrid = 40
         dt = 0.04
-        self.finger_nlp = c_utils.define_static_object_opt(nGrid, dt)
+        self.finger_nlp = c_utils.define_static_object_opt(nGrid, dt,
+                warm_start=self.WARM_START_TRAJ_OPT, codegen=self.CODEGEN_TRAJ_OPT)
+
+    def reset_policy(self, observation, platform=None):
+        if platform:
+            self.platform = platform
+        self.init_planning(self.platform.simfinger.finger_urdf_path,
+                           self.platform.simfinger.tip_link_names)
+
+        # Impedance controller for all fingers, gains updated in predict()
+        self.impedance_ctrl = c_utils.ImpedanceController(self.KP, self.KV)
 
         init_position = np.array([0.0, 0.9, -1.7, 0.0, 0.9, -1.7, 0.0, 0.9, -1.7])
         self.init_ft_pos = self.get_fingertip_pos_wf(init_position)
         self.init_ft_pos = np.asarray(self.init_ft_pos).flatten()
 
-        # Previous object pose and time (for estimating object velocity)
-        self.prev_obj_pose = get_pose_from_observation(observation)
-        if osp.exists("/output"):
-            self.prev_step_time = observation["cam0_timestamp"]
-        else:
-            self.prev_step_time = observation["cam0_timestamp"] / 1000
-        self.prev_vel = np.zeros(6)
-        self.filt_vel = np.zeros(6)
+        # Counters
+        self.step_count = 0 # Number of times predict() is called
 
-        self.filtered_obj_pose = get_pose_from_observation(observation)
+        # Object pose and velocity estimate, corrected at each new camera frame
+        self.obj_estimator = ObjectStateEstimator(get_pose_from_observation(observation),
+                                                  self.get_cam_timestamp(observation),
+                                                  self.get_time())
+        self.filtered_obj_pose = self.obj_estimator.pose
 
-        self.ft_pos_traj = np.tile(self.init_ft_pos, (10000,1))
-        self.ft_vel_traj = np.zeros((10000,9))
-        self.l_wf_traj = None
-        self.x_traj = None
-        self.dx_traj = None
+        self.traj = Trajectory.hold(self.init_ft_pos)
+        self.traj_start_time = self.get_time()
         self.mode = TrajMode.RESET
         self.plan_trajectory(observation)
 
-        # Counters
-        self.step_count = 0 # Number of times predict() is called
+        # Planner worker is started once, and kept across episodes
+        self.waiting_for_plan = False
+        if self.async_planner is not None:
+            self.async_planner.cancel()
+        elif self.ASYNC_PLANNING:
+            make_policy = functools.partial(make_planning_policy, type(self),
+                                            self.platform.simfinger.finger_urdf_path,
+                                            self.platform.simfinger.tip_link_names)
+            self.async_planner = AsyncPlanner(make_policy, self.PLAN_STATE_ATTRS, self.PLAN_RESULT_ATTRS)
+
+        # Control loop timing is summarized per episode
+        timing.TIMER.reset()
+        self.tick_start = time.perf_counter()
+        self.prev_tick_overran = False
+        self.prev_ft_des_force_wf = None
 
     def set_init_goal(self, initial_pose, goal_pose, flip=False):
         self.goal_pose = goal_pose
@@ -211,7 +258,6 @@ class ImpedanceControllerPolicy:
     Run trajectory optimization to move object given fixed contact points
     """
     def set_traj_lift_object(self, observation, nGrid = 50, dt = 0.01):
-        self.traj_waypoint_counter = 0
         qnum = 3
 
         # Get object pose
@@ -230,10 +276,10 @@ class ImpedanceControllerPolicy:
         if self.difficulty == 4:
             x_goal[0, -4:] = self.goal_pose.orientation
 
-        print("Object pose position: {}".format(obj_pose.position))
-        print("Object pose orientation: {}".format(obj_pose.orientation))
-        print("Traj lift x0: {}".format(repr(x0)))
-        print("Traj lift x_goal: {}".format(repr(x_goal)))
+        logger.debug("Object pose position: %s", obj_pose.position)
+        logger.debug("Object pose orientation: %s", obj_pose.orientation)
+        logger.debug("Traj lift x0: %r", x0)
+        logger.debug("Traj lift x_goal: %r", x_goal)
 
         # Get current joint positions
         current_position, _ = get_robot_position_velocity(observation)
@@ -242,74 +288,38 @@ class ImpedanceControllerPolicy:
 
         self.x_soln, self.dx_soln, l_wf_soln = c_utils.run_fixed_cp_traj_opt(
                 obj_pose, self.cp_params, current_position, self.custom_pinocchio_utils,
-                x0, x_goal, nGrid, dt, npz_filepath = self.lift_trajopt_filepath)
-
-        ft_pos = np.zeros((nGrid, 9))
-        ft_vel = np.zeros((nGrid, 9))
+                x0, x_goal, nGrid, dt, npz_filepath = self.lift_trajopt_filepath,
+                codegen = self.CODEGEN_TRAJ_OPT)
 
         free_finger_id = None
         for i, cp in enumerate(self.cp_params):
             if cp is None:
                 free_finger_id = i
                 break
+        obj_finger_ids = [f_i for f_i in range(3) if f_i != free_finger_id]
 
-        for t_i in range(nGrid):
-            # Set fingertip goal positions and velocities from x_soln, dx_soln
-            next_cube_pos_wf = self.x_soln[t_i, 0:3]
-            next_cube_quat_wf = self.x_soln[t_i, 3:]
-
-            ft_pos_list = c_utils.get_cp_pos_wf_from_cp_params(
-                    self.cp_params, next_cube_pos_wf, next_cube_quat_wf)
+        # Fingertips follow contact points, and object velocity, along x_soln, dx_soln
+        ft_pos = c_utils.get_cp_pos_wf_from_cp_params_batch(self.cp_params, self.x_soln)
+        ft_vel = np.tile(self.dx_soln[:, None, 0:3], (1, 3, 1))
 
-            # Hold free_finger at current ft position
-            if free_finger_id is not None:
-                ft_pos_list[free_finger_id] = current_ft_pos[free_finger_id]
-            ft_pos[t_i, :] = np.asarray(ft_pos_list).flatten()
-
-            # Fingertip velocities
-            ft_vel_arr = np.tile(self.dx_soln[t_i, 0:3], 3)
-            if free_finger_id is not None:
-                ft_vel_arr[free_finger_id * qnum : free_finger_id * qnum + qnum] = np.zeros(qnum)
-            ft_vel[t_i, :] = ft_vel_arr
+        # Hold free_finger at current ft position
+        if free_finger_id is not None:
+            ft_pos[:, free_finger_id] = current_ft_pos[free_finger_id]
+            ft_vel[:, free_finger_id] = 0
 
         # Add 0 forces for free_fingertip to l_wf
-        l_wf = np.zeros((nGrid, 9))
-        i = 0
-        for f_i in range(3):
-            if f_i == free_finger_id: continue
-            l_wf[:,f_i * qnum : f_i * qnum + qnum] = l_wf_soln[:, i * qnum : i * qnum + qnum]
-            i += 1
-
-        # Number of interpolation points
-        interp_n = 26
-
-        # Linearly interpolate between each position waypoint (row) and force waypoint
-        # Initial row indices
-        row_ind_in = np.arange(nGrid)
-        # Output row coordinates
-        row_coord_out = np.linspace(0, nGrid - 1, interp_n * (nGrid-1) + nGrid)
-        # scipy.interpolate.interp1d instance
-        itp_pos = interp1d(row_ind_in, ft_pos, axis=0)
-        #itp_vel = interp1d(row_ind_in, ft_vel, axis=0)
-        itp_lwf = interp1d(row_ind_in, l_wf, axis=0)
-        self.ft_pos_traj = itp_pos(row_coord_out)
-        #self.ft_vel_traj = itp_vel(row_coord_out)
-        self.l_wf_traj = itp_lwf(row_coord_out)
-
-        # Linearly interpolate between each object pose
-        # TODO: Does it make sense to linearly interpolate quaternions?
-        itp_x_soln = interp1d(row_ind_in, self.x_soln, axis=0)
-        self.x_traj = itp_x_soln(row_coord_out)
-
-        # Zero-order hold for velocity waypoints
-        self.ft_vel_traj = np.repeat(ft_vel, repeats=interp_n+1, axis=0)[:-interp_n, :]
-        self.dx_traj = np.repeat(self.dx_soln, repeats=interp_n+1, axis=0)[:-interp_n, :]
+        l_wf = np.zeros((nGrid, 3, qnum))
+        l_wf[:, obj_finger_ids] = l_wf_soln.reshape(nGrid, -1, qnum)
+
+        ft_pos = ft_pos.reshape(nGrid, 9)
+        ft_vel = ft_vel.reshape(nGrid, 9)
+        l_wf = l_wf.reshape(nGrid, 9)
+        self.traj = Trajectory(dt, ft_pos, ft_vel, x=self.x_soln, dx=self.dx_soln, l_wf=l_wf)
 
     """
     Run trajectory optimization to move fingers to contact points on object
     """
     def set_traj_to_object(self, observation):
-        self.traj_waypoint_counter = 0
         # First, set cp_params based on mode
         self.set_cp_params(observation)
 
@@ -335,16 +345,12 @@ class ImpedanceControllerPolicy:
                 cp_wf_list[i] = current_ft_pos[i]
 
         ft_goal = np.asarray(cp_wf_list).flatten()
-        self.ft_pos_traj, self.ft_vel_traj = self.run_finger_traj_opt(current_position, obj_pose, ft_goal)
-        self.l_wf_traj = None
-        self.x_traj = None
-        self.dx_traj = None
+        self.traj = self.run_finger_traj_opt(current_position, obj_pose, ft_goal)
 
     """
     Run traj opt to lower fingers to ground level
     """
     def set_traj_lower_finger(self, observation):
-        self.traj_waypoint_counter = 0
         # First, set cp_params based on mode
         self.set_cp_params(observation)
 
@@ -362,10 +368,7 @@ class ImpedanceControllerPolicy:
 
         ft_goal = c_utils.get_pre_grasp_ft_goal(obj_pose, current_ft_pos, self.cp_params)
 
-        self.ft_pos_traj, self.ft_vel_traj = self.run_finger_traj_opt(current_position, obj_pose, ft_goal)
-        self.l_wf_traj = None
-        self.x_traj = None
-        self.dx_traj = None
+        self.traj = self.run_finger_traj_opt(current_position, obj_pose, ft_goal)
 
     """
     Run trajectory optimization for fingers, given fingertip goal positions
@@ -373,64 +376,40 @@ class ImpedanceControllerPolicy:
     """
     def run_finger_traj_opt(self, current_position, obj_pose, ft_goal):
         nGrid = self.finger_nlp.nGrid
-        self.traj_waypoint_counter = 0
-
-        ft_pos, ft_vel = c_utils.get_finger_waypoints(self.finger_nlp, ft_goal, current_position, obj_pose, npz_filepath = self.grasp_trajopt_filepath)
-
-        print("FT_GOAL: {}".format(ft_goal))
-        print(ft_pos[-1,:])
-
-        # Number of interpolation points
-        interp_n = 26
 
-        # Linearly interpolate between each waypoint (row)
-        # Initial row indices
-        row_ind_in = np.arange(nGrid)
-        # Output row coordinates
-        row_coord_out = np.linspace(0, nGrid - 1, interp_n * (nGrid-1) + nGrid)
-        # scipy.interpolate.interp1d instance
-        itp_pos = interp1d(row_ind_in, ft_pos, axis=0)
-        #itp_vel = interp1d(row_ind_in, ft_vel, axis=0)
-        ft_pos_traj = itp_pos(row_coord_out)
+        # Shift the warm start by the knots of the current trajectory executed so far
+        elapsed = self.get_time() - self.traj_start_time
+        n_shift = min(max(int(round(elapsed / self.finger_nlp.dt)), 0), nGrid - 1)
+        ft_pos, ft_vel = c_utils.get_finger_waypoints(self.finger_nlp, ft_goal, current_position, obj_pose,
+                npz_filepath = self.grasp_trajopt_filepath, n_shift = n_shift)
 
-        # Zero-order hold for velocity waypoints
-        ft_vel_traj = np.repeat(ft_vel, repeats=interp_n+1, axis=0)[:-interp_n, :]
+        logger.debug("FT_GOAL: %s, planned final ft pos: %s", ft_goal, ft_pos[-1,:])
 
-        return ft_pos_traj, ft_vel_traj
+        return Trajectory(self.finger_nlp.dt, ft_pos, ft_vel)
 
     def log_to_buffers(self, ft_pos_goal_list, ft_vel_goal_list,
                        cur_ft_pos, obj_pose, obj_vel, torque,
-                       ft_des_force_wf=None):
+                       ft_des_force_wf=None, x_des=None, dx_des=None):
         # LOGGING
-        self.l_step_count.append(self.step_count)
-        self.l_timestamp.append(time.time())
-        self.l_desired_ft_pos.append(np.asarray(ft_pos_goal_list).flatten())
-        self.l_desired_ft_vel.append(np.asarray(ft_vel_goal_list).flatten())
-        self.l_actual_ft_pos.append(cur_ft_pos)
-        self.l_observed_obj_pose.append(np.concatenate((obj_pose.position,obj_pose.orientation)))
-        self.l_observed_filt_obj_pose.append(np.concatenate((self.filtered_obj_pose.position,self.filtered_obj_pose.orientation)))
-        self.l_observed_obj_vel.append(obj_vel)
-        self.l_desired_torque.append(np.asarray(torque))
-
-        if self.x_traj is None:
-            # Nan if there is no obj traj (during grasping)
-            self.l_desired_obj_pose.append(np.ones(7) * np.nan)
-        else:
-            self.l_desired_obj_pose.append(self.x_traj[self.traj_waypoint_counter, :])
-        if self.dx_traj is None:
-            # Nan if there is no obj traj (during grasping)
-            self.l_desired_obj_vel.append(np.ones(6) * np.nan)
-        else:
-            self.l_desired_obj_vel.append(self.dx_traj[self.traj_waypoint_counter, :])
-        if ft_des_force_wf is None:
-            # Nan if no desired ft forces (during grasping)
-            self.l_desired_ft_force.append(np.ones(9) * np.nan)
-        else:
-            self.l_desired_ft_force.append(ft_des_force_wf)
+        log = self.log
+        log.append("step_count", self.step_count)
+        log.append("timestamp", time.time())
+        log.append("desired_ft_pos", np.reshape(ft_pos_goal_list, 9))
+        log.append("desired_ft_vel", np.reshape(ft_vel_goal_list, 9))
+        log.append("actual_ft_pos", cur_ft_pos)
+        log.append("observed_obj_pose", np.concatenate((obj_pose.position,obj_pose.orientation)))
+        log.append("observed_filt_obj_pose", np.concatenate((self.filtered_obj_pose.position,self.filtered_obj_pose.orientation)))
+        log.append("observed_obj_vel", obj_vel)
+        log.append("desired_torque", torque)
+
+        # Nan if there is no obj traj or desired ft forces (during grasping)
+        log.append("desired_obj_pose", np.nan if x_des is None else x_des)
+        log.append("desired_obj_vel", np.nan if dx_des is None else dx_des)
+        log.append("desired_ft_force", np.nan if ft_des_force_wf is None else ft_des_force_wf)
         return
 
     """
-    Replans trajectory according to TrajMode, and sets self.traj_waypoint_counter
+    Replans trajectory according to TrajMode, and starts it at the current time
     """
     def plan_trajectory(self, observation):
         if self.mode == TrajMode.RESET:
@@ -443,75 +422,112 @@ class ImpedanceControllerPolicy:
             self.set_traj_lift_object(observation, nGrid=50, dt=0.08)
             self.mode = TrajMode.REPOSE
         elif self.mode == TrajMode.REPOSE:
-            print("ERROR: should not reach this case")
+            logger.error("plan_trajectory: no trajectory to plan in REPOSE mode")
 
-        self.traj_waypoint_counter = 0
+        self.traj_start_time = self.get_time()
         return
 
-    # TODO: What about when object observations are noisy???
-    def get_obj_vel(self, cur_obj_pose, cur_step_time):
-        dt = cur_step_time - self.prev_step_time
-
-        if dt == 0:
-            return self.filt_vel
-
-        obj_vel_position = (cur_obj_pose.position - self.prev_obj_pose.position) / dt
-
-        # TODO: verify that we are getting angular velocities from quaternions correctly
-        #cur_R = Rotation.from_quat(cur_obj_pose.orientation)
-        #prev_R = Rotation.from_quat(self.prev_obj_pose.orientation)
-        #delta_R = cur_R * prev_R.inv()
-        #obj_vel_quat = delta_R.as_quat() / dt
-        obj_vel_quat = (cur_obj_pose.orientation - self.prev_obj_pose.orientation) / dt
-        M = c_utils.get_dquat_to_dtheta_matrix(self.prev_obj_pose.orientation) # from Paul Mitiguy dynamics notes
-        obj_vel_theta = 2 * M @ obj_vel_quat
-        #obj_vel_theta = np.zeros(obj_vel_theta.shape)
-
-        cur_vel = np.concatenate((obj_vel_position, obj_vel_theta))
+    """
+    Get current time in seconds, for indexing trajectories
+    """
+    def get_time(self):
+        if self.use_wall_clock:
+            return time.monotonic()
+        return self.step_count * self.CONTROL_DT
 
-        # Set previous obj_pose and step_time to current values
-        self.prev_obj_pose = cur_obj_pose
-        self.prev_step_time = cur_step_time
-        self.prev_vel = cur_vel
+    """
+    Request new plan from async planner, and hold last waypoint until it is done
+    """
+    def request_async_plan(self, observation):
+        self.async_planner.request(self, observation)
+        self.waiting_for_plan = True
 
-        # filter the velocity
-        theta = 0.1
-        filt_vel = (1-theta) * self.filt_vel + theta * cur_vel
-        self.filt_vel = filt_vel.copy()
+    """
+    Swap in trajectory from async planner if it is done
+    Re-request if the previous request failed, once the planner accepts retries
+    """
+    def update_async_plan(self, observation):
+        result = self.async_planner.poll()
+        if result is not None:
+            for k, v in result.items():
+                setattr(self, k, v)
+            self.traj_start_time = self.get_time()
+            self.waiting_for_plan = False
+        elif self.waiting_for_plan and not self.async_planner.busy:
+            self.async_planner.request(self, observation)
 
-        # Log obj_vel_quat for debugging
-        if self.DEBUG:
-            self.l_dquat.append(obj_vel_quat)
+    """
+    Get camera timestamp of observation in seconds, on the real robot and in simulation
+    """
+    def get_cam_timestamp(self, observation):
+        return observation["cam0_timestamp"]
 
-        return filt_vel
-        return cur_vel
+    """
+    Get time left in the budget of current predict() call, seconds
+    """
+    def get_tick_time_left(self):
+        return self.TICK_BUDGET - (time.perf_counter() - self.tick_start)
 
     def predict(self, full_observation):
+        timer = timing.TIMER
+        t_predict = timer.start()
+        self.tick_start = time.perf_counter()
+        # If the previous tick overran, this one started late
+        degrade = self.DEADLINE_AWARE and self.prev_tick_overran
         self.step_count += 1
         observation = full_observation['observation']
         current_position, current_velocity = observation['position'], observation['velocity']
 
         # Get object pose
+        t = timer.start()
         obj_pose = get_pose_from_observation(full_observation)
-        # Filter object pose
-        self.set_filtered_pose_from_observation(full_observation)
 
-        # Estimate object velocity based on previous and current object pose
-        # TODO: this might cause an issue if observed object poses are the same across steps?
-        if osp.exists("/output"):
-            timestamp = full_observation["cam0_timestamp"]
-        else:
-            timestamp = full_observation["cam0_timestamp"] / 1000
-        print("Cam0_timestamp: {}".format(timestamp))
-        obj_vel = self.get_obj_vel(self.filtered_obj_pose, timestamp)
+        # Update filtered object pose and velocity estimate
+        # Corrected only when a new camera frame arrives, else propagated
+        # When degraded, defer correction to the next tick, which sees the same frame
+        timestamp = self.get_cam_timestamp(full_observation)
+        new_frame = self.obj_estimator.update(obj_pose, timestamp, self.get_time(),
+                                              correct=not degrade)
+        if degrade and timestamp > self.obj_estimator.frame_timestamp:
+            timer.count("degrade_defer_estimate")
+        if new_frame:
+            logger.debug("Cam0_timestamp: %s", timestamp)
+            if self.DEBUG:
+                self.log.append("dquat", self.obj_estimator.get_dquat())
+        self.filtered_obj_pose = self.obj_estimator.pose
+        obj_vel = self.obj_estimator.twist
+        timer.stop("obj_estimate", t)
 
         # Get current fingertip position
+        t = timer.start()
         cur_ft_pos = self.get_fingertip_pos_wf(current_position)
         cur_ft_pos = np.asarray(cur_ft_pos).flatten()
-
-        if self.traj_waypoint_counter == self.ft_pos_traj.shape[0]:
-            # TODO: currently will redo the last waypoint after reaching end of trajectory
-            self.plan_trajectory(full_observation)
+        timer.stop("kinematics", t)
+
+        t = timer.start()
+        if self.async_planner is not None and self.waiting_for_plan:
+            self.update_async_plan(full_observation)
+
+        # Replan when the end of the trajectory is reached. In REPOSE, the last
+        # waypoint is held instead
+        if self.mode != TrajMode.REPOSE and not self.waiting_for_plan and \
+                self.get_time() - self.traj_start_time > self.traj.duration:
+            if self.async_planner is not None:
+                self.request_async_plan(full_observation)
+            else:
+                # TODO: currently will redo the last waypoint after reaching end of trajectory
+                self.plan_trajectory(full_observation)
+        timer.stop("planning", t)
+
+        # Desired fingertip and object states at current time along trajectory
+        # While waiting for a plan, hold the last waypoint
+        t = timer.start()
+        if self.waiting_for_plan:
+            traj_time = self.traj.duration + self.CONTROL_DT
+        else:
+            traj_time = self.get_time() - self.traj_start_time
+        ft_pos_des, ft_vel_des = self.traj.get_ft_pos_vel(traj_time)
+        x_des, dx_des = self.traj.get_obj_pose_vel(traj_time)
 
         ft_pos_goal_list = []
         ft_vel_goal_list = []
@@ -520,8 +536,8 @@ class ImpedanceControllerPolicy:
             H_list = c_utils.get_ft_R(current_position)
 
         for f_i in range(3):
-            new_pos = self.ft_pos_traj[self.traj_waypoint_counter, f_i*3:f_i*3+3]
-            new_vel = self.ft_vel_traj[self.traj_waypoint_counter, f_i*3:f_i*3+3]
+            new_pos = ft_pos_des[f_i*3:f_i*3+3]
+            new_vel = ft_vel_des[f_i*3:f_i*3+3]
             #print(f_i)
 
             #print(new_pos)
@@ -537,21 +553,35 @@ class ImpedanceControllerPolicy:
             ft_vel_goal_list.append(new_vel)
         # if self.mode == TrajMode.REPOSE:
            # quit()
+        timer.stop("traj_eval", t)
 
         # If in REPOSE, get fingertip forces in world frame
-        if self.mode == TrajMode.REPOSE:
-            ft_des_force_wf, W = c_utils.get_ft_forces(self.x_traj[self.traj_waypoint_counter, :],
-                                 self.dx_traj[self.traj_waypoint_counter, :],
+        # If the tick is at risk of missing its deadline, reuse the previous forces,
+        # or use the planned forces if there are none
+        if self.mode == TrajMode.REPOSE and self.DEADLINE_AWARE and \
+                (degrade or self.get_tick_time_left() < self.FT_FORCES_RESERVE) and \
+                (self.prev_ft_des_force_wf is not None or self.traj.l_wf_knots is not None):
+            if self.prev_ft_des_force_wf is not None:
+                ft_des_force_wf = self.prev_ft_des_force_wf
+            else:
+                ft_des_force_wf = self.traj.get_l_wf(traj_time)
+            timer.count("degrade_ft_forces")
+        elif self.mode == TrajMode.REPOSE:
+            t = timer.start()
+            ft_des_force_wf, W = c_utils.get_ft_forces(x_des, dx_des,
                                  obj_pose, obj_vel, self.KP_OBJ, self.KV_OBJ,
                                  self.cp_params)
             ft_des_force_wf = np.asarray(ft_des_force_wf).flatten()
-            # ft_des_force_wf = self.l_wf_traj[self.traj_waypoint_counter, :]
+            # ft_des_force_wf = self.traj.get_l_wf(traj_time)
+            self.prev_ft_des_force_wf = ft_des_force_wf
+            timer.stop("ft_forces", t)
 
             #if self.DEBUG:
-            #    self.l_desired_obj_w.append(W.flatten())
+            #    self.log.append("desired_obj_w", W.flatten())
 
         else:
             ft_des_force_wf = None
+            self.prev_ft_des_force_wf = None
 
         # Compute torque with impedance controller, and clip
         if self.mode == TrajMode.REPOSE:
@@ -561,42 +591,49 @@ class ImpedanceControllerPolicy:
             KP = self.KP
             KV = self.KV
 
-        torque = c_utils.impedance_controller(ft_pos_goal_list,
-                                              ft_vel_goal_list,
-                                              current_position, current_velocity,
-                                              self.custom_pinocchio_utils,
-                                              tip_forces_wf=ft_des_force_wf,
-                                              Kp = KP, Kv = KV)
+        t = timer.start()
+        self.impedance_ctrl.set_gains(KP, KV)
+        torque = self.impedance_ctrl.compute(ft_pos_goal_list,
+                                             ft_vel_goal_list,
+                                             current_velocity,
+                                             self.custom_pinocchio_utils.get_snapshot(current_position),
+                                             tip_forces_wf=ft_des_force_wf)
+        timer.stop("impedance_torque", t)
+        t = timer.start()
         torque = np.clip(torque, self.action_space.low, self.action_space.high)
+        timer.stop("clip", t)
 
-        self.log_to_buffers(ft_pos_goal_list, ft_vel_goal_list,
-                            cur_ft_pos, obj_pose, obj_vel, torque,
-                            ft_des_force_wf)
-        # always increment traj_waypoint_counter UNLESS in repose mode and have reached final waypoint
-        if not (self.mode == TrajMode.REPOSE and self.traj_waypoint_counter == self.ft_pos_traj.shape[0] - 1):
-            self.traj_waypoint_counter += 1
+        if self.DEADLINE_AWARE and (degrade or self.get_tick_time_left() < self.LOG_RESERVE):
+            timer.count("degrade_skip_log")
+        else:
+            t = timer.start()
+            self.log_to_buffers(ft_pos_goal_list, ft_vel_goal_list,
+                                cur_ft_pos, obj_pose, obj_vel, torque,
+                                ft_des_force_wf, x_des, dx_des)
+            timer.stop("log", t)
+
+        self.prev_tick_overran = self.get_tick_time_left() < 0
+        if self.prev_tick_overran:
+            timer.count("tick_overrun")
+        timer.stop("impedance_predict", t_predict)
         return torque
 
     """
     Get fingertip positions in world frame given current joint q
     """
     def get_fingertip_pos_wf(self, current_q):
-        fingertip_pos_wf = self.custom_pinocchio_utils.forward_kinematics(current_q)
+        fingertip_pos_wf = self.custom_pinocchio_utils.get_snapshot(current_q).tip_pos
         return fingertip_pos_wf
 
-    """
-    """
-    def set_filtered_pose_from_observation(self, observation, theta=0.01):
-        new_pose = get_pose_from_observation(observation)
-
-        f_p = (1-theta) * self.filtered_obj_pose.position + theta * new_pose.position
-        f_o = (1-theta) * self.filtered_obj_pose.orientation + theta * new_pose.orientation
-
-        filt_pose = move_cube.Pose(position=f_p, orientation=f_o)
-        self.filtered_obj_pose = filt_pose
 
-        return filt_pose
 
+"""
+Build a copy of policy_cls with only what plan_trajectory() needs, in the async planner worker
+"""
+def make_planning_policy(policy_cls, finger_urdf_path, tip_link_names):
+    policy = policy_cls.__new__(policy_cls)
+    policy.init_planning(finger_urdf_path, tip_link_names)
+    return policy
 
 
 class HierarchicalControllerPolicy:
@@ -634,6 +671,9 @@ class HierarchicalControllerPolicy:
             self._platform = platform
         self.impedance_controller.reset_policy(observation, platform)
 
+    def close(self):
+        self.impedance_controller.close()
+
     @property
     def platform(self):
         assert self._platform is not None, 'HierarchicalControlPolicy.platform is not set'
@@ -658,6 +698,7 @@ class HierarchicalControllerPolicy:
 
     def load_sb_policy(self, load_dir):
         # loads make_env, make_reorient_env, and make_model helpers
+        from rrc_iprl_package import run_rrc_sb as sb_utils
         assert 'HER-SAC' in load_dir, 'only configured HER-SAC policies so far'
         if '_push' in load_dir:
             self.rl_env = sb_utils.make_env()
@@ -751,6 +792,7 @@ class HierarchicalControllerPolicy:
         return robot_position
 
     def predict(self, observation):
+        t_predict = timing.TIMER.start()
         if not self.traj_initialized and self.initialize_traj_opt(observation['impedance']):
             self.set_waypoints(observation['impedance'])
 
@@ -767,6 +809,7 @@ class HierarchicalControllerPolicy:
         else:
             assert False, 'use a different start mode, started with: {}'.format(self.start_mode)
         self.step_count += 1
+        timing.TIMER.stop("hierarchical_predict", t_predict)
         return ac
 
 
@@ -858,6 +901,7 @@ def load_policy_and_env(fpath, itr='last', deterministic=False):
 
     # try to load environment from save
     # (sometimes this will fail because the environment could not be pickled)
+    import joblib
     state = joblib.load(osp.join(fpath, 'vars'+itr+'.pkl'))
     env = state['env']
 
@@ -866,6 +910,7 @@ def load_policy_and_env(fpath, itr='last', deterministic=False):
 
 def load_pytorch_policy(fpath, itr, deterministic=False):
     """ Load a pytorch policy saved with Spinning Up Logger."""
+    import torch
 
     fname = osp.join(fpath, 'pyt_save', 'model'+itr+'.pt')
     print('\n\nLoading from %s.\n\n'%fname)
@@ -2,14 +2,14 @@ import numpy as np
 import enum
 from scipy.spatial.transform import Rotation
 from scipy.spatial.distance import pdist, squareform
-from casadi import *
-from scipy.optimize import nnls
 
 from rrc_iprl_package.control.contact_point import ContactPoint
+from rrc_iprl_package.logging_utils import get_logger
 from trifinger_simulation.tasks import move_cube
-from rrc_iprl_package.traj_opt.fixed_contact_point_opt import FixedContactPointOpt
-from rrc_iprl_package.traj_opt.fixed_contact_point_system import FixedContactPointSystem
-from rrc_iprl_package.traj_opt.static_object_opt import StaticObjectOpt
+# traj_opt modules (and casadi) are imported on first use in define_static_object_opt()
+# and run_fixed_cp_traj_opt(), so the control loop does not load them at import
+
+logger = get_logger("control.controller_utils")
 
 class PolicyMode(enum.Enum):
         RESET = enum.auto()
@@ -112,8 +112,7 @@ def track_obj_traj_controller(x_des, dx_des, x_cur, dx_cur, Kp, Kv):
     dx_delta = np.concatenate((dp_delta, do_delta))
     W = Kp @ x_delta + Kv @ dx_delta - OBJ_MASS * g
     
-    print("x_delta: {}".format(x_delta))
-    print("dx_delta: {}".format(dx_delta))
+    logger.debug("x_delta: %s, dx_delta: %s", x_delta, dx_delta)
 
     #print(W)
 
@@ -126,90 +125,160 @@ def get_ft_forces(x_des, dx_des, x_cur, dx_cur, Kp, Kv, cp_params):
     # Get desired wrench for object COM to track obj traj
     W = track_obj_traj_controller(x_des, dx_des, x_cur, dx_cur, Kp, Kv)
 
-    # Get list of contact point positions and orientations in object frame
-    # By converting cp_params to contactPoints
-    cp_list = []
-    for cp_param in cp_params:
-        if cp_param is not None:
-            cp = get_cp_of_from_cp_param(cp_param)
-            cp_list.append(cp)
-    fnum = len(cp_list)
-
-    # To compute grasp matrix
-    G = __get_grasp_matrix(np.concatenate((x_cur.position, x_cur.orientation)), cp_list)
-    
-    # Solve for fingertip forces via optimization
-    # TODO use casadi for now, make new problem every time. If too slow, try cvxopt or scipy.minimize, 
-    # Or make a parametrized problem??
-    # Contact-surface normal vector for each contact point
-    n = np.array([1, 0, 0]) # contact point frame x axis points into object    
-    # Tangent vectors d_i for each contact point
-    d = [np.array([0, 1, 0]),
-         np.array([0, -1, 0]),
-         np.array([0, 0, 1]),
-         np.array([0, 0, -1])]
-    V = np.zeros((9,12));
-    for i in range(3):
-        for j in range(4):
-            V[i*3:(i+1)*3,i*4+j] = n + OBJ_MU * d[j]
-    B_soln = nnls(G@V,W)[0]
-    L = V@B_soln
-
-    # Formulate optimization problem
-    #B = SX.sym("B", len(d) * fnum) # Scaling weights for each of the cone vectors
-    #B0 = np.zeros(B.shape[0]) # Initial guess for weights
-
-    ## Fill lambda vector
-    #l_list = []
-    #for j in range(fnum):
-    #    l = 0 # contact force
-    #    for i in range(len(d)):
-    #        v = n + OBJ_MU * d[i] 
-    #        l += B[j*fnum + i] * v 
-    #    l_list.append(l)
-    #L = vertcat(*l_list) # (9x1) lambda vector
-
-    #f = G @ L - W # == 0
-
-    ## Formulate constraints
-    #g = f # contraint function
-    #g_lb = np.zeros(f.shape[0]) # constraint lower bound
-    #g_ub = np.zeros(f.shape[0]) # constraint upper bound
-
-    ## Constraints on B
-    #z_lb = np.zeros(B.shape[0]) # Lower bound on beta
-    #z_ub = np.ones(B.shape[0]) * np.inf # Upper bound on beta
-
-    #cost = L.T @ L
-
-    #problem = {"x": B, "f": cost, "g": g}
-    #options = {"ipopt.print_level":5,
-    #           "ipopt.max_iter":10000,
-    #            "ipopt.tol": 1e-4,
-    #            "print_time": 1
-    #          }
-    #solver = nlpsol("S", "ipopt", problem, options)
-    #r = solver(x0=B0, lbg=g_lb, ubg=g_ub, lbx=z_lb, ubx=z_ub)
-    #B_soln = r["x"]
-
-    # Compute contact forces in contact point frames from B_soln
-    # TODO fix list length when there are only 2 contact points
-    # save for later since we always have a 3 fingered grasp
-    l_wf_soln = []
-    for j in range(fnum):
-        l_cf = 0 # contact force
-        for i in range(len(d)):
-            v = n + OBJ_MU * d[i] 
-            l_cf += B_soln[j*fnum + i] * v 
-
-        # Convert from contact point frame to world frame
-        cp = cp_list[j]
-        R_cp_2_o = Rotation.from_quat(cp.quat_of)
-        R_o_2_w = Rotation.from_quat(x_cur.orientation)
-        l_wf = R_o_2_w.apply(R_cp_2_o.apply(np.squeeze(l_cf)))
-        l_wf_soln.append(l_wf)
+    # Distribute wrench over contact points
+    solver = get_force_distribution_solver(cp_params)
+    l_wf_soln = solver.solve(W, x_cur.orientation)
     return l_wf_soln, W
 
+"""
+Force distribution solver for the current grasp, rebuilt only when cp_params change
+"""
+_FORCE_SOLVER = None
+
+def get_force_distribution_solver(cp_params):
+    global _FORCE_SOLVER
+    if _FORCE_SOLVER is None or not _FORCE_SOLVER.has_cp_params(cp_params):
+        _FORCE_SOLVER = ForceDistributionSolver(cp_params)
+    return _FORCE_SOLVER
+
+"""
+Distributes a desired object wrench W over fixed contact points
+Contact forces are nonnegative combinations B of the vectors of the linearized friction
+cone at each contact point, found with NNLS: min ||G V B - W|| s.t. B >= 0
+The friction cone basis V and the object frame parts of the grasp matrix G are
+computed once per grasp, so each step only applies the object rotation.
+NNLS is warm started from the active set of the previous step.
+"""
+class ForceDistributionSolver:
+    def __init__(self, cp_params):
+        self.cp_params = [None if cp is None else tuple(cp) for cp in cp_params]
+
+        # Get list of contact point positions and orientations in object frame
+        # By converting cp_params to contactPoints
+        cp_list = [get_cp_of_from_cp_param(cp) for cp in cp_params if cp is not None]
+        self.fnum = len(cp_list)
+
+        # Contact-surface normal vector for each contact point
+        n = np.array([1, 0, 0]) # contact point frame x axis points into object
+        # Tangent vectors d_i for each contact point
+        d = [np.array([0, 1, 0]),
+             np.array([0, -1, 0]),
+             np.array([0, 0, 1]),
+             np.array([0, 0, -1])]
+        self.dnum = len(d)
+        # Friction cone basis for a single contact point, one vector per column
+        V_i = np.stack([n + OBJ_MU * d_j for d_j in d], axis=1)
+
+        # Grasp matrix for finger i is [R_o_2_w @ R_cp_2_o; S_i @ R_o_2_w @ R_cp_2_o]
+        # with S_i the cross product matrix of the contact point position in object frame
+        R_cp_2_o_list = []
+        S_list = []
+        for cp in cp_list:
+            p = cp.pos_of
+            R_cp_2_o_list.append(get_R_from_quat(cp.quat_of))
+            S_list.append(np.array([
+                                   [0, -p[2], p[1]],
+                                   [p[2], 0, -p[0]],
+                                   [-p[1], p[0], 0]
+                                   ]))
+        self.V_i = V_i
+        self.R_cp_2_o = np.stack(R_cp_2_o_list) # (fnum, 3, 3)
+        self.S = np.stack(S_list) # (fnum, 3, 3)
+        # Friction cone vectors in object frame, (3, fnum*dnum)
+        self.RV = np.concatenate([R @ V_i for R in R_cp_2_o_list], axis=1)
+
+        self.GV = np.zeros((6, self.dnum * self.fnum)) # G @ V
+        self.passive = np.zeros(self.dnum * self.fnum, dtype=bool) # NNLS active set
+
+    def has_cp_params(self, cp_params):
+        return self.cp_params == [None if cp is None else tuple(cp) for cp in cp_params]
+
+    """
+    Get list of contact forces in world frame for desired object wrench W
+    obj_quat: current object orientation [qx, qy, qz, qw]
+    """
+    def solve(self, W, obj_quat):
+        fnum = self.fnum
+        dnum = self.dnum
+        R_o_2_w = get_R_from_quat(obj_quat)
+
+        # Force rows of G @ V, then torque rows for all fingers at once
+        A = R_o_2_w @ self.RV
+        self.GV[0:3, :] = A
+        A_f = A.reshape(3, fnum, dnum).transpose(1, 0, 2) # (fnum, 3, dnum)
+        self.GV[3:6, :] = np.matmul(self.S, A_f).transpose(1, 0, 2).reshape(3, fnum * dnum)
+
+        B_soln, self.passive = nnls_active_set(self.GV, W, self.passive)
+
+        # Compute contact forces in contact point frames from B_soln
+        # and convert from contact point frame to world frame
+        l_cf = self.V_i @ B_soln.reshape(fnum, dnum).T # (3, fnum)
+        l_of = np.matmul(self.R_cp_2_o, l_cf.T[:, :, None])[:, :, 0] # (fnum, 3)
+        l_wf = l_of @ R_o_2_w.T
+        return list(l_wf)
+
+"""
+Solve min ||A x - b|| s.t. x >= 0 with the Lawson-Hanson active set method
+Warm started from passive, the set of variables that were positive in a previous
+solution of a similar problem; when it is still correct only one least squares
+solve is needed.
+Return:
+x: solution
+passive: boolean mask of positive variables in x
+"""
+def nnls_active_set(A, b, passive = None, tol = 1e-10, max_iter = None):
+    n = A.shape[1]
+    if max_iter is None:
+        max_iter = 3 * n
+    x = np.zeros(n)
+    P = np.zeros(n, dtype=bool) if passive is None else passive.copy()
+
+    # Warm start: least squares on the previous passive set, dropping variables
+    # until all are positive
+    while P.any():
+        z = solve_least_squares(A[:, P], b)
+        if np.all(z > tol):
+            x[P] = z
+            break
+        P[np.flatnonzero(P)[z <= tol]] = False
+
+    for _ in range(max_iter):
+        # Gradient of -0.5||Ax - b||^2, positive where increasing x reduces the residual
+        w = A.T @ (b - A @ x)
+        w[P] = -np.inf
+        j = np.argmax(w)
+        if w[j] <= tol:
+            break
+        P[j] = True
+
+        # Inner loop: keep x feasible while solving least squares on P
+        while True:
+            z = np.zeros(n)
+            z[P] = solve_least_squares(A[:, P], b)
+            if np.all(z[P] > tol):
+                x = z
+                break
+            neg = P & (z <= tol)
+            alpha = np.min(x[neg] / (x[neg] - z[neg]))
+            x = x + alpha * (z - x)
+            P &= x > tol
+            x[~P] = 0
+
+    return x, P
+
+"""
+Least squares solution of A x = b, for A with few columns
+Solves the normal equations, which is much faster than np.linalg.lstsq for small A.
+Lawson-Hanson keeps the columns of A[:, P] linearly independent, so np.linalg.lstsq
+is only needed as a fallback when they are not (more columns than rows).
+"""
+def solve_least_squares(A, b):
+    if A.shape[1] <= A.shape[0]:
+        try:
+            return np.linalg.solve(A.T @ A, A.T @ b)
+        except np.linalg.LinAlgError:
+            pass
+    return np.linalg.lstsq(A, b, rcond=None)[0]
 
 """
 Compute joint torques to move fingertips to desired locations
@@ -286,8 +355,11 @@ def impedance_controller_single_finger(
     Kv_z = Kv[finger_id*3 + 2]
     Kv = np.diag([Kv_x, Kv_y, Kv_z])
 
+    # Kinematics at q_current, shared across fingers
+    kinematics = custom_pinocchio_utils.get_snapshot(q_current)
+
     # Compute current fingertip position
-    x_current = custom_pinocchio_utils.forward_kinematics(q_current)[finger_id]
+    x_current = kinematics.tip_pos[finger_id]
 
     delta_x = np.expand_dims(np.array(tip_pos_desired) - np.array(x_current), 1)
     #print("Current x: {}".format(x_current))
@@ -295,12 +367,12 @@ def impedance_controller_single_finger(
     #print("Delta: {}".format(delta_x))
     
     # Get full Jacobian for finger
-    Ji = custom_pinocchio_utils.get_tip_link_jacobian(finger_id, q_current)
+    Ji = kinematics.tip_jacobians[finger_id]
     # Just take first 3 rows, which correspond to linear velocities of fingertip
     Ji = Ji[:3, :]
 
     # Get g matrix for gravity compensation
-    _, g = custom_pinocchio_utils.get_lambda_and_g_matrix(finger_id, q_current, Ji)
+    g = kinematics.g_list[finger_id]
 
     # Get current fingertip velocity
     dx_current = Ji @ np.expand_dims(np.array(dq_current), 1)
@@ -316,6 +388,72 @@ def impedance_controller_single_finger(
     #print(np.linalg.norm(delta_x))
     return torque
 
+"""
+Impedance controller for all fingers in a single pass
+Same control law as impedance_controller(), with the fingertip Jacobians stacked
+into one block diagonal (9x9) Jacobian. Gains are diagonal, so they are stored as
+9-vectors, copied in by set_gains() every control step. All intermediate
+values are written into preallocated buffers.
+"""
+class ImpedanceController:
+    def __init__(self, Kp, Kv):
+        self.Kp = np.zeros(9)
+        self.Kv = np.zeros(9)
+        self.set_gains(Kp, Kv)
+
+        self.torque = np.zeros(9) # Output buffer, overwritten by every compute()
+        self._J = np.zeros((9,9))
+        self._delta_x = np.zeros(9)
+        self._delta_dx = np.zeros(9)
+        self._dx = np.zeros(9)
+        self._f = np.zeros(9)
+
+    """
+    Set 9-vectors of position and velocity gains, [f1_x, f1_y, f1_z, ..., f3_z]
+    Gains are copied on every call, so gains edited in place are picked up
+    """
+    def set_gains(self, Kp, Kv):
+        self.Kp[:] = Kp
+        self.Kv[:] = Kv
+
+    """
+    Compute joint torques to move all fingertips to desired positions
+    Inputs:
+    tip_pos_desired: (3,3) or (9,) desired fingertip positions in world frame
+    tip_vel_desired: (3,3) or (9,) desired fingertip velocities in world frame
+    dq_current: Current joint velocities
+    kinematics: KinematicsSnapshot at current joint positions
+    tip_forces_wf: (9,) fingertip forces in world frame
+    Return:
+    torque: (9,) joint torques, in self.torque buffer
+    """
+    def compute(self, tip_pos_desired, tip_vel_desired, dq_current, kinematics,
+                tip_forces_wf = None):
+        J = self._J
+        for finger_id in range(3):
+            J[finger_id*3:finger_id*3+3, :] = kinematics.tip_jacobians[finger_id][:3, :]
+            self._delta_x[finger_id*3:finger_id*3+3] = kinematics.tip_pos[finger_id]
+
+        # delta_x = x_desired - x_current
+        np.subtract(np.reshape(tip_pos_desired, 9), self._delta_x, out=self._delta_x)
+
+        # delta_dx = dx_desired - J @ dq
+        np.dot(J, dq_current, out=self._dx)
+        np.subtract(np.reshape(tip_vel_desired, 9), self._dx, out=self._delta_dx)
+
+        # f = Kp * delta_x + Kv * delta_dx (+ tip_forces_wf)
+        np.multiply(self.Kp, self._delta_x, out=self._f)
+        np.multiply(self.Kv, self._delta_dx, out=self._delta_dx)
+        np.add(self._f, self._delta_dx, out=self._f)
+        if tip_forces_wf is not None:
+            np.add(self._f, tip_forces_wf, out=self._f)
+
+        # torque = J.T @ f + g
+        np.dot(J.T, self._f, out=self.torque)
+        for g in kinematics.g_list:
+            np.add(self.torque, g, out=self.torque)
+        return self.torque
+
 """
 Compute contact point position in world frame
 Inputs:
@@ -343,6 +481,20 @@ def get_cp_pos_wf_from_cp_params(cp_params, cube_pos, cube_quat, use_obj_size_of
             fingertip_goal_list.append(get_cp_pos_wf_from_cp_param(cp_params[i], cube_pos, cube_quat, use_obj_size_offset = use_obj_size_offset))
     return fingertip_goal_list
 
+"""
+Get contact point positions in world frame from cp_params, along a trajectory of object poses
+Inputs:
+cp_params: list of contact point params, None for fingers not on the object
+x: (N, 7) object poses [x, y, z, qx, qy, qz, qw]
+Returns (N, len(cp_params), 3) contact point positions, NaN for cp_params that are None
+"""
+def get_cp_pos_wf_from_cp_params_batch(cp_params, x, use_obj_size_offset = False):
+    cp_of = np.full((len(cp_params), 3), np.nan)
+    for i, cp_param in enumerate(cp_params):
+        if cp_param is not None:
+            cp_of[i] = get_cp_of_from_cp_param(cp_param, use_obj_size_offset = use_obj_size_offset).pos_of
+    return get_wf_from_of_batch(cp_of, x)
+
 """
 Compute contact point position in object frame
 Inputs:
@@ -415,6 +567,18 @@ def get_wf_from_of(p, obj_pose):
     
     return rotation.apply(p) + translation
 
+"""
+Trasform points p from object frame to world frame, along a trajectory of object poses
+Inputs:
+p: (M, 3) points in object frame
+x: (N, 7) object poses [x, y, z, qx, qy, qz, qw]
+Returns (N, M, 3) points in world frame
+"""
+def get_wf_from_of_batch(p, x):
+    x = np.asarray(x)
+    R = Rotation.from_quat(x[:, 3:]).as_matrix() # One rotation object for all poses
+    return np.einsum("nij,mj->nmi", R, np.asarray(p)) + x[:, None, 0:3]
+
 """
 Trasform point p from object frame to world frame, given object pose
 """
@@ -441,26 +605,29 @@ x0: object initial position for traj opt
 x_goal: object goal position for traj opt
 nGrid: number of grid points
 dt: delta t
+codegen: use NLP functions compiled to C, cached on disk
 """
-def run_fixed_cp_traj_opt(obj_pose, cp_params, current_position, custom_pinocchio_utils, x0, x_goal, nGrid, dt, npz_filepath = None):
+def run_fixed_cp_traj_opt(obj_pose, cp_params, current_position, custom_pinocchio_utils, x0, x_goal, nGrid, dt, npz_filepath = None, codegen = False):
 
     cp_params_on_obj = []
     for cp in cp_params:
         if cp is not None: cp_params_on_obj.append(cp)
     fnum = len(cp_params_on_obj)
 
-    # Formulate and solve optimization problem
-    opt_problem = FixedContactPointOpt(
-                                      nGrid     = nGrid,    # Number of timesteps
-                                      dt        = dt,       # Length of each timestep (seconds)
-                                      fnum      = fnum,
-                                      cp_params = cp_params_on_obj,
-                                      x0        = x0,
-                                      x_goal    = x_goal,
-                                      obj_shape = OBJ_SIZE,
-                                      obj_mass  = OBJ_MASS,
-                                      npz_filepath = npz_filepath
-                                      )
+    from rrc_iprl_package.traj_opt.fixed_contact_point_opt import get_fixed_contact_point_opt
+
+    # Get optimization problem, which is only formulated once per (nGrid, dt, fnum)
+    opt_problem = get_fixed_contact_point_opt(nGrid, dt, fnum, codegen = codegen)
+
+    # Solve optimization problem
+    opt_problem.solve_nlp(
+                          cp_params = cp_params_on_obj,
+                          x0        = x0,
+                          x_goal    = x_goal,
+                          obj_shape = OBJ_SIZE,
+                          obj_mass  = OBJ_MASS,
+                          npz_filepath = npz_filepath,
+                          )
     
     x_soln     = np.array(opt_problem.x_soln)
     dx_soln    = np.array(opt_problem.dx_soln)
@@ -532,7 +699,7 @@ def get_lifting_cp_params(obj_pose):
     face = assign_faces_to_fingers(obj_pose, [curr_finger_id], free_faces)[curr_finger_id]
     finger_assignments[face].append(curr_finger_id)
 
-    print("finger assignments: {}".format(finger_assignments))
+    logger.debug("finger assignments: %s", finger_assignments)
     
     # Set contact point params for two long faces
     cp_params = [None, None, None]
@@ -555,7 +722,7 @@ def get_lifting_cp_params(obj_pose):
                 
         else:
             cp_params[finger_id_list[0]] = param
-    print("LIFT CP PARAMS: {}".format(cp_params))
+    logger.debug("LIFT CP PARAMS: %s", cp_params)
 
     return cp_params
 
@@ -659,19 +826,24 @@ def get_pre_grasp_ft_goal(obj_pose, fingertips_current_wf, cp_params):
 """
 Set up traj opt for fingers and static object
 """
-def define_static_object_opt(nGrid, dt):
+def define_static_object_opt(nGrid, dt, warm_start = False, codegen = False):
+    from rrc_iprl_package.traj_opt.static_object_opt import StaticObjectOpt
+
     problem = StaticObjectOpt(
                  nGrid     = nGrid,
                  dt        = dt,
                  obj_shape = OBJ_SIZE,
+                 warm_start = warm_start,
+                 codegen   = codegen,
                  )
     return problem
 
 """
 Solve traj opt to get finger waypoints
+n_shift: timesteps elapsed since previous solve, to shift warm start
 """
-def get_finger_waypoints(nlp, ft_goal, q_cur, obj_pose, npz_filepath = None):
-    nlp.solve_nlp(ft_goal, q_cur, obj_pose = obj_pose, npz_filepath = npz_filepath)
+def get_finger_waypoints(nlp, ft_goal, q_cur, obj_pose, npz_filepath = None, n_shift = 0):
+    nlp.solve_nlp(ft_goal, q_cur, obj_pose = obj_pose, npz_filepath = npz_filepath, n_shift = n_shift)
     ft_pos = nlp.ft_pos_soln
     ft_vel = nlp.ft_vel_soln
     return ft_pos, ft_vel
@@ -870,6 +1042,20 @@ def __get_grasp_matrix(x, cp_list):
     #print(GT.T)
     return GT.T
 
+"""
+Get 3x3 rotation matrix from quaternion [x, y, z, w]
+Same as Rotation.from_quat(quat).as_matrix(), without creating a Rotation
+"""
+def get_R_from_quat(quat):
+    x, y, z, w = quat
+    scale = 1 / (x*x + y*y + z*z + w*w) ** 0.5
+    x, y, z, w = x*scale, y*scale, z*scale, w*scale
+    return np.array([
+                    [1 - 2*(y*y + z*z), 2*(x*y - w*z), 2*(x*z + w*y)],
+                    [2*(x*y + w*z), 1 - 2*(x*x + z*z), 2*(y*z - w*x)],
+                    [2*(x*z - w*y), 2*(y*z + w*x), 1 - 2*(x*x + y*y)],
+                    ])
+
 """
 Get matrix to convert dquat (4x1 vector) to angular velocities (3x1 vector)
 """
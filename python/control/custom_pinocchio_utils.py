@@ -4,6 +4,8 @@ import pinocchio
 
 from trifinger_simulation.pinocchio_utils import Kinematics
 
+from rrc_iprl_package.control.analytic_kinematics import AnalyticKinematics
+
 class CustomPinocchioUtils(Kinematics):
     """
     Consists of kinematic methods for the finger platform.
@@ -26,14 +28,38 @@ class CustomPinocchioUtils(Kinematics):
     np.fill_diagonal(I3,[3.5e-5,3.5e-5,1.4e-6])
     Is=[I1,I2,I3]
 
-    def __init__(self, finger_urdf_path, tip_link_names):
+    GRAVITY_FRAME_ORDER = [0,1,3] # Link frames (finger_id+1)*10+order[j] with masses ms[j]
+
+    def __init__(self, finger_urdf_path, tip_link_names, backend="pinocchio"):
         """
         Initializes the finger model on which control's to be performed.
     
         Args:
             finger (SimFinger): An instance of the SimFinger class
+            backend: "pinocchio" or "analytic", used by get_snapshot()
         """
         super().__init__(finger_urdf_path, tip_link_names)
+        self.snapshot = None # KinematicsSnapshot of last q passed to get_snapshot()
+
+        if backend == "analytic":
+            gravity_frame_ids = [[(finger_id+1)*10+order for order in self.GRAVITY_FRAME_ORDER]
+                                 for finger_id in range(len(self.tip_link_ids))]
+            self.analytic = AnalyticKinematics(self.robot_model, self.tip_link_ids,
+                                               gravity_frame_ids, self.ms)
+        elif backend == "pinocchio":
+            self.analytic = None
+        else:
+            raise ValueError("Invalid kinematics backend {}".format(backend))
+
+    def get_snapshot(self, q):
+        """
+        Get KinematicsSnapshot at joint positions q
+        Computed with a single pinocchio pass (or analytic backend call), and
+        reused while q does not change
+        """
+        if self.snapshot is None or not np.array_equal(self.snapshot.q, q):
+            self.snapshot = KinematicsSnapshot(self, q)
+        return self.snapshot
     
     def get_tip_link_jacobian(self, finger_id, q):
         """
@@ -84,7 +110,7 @@ class CustomPinocchioUtils(Kinematics):
         Ai = np.zeros((9,9))
         g = np.zeros(9)
         grav = np.array([0,0,-9.81])
-        order = [0,1,3]
+        order = self.GRAVITY_FRAME_ORDER
         for j in range(3):
             id = (finger_id+1)*10+order[j]
             Jj = self.get_any_link_jacobian(id, q)
@@ -98,3 +124,52 @@ class CustomPinocchioUtils(Kinematics):
         # Li = Ai;
         # Li is Lambda matrix (kinetic energy matrix in operation space)
         return Li,g
+
+
+class KinematicsSnapshot:
+    """
+    Kinematic quantities of all fingers at one joint configuration q, shared by
+    every consumer in a control step:
+    tip_pos: list of fingertip positions in world frame
+    tip_R: list of 3x3 fingertip orientations in world frame
+    tip_jacobians: list of 6x9 fingertip Jacobians (LOCAL_WORLD_ALIGNED)
+    g_list: list of gravity compensation torques (9,) for each finger,
+            as in CustomPinocchioUtils.get_lambda_and_g_matrix
+    """
+    def __init__(self, kinematics, q):
+        self.q = np.array(q, dtype=float)
+        if kinematics.analytic is not None:
+            result = kinematics.analytic.compute(self.q)
+            self.tip_pos = list(result["tip_pos"])
+            self.tip_R = list(result["tip_R"])
+            self.tip_jacobians = list(result["tip_jacobians"])
+            self.g_list = list(result["g"])
+            return
+
+        model = kinematics.robot_model
+        data = kinematics.data
+
+        pinocchio.computeJointJacobians(model, data, self.q)
+        pinocchio.framesForwardKinematics(model, data, self.q)
+
+        def frame_jacobian(frame_id):
+            return pinocchio.getFrameJacobian(
+                model, data, frame_id, pinocchio.ReferenceFrame.LOCAL_WORLD_ALIGNED,
+            )
+
+        self.tip_pos = [np.array(data.oMf[frame_id].translation).reshape(-1)
+                        for frame_id in kinematics.tip_link_ids]
+        self.tip_R = [np.array(data.oMf[frame_id].rotation)
+                      for frame_id in kinematics.tip_link_ids]
+        self.tip_jacobians = [frame_jacobian(frame_id)
+                              for frame_id in kinematics.tip_link_ids]
+
+        grav = np.array([0,0,-9.81])
+        order = kinematics.GRAVITY_FRAME_ORDER
+        self.g_list = []
+        for finger_id in range(len(kinematics.tip_link_ids)):
+            g = np.zeros(9)
+            for j in range(3):
+                Jjv = frame_jacobian((finger_id+1)*10+order[j])[:3,:]
+                g -= kinematics.ms[j]*Jjv.T @ grav * 0.33
+            self.g_list.append(g)
@@ -0,0 +1,117 @@
+"""
+Implements ObjectStateEstimator class, which filters camera object poses into
+a cached object pose and twist estimate for the control loop
+"""
+
+import numpy as np
+from trifinger_simulation.tasks import move_cube
+
+from rrc_iprl_package.control.trajectory import quat_mul, quat_conj, quat_from_rotvec, rotvec_from_quat
+
+
+"""
+Constant velocity alpha-beta filter on object pose, in SE(3)
+
+The filter only corrects its state when a camera frame with a new timestamp
+arrives. Between frames, the control loop calls update() every tick with the
+same frame, which only propagates the last corrected state to the current time
+with the constant velocity model and caches the result in pose and twist.
+
+Orientation errors are rotation vectors of the error quaternion, so the filter
+stays on unit quaternions and is insensitive to the sign of the observed quaternion.
+
+pose:  move_cube.Pose, estimated object pose at the time of the last update()
+twist: (6,) estimated object linear velocity and angular velocity, world frame
+"""
+class ObjectStateEstimator:
+    POS_TAU = 0.1 # Time constant of position correction, seconds
+    ORI_TAU = 0.1 # Time constant of orientation correction, seconds
+    VEL_TAU = 1.0 # Time constant of velocity correction towards residual rate, seconds
+    MAX_FRAME_DT = 1.0 # Reset to observed pose, at rest, if frames are further apart, seconds
+
+    """
+    pose: move_cube.Pose, first observed object pose
+    timestamp: camera timestamp of pose, seconds
+    now: control loop time, seconds
+    """
+    def __init__(self, pose, timestamp, now):
+        self.pose = move_cube.Pose()
+        self.reset(pose, timestamp, now)
+
+    """
+    Reset state to observed pose at rest
+    """
+    def reset(self, pose, timestamp, now):
+        # Corrected state at last camera frame
+        self.frame_timestamp = timestamp
+        self.frame_time = now
+        self.frame_pos = np.array(pose.position, dtype=float)
+        self.frame_quat = np.array(pose.orientation, dtype=float)
+        self.frame_quat /= np.linalg.norm(self.frame_quat)
+        self.twist = np.zeros(6)
+
+        self.pose.position = self.frame_pos.copy()
+        self.pose.orientation = self.frame_quat.copy()
+
+    """
+    Update estimate with observed pose at camera timestamp, and propagate it to now
+    If correct is False, a new frame is not used yet, and is used by the next update
+    Return True if observed pose is from a new camera frame and was used
+    """
+    def update(self, pose, timestamp, now, correct=True):
+        new_frame = correct and timestamp > self.frame_timestamp
+        if new_frame:
+            self.correct(pose, timestamp, now)
+        self.propagate(now)
+        return new_frame
+
+    """
+    Correct state with observed pose from new camera frame
+    """
+    def correct(self, pose, timestamp, now):
+        dt = timestamp - self.frame_timestamp
+        if dt > self.MAX_FRAME_DT:
+            # Constant velocity prediction over a gap this long is meaningless
+            self.reset(pose, timestamp, now)
+            return
+        vel = self.twist[0:3]
+        omega = self.twist[3:6]
+
+        # Predict state at frame time
+        pos_pred = self.frame_pos + dt * vel
+        quat_pred = quat_mul(quat_from_rotvec(dt * omega), self.frame_quat)
+
+        # Residuals of observation w.r.t. prediction
+        pos_res = np.asarray(pose.position) - pos_pred
+        # Rotation vector does not depend on scale, so observed quat need not be unit
+        ori_res = rotvec_from_quat(quat_mul(pose.orientation, quat_conj(quat_pred)))
+
+        # Correct
+        a_pos = 1 - np.exp(-dt / self.POS_TAU)
+        a_ori = 1 - np.exp(-dt / self.ORI_TAU)
+        self.frame_pos[:] = pos_pred + a_pos * pos_res
+        self.frame_quat[:] = quat_mul(quat_from_rotvec(a_ori * ori_res), quat_pred)
+        self.frame_quat /= np.linalg.norm(self.frame_quat)
+        # Velocity moves towards residual rate res / dt by a_vel. a_vel / dt is
+        # at most 1 / VEL_TAU, so closely spaced frames cannot blow it up
+        a_vel_rate = -np.expm1(-dt / self.VEL_TAU) / dt
+        vel += a_vel_rate * pos_res
+        omega += a_vel_rate * ori_res
+
+        self.frame_timestamp = timestamp
+        self.frame_time = now
+
+    """
+    Propagate last corrected state to now with constant velocity, into pose
+    """
+    def propagate(self, now):
+        dt = now - self.frame_time
+        self.pose.position = self.frame_pos + dt * self.twist[0:3]
+        self.pose.orientation = quat_mul(quat_from_rotvec(dt * self.twist[3:6]), self.frame_quat)
+
+    """
+    Get (4,) quaternion derivative of estimated pose, for logging
+    """
+    def get_dquat(self):
+        omega_quat = np.append(self.twist[3:6], 0)
+        return 0.5 * quat_mul(omega_quat, self.pose.orientation)
@@ -0,0 +1,138 @@
+"""
+Low overhead timing of named spans in the control loop
+
+Enabled by setting environment variable RRC_TIMING=1. When disabled, start()
+returns 0 and stop() returns immediately, so instrumentation can stay in place.
+Event counters, from count(), are always on.
+
+Usage:
+    t = timing.TIMER.start()
+    ...
+    timing.TIMER.stop("span_name", t)
+"""
+
+import json
+import math
+import os
+import time
+
+import numpy as np
+
+from rrc_iprl_package.logging_utils import get_logger
+
+logger = get_logger("control.timing")
+
+CONTROL_DEADLINE_NS = 1000000 # 1 ms control tick budget
+
+# Log spaced histogram bins, 100 ns to 1 s, 20 bins per decade
+HIST_MIN_NS = 100
+HIST_BINS_PER_DECADE = 20
+HIST_NUM_BINS = 4 * HIST_BINS_PER_DECADE + 2 # Plus underflow and overflow bins
+
+
+"""
+Per-span latency statistics, with preallocated log spaced histograms
+"""
+class SpanTimer:
+    def __init__(self, enabled=False, deadline_ns=CONTROL_DEADLINE_NS):
+        self.enabled = enabled
+        self.deadline_ns = deadline_ns
+        self.spans = {} # name -> _Span
+        self.counts = {} # event name -> count
+        self._log_scale = HIST_BINS_PER_DECADE / math.log(10)
+
+    def start(self):
+        if not self.enabled:
+            return 0
+        return time.perf_counter_ns()
+
+    """
+    Record span name started at t_start, from start()
+    """
+    def stop(self, name, t_start):
+        if not self.enabled:
+            return
+        dt = time.perf_counter_ns() - t_start
+        span = self.spans.get(name)
+        if span is None:
+            span = self.spans[name] = _Span()
+        if dt < HIST_MIN_NS:
+            i = 0
+        else:
+            i = min(int(math.log(dt / HIST_MIN_NS) * self._log_scale) + 1, HIST_NUM_BINS - 1)
+        span.hist[i] += 1
+        span.count += 1
+        span.total_ns += dt
+        if dt > span.max_ns:
+            span.max_ns = dt
+        if dt > self.deadline_ns:
+            span.deadline_misses += 1
+
+    """
+    Count event name, e.g. a degraded control tick
+    """
+    def count(self, name):
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    """
+    Clear recorded spans and counts, e.g. at start of episode
+    """
+    def reset(self):
+        self.spans = {}
+        self.counts = {}
+
+    """
+    Dict of span name -> latency statistics in microseconds
+    Percentiles are upper edges of histogram bins, so within about 12% above the true value
+    """
+    def summary(self):
+        summary = {}
+        for name, span in self.spans.items():
+            cdf = np.cumsum(span.hist)
+            summary[name] = {
+                "count": span.count,
+                "mean_us": span.total_ns / span.count / 1000,
+                "p50_us": _bin_upper_edge_ns(np.searchsorted(cdf, 0.5 * span.count)) / 1000,
+                "p99_us": _bin_upper_edge_ns(np.searchsorted(cdf, 0.99 * span.count)) / 1000,
+                "max_us": span.max_ns / 1000,
+                "deadline_misses": span.deadline_misses,
+            }
+        return summary
+
+    """
+    Write summary() and counts to json file at filepath, and log them at INFO
+    Only writes counts if timing is disabled, and nothing if there are none
+    """
+    def write_summary(self, filepath):
+        if not self.enabled and not self.counts:
+            return
+        summary = self.summary()
+        with open(filepath, "w") as f:
+            json.dump({"deadline_us": self.deadline_ns / 1000, "spans": summary,
+                       "counts": self.counts}, f, indent=2)
+
+        for name, count in self.counts.items():
+            logger.info("{:>24} {:>9}".format(name, count))
+
+        logger.info("{:>24} {:>9} {:>10} {:>10} {:>10} {:>8}".format(
+                    "span", "count", "p50 us", "p99 us", "max us", "misses"))
+        for name, s in summary.items():
+            logger.info("{:>24} {:>9} {:>10.1f} {:>10.1f} {:>10.1f} {:>8}".format(
+                        name, s["count"], s["p50_us"], s["p99_us"], s["max_us"], s["deadline_misses"]))
+
+
+class _Span:
+    def __init__(self):
+        self.hist = [0] * HIST_NUM_BINS # List, faster than numpy to increment one bin
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self.deadline_misses = 0
+
+
+def _bin_upper_edge_ns(i):
+    return HIST_MIN_NS * 10 ** (i / HIST_BINS_PER_DECADE)
+
+
+# Shared timer for all instrumented code
+TIMER = SpanTimer(enabled=os.environ.get("RRC_TIMING", "0") not in ("", "0"))
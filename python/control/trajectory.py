@@ -0,0 +1,200 @@
+"""
+Implements Trajectory class, a compact time-indexed representation of planned
+fingertip and object trajectories, evaluated on demand from the traj opt knots
+"""
+
+import numpy as np
+from scipy.interpolate import CubicSpline
+from scipy.spatial.transform import Rotation
+
+
+"""
+Trajectory through traj opt knots spaced dt seconds apart, evaluated at time t
+seconds since the start of the trajectory
+
+Fingertip and object positions are cubic splines through the knots, and their
+velocities are the analytic spline derivatives. Object orientations are slerped
+between knots, with the constant world frame angular velocity of each slerp.
+Contact forces are linearly interpolated. Outside of [0, duration], the
+trajectory holds its first or last knot with zero velocity.
+
+ft_pos: (nGrid, 9) fingertip positions in world frame
+ft_vel: (nGrid, 9) fingertip velocities, only used for spline end conditions
+x:      (nGrid, 7) object poses [x, y, z, qx, qy, qz, qw], optional
+dx:     (nGrid, 6) object velocities, only used for spline end conditions
+l_wf:   (nGrid, 9) fingertip forces in world frame, optional
+"""
+class Trajectory:
+    def __init__(self, dt, ft_pos, ft_vel=None, x=None, dx=None, l_wf=None):
+        ft_pos = np.asarray(ft_pos, dtype=float)
+        self.dt = dt
+        self.nGrid = ft_pos.shape[0]
+        self.duration = dt * (self.nGrid - 1)
+
+        self.ft_pos_knots = ft_pos
+        self.ft_pos_coeffs = get_spline_coeffs(dt, ft_pos, ft_vel)
+
+        self.x_knots = None
+        self.l_wf_knots = None
+        if x is not None:
+            x = np.asarray(x, dtype=float)
+            self.x_knots = x
+            self.obj_pos_coeffs = get_spline_coeffs(dt, x[:, 0:3],
+                                                    None if dx is None else np.asarray(dx)[:, 0:3])
+            # Rotation vector (world frame) taking each knot orientation to the next
+            R = Rotation.from_quat(x[:, 3:])
+            if self.nGrid > 1:
+                self.obj_rotvecs = (R[1:] * R[:-1].inv()).as_rotvec()
+            else:
+                self.obj_rotvecs = np.zeros((0, 3))
+            self.obj_quats = R.as_quat()
+        if l_wf is not None:
+            self.l_wf_knots = np.asarray(l_wf, dtype=float)
+
+    """
+    Trajectory which holds ft_pos, (9,) fingertip positions, with zero velocity
+    """
+    @classmethod
+    def hold(cls, ft_pos, dt=1.0):
+        return cls(dt, np.tile(np.asarray(ft_pos, dtype=float).flatten(), (2, 1)))
+
+    @property
+    def has_obj_traj(self):
+        return self.x_knots is not None
+
+    """
+    Get knot index and time since that knot, for time t clamped to the trajectory
+    Also return whether t is inside the trajectory (velocity is zero if not)
+    """
+    def _locate(self, t):
+        if self.nGrid == 1 or t <= 0:
+            return 0, 0.0, False
+        if t >= self.duration:
+            return self.nGrid - 2, self.dt, False
+        k = min(int(t / self.dt), self.nGrid - 2)
+        return k, t - k * self.dt, True
+
+    """
+    Get desired (9,) fingertip positions and velocities at time t
+    """
+    def get_ft_pos_vel(self, t):
+        if self.nGrid == 1:
+            return self.ft_pos_knots[0].copy(), np.zeros(9)
+        k, s, moving = self._locate(t)
+        pos, vel = eval_spline(self.ft_pos_coeffs, k, s)
+        if not moving:
+            vel[:] = 0
+        return pos, vel
+
+    """
+    Get desired (7,) object pose and (6,) object velocity at time t
+    Return None, None if trajectory has no object trajectory
+    """
+    def get_obj_pose_vel(self, t):
+        if self.x_knots is None:
+            return None, None
+        if self.nGrid == 1:
+            return self.x_knots[0].copy(), np.zeros(6)
+        k, s, moving = self._locate(t)
+        x = np.empty(7)
+        dx = np.zeros(6)
+        x[0:3], dx[0:3] = eval_spline(self.obj_pos_coeffs, k, s)
+        omega = self.obj_rotvecs[k] / self.dt
+        x[3:] = quat_mul(quat_from_rotvec(omega * s), self.obj_quats[k])
+        if moving:
+            dx[3:] = omega
+        else:
+            dx[0:3] = 0
+        return x, dx
+
+    """
+    Get desired (9,) fingertip forces in world frame at time t
+    Return None if trajectory has no forces
+    """
+    def get_l_wf(self, t):
+        if self.l_wf_knots is None:
+            return None
+        if self.nGrid == 1:
+            return self.l_wf_knots[0].copy()
+        k, s, _ = self._locate(t)
+        a = s / self.dt
+        return (1 - a) * self.l_wf_knots[k] + a * self.l_wf_knots[k+1]
+
+
+"""
+Get (4, nGrid-1, dim) piecewise cubic coefficients of spline through knots y
+If knot velocities dy are given, they are used as end conditions, else not-a-knot
+"""
+def get_spline_coeffs(dt, y, dy=None):
+    nGrid = y.shape[0]
+    if nGrid < 2:
+        return np.zeros((4, 0, y.shape[1]))
+    if nGrid == 2 and dy is None:
+        # Straight line
+        c = np.zeros((4, 1, y.shape[1]))
+        c[2, 0] = (y[1] - y[0]) / dt
+        c[3, 0] = y[0]
+        return c
+    t = np.arange(nGrid) * dt
+    if dy is None:
+        bc_type = "not-a-knot"
+    else:
+        dy = np.asarray(dy, dtype=float)
+        bc_type = ((1, dy[0]), (1, dy[-1]))
+    return CubicSpline(t, y, axis=0, bc_type=bc_type).c
+
+"""
+Evaluate spline coefficients c on segment k, s seconds after its knot
+Return value and derivative
+"""
+def eval_spline(c, k, s):
+    c3, c2, c1, c0 = c[0, k], c[1, k], c[2, k], c[3, k]
+    val = ((c3 * s + c2) * s + c1) * s + c0
+    der = (3 * c3 * s + 2 * c2) * s + c1
+    return val, der
+
+"""
+Quaternion [x, y, z, w] from rotation vector
+"""
+def quat_from_rotvec(r):
+    angle = np.sqrt(r[0]*r[0] + r[1]*r[1] + r[2]*r[2])
+    if angle < 1e-8:
+        # Small angle expansion
+        k = 0.5 - angle * angle / 48
+    else:
+        k = np.sin(0.5 * angle) / angle
+    return np.array([k * r[0], k * r[1], k * r[2], np.cos(0.5 * angle)])
+
+"""
+Hamilton product p * q of quaternions [x, y, z, w]
+"""
+def quat_mul(p, q):
+    px, py, pz, pw = p
+    qx, qy, qz, qw = q
+    return np.array([
+                    pw*qx + px*qw + py*qz - pz*qy,
+                    pw*qy - px*qz + py*qw + pz*qx,
+                    pw*qz + px*qy - py*qx + pz*qw,
+                    pw*qw - px*qx - py*qy - pz*qz,
+                    ])
+
+"""
+Rotation vector of quaternion [x, y, z, w], with angle in [0, pi]
+"""
+def rotvec_from_quat(q):
+    x, y, z, w = q
+    if w < 0:
+        x, y, z, w = -x, -y, -z, -w
+    s = np.sqrt(x*x + y*y + z*z)
+    if s < 1e-8:
+        # Small angle expansion
+        k = 2 / w
+    else:
+        k = 2 * np.arctan2(s, w) / s
+    return np.array([k * x, k * y, k * z])
+
+"""
+Conjugate (inverse, for unit quaternions) of quaternion [x, y, z, w]
+"""
+def quat_conj(q):
+    return np.array([-q[0], -q[1], -q[2], q[3]])
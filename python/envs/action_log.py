@@ -0,0 +1,157 @@
+"""Append-only binary action log for the cube environments.
+
+The log is one fixed size numeric record per env step (see ``ACTION_LOG_DTYPE``)
+preceded by a small JSON header. Records are written in chunks by a background
+thread, and the file is read back as a memory mapped numpy structured array.
+"""
+import json
+import queue
+import struct
+import threading
+
+import numpy as np
+
+MAGIC = b"RRCALOG1"
+HEADER_ALIGN = 64
+
+ACTION_LOG_DTYPE = np.dtype([
+    ("t", np.int64),
+    ("action_torque", np.float64, (9,)),    # NaN if action has no torque
+    ("action_position", np.float64, (9,)),  # NaN if action has no position
+    ("robot_position", np.float64, (9,)),
+    ("robot_velocity", np.float64, (9,)),
+    ("robot_torque", np.float64, (9,)),
+    ("object_position", np.float64, (3,)),
+    ("object_orientation", np.float64, (4,)),
+    ("goal_position", np.float64, (3,)),
+    ("goal_orientation", np.float64, (4,)),
+    ("reward", np.float64),
+    ("cam0_timestamp", np.float64),
+])
+
+
+class ActionLogWriter:
+    """Writes ``ACTION_LOG_DTYPE`` records to a file in chunks.
+
+    Records are filled into a preallocated chunk in place. Full chunks are
+    handed to a background thread, which writes them to the file and hands the
+    buffer back for reuse, so memory is bounded by ``num_chunks * chunk_size``
+    records and the stepping thread never waits on disk unless all chunks are
+    in flight.
+    """
+
+    def __init__(self, filepath, metadata=None, chunk_size=1000, num_chunks=4):
+        """Initialize.
+        Args:
+            filepath (str): Log file, truncated if it exists.
+            metadata (dict): JSON serializable data stored in the header,
+                e.g. initial and goal pose.
+            chunk_size (int): Number of records per chunk.
+            num_chunks (int): Number of chunk buffers.
+        """
+        self.filepath = filepath
+        self._file = open(filepath, "wb", buffering=0)
+        self._file.write(_make_header(metadata))
+
+        self._free = queue.Queue()
+        for _ in range(num_chunks):
+            self._free.put(np.zeros(chunk_size, dtype=ACTION_LOG_DTYPE))
+        self._pending = queue.Queue()
+        self._error = None
+        self._thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._thread.start()
+
+        self._chunk = self._free.get()
+        self._n = 0
+        self.num_records = 0
+
+    def next_record(self):
+        """Get the next record to fill in place, as a numpy record."""
+        if self._n == self._chunk.shape[0]:
+            self._submit()
+        record = self._chunk[self._n]
+        self._n += 1
+        self.num_records += 1
+        return record
+
+    def flush(self):
+        """Write all records so far, and block until they are on disk."""
+        if self._n > 0:
+            self._submit()
+        self._pending.join()
+        if self._error is not None:
+            raise self._error
+
+    def close(self):
+        if self._file.closed:
+            return
+        try:
+            self.flush()
+        finally:
+            self._pending.put(None)
+            self._thread.join()
+            self._file.close()
+
+    def _submit(self):
+        self._pending.put((self._chunk, self._n))
+        self._chunk = self._free.get()
+        self._n = 0
+
+    def _write_loop(self):
+        while True:
+            item = self._pending.get()
+            if item is None:
+                self._pending.task_done()
+                break
+            chunk, n = item
+            try:
+                if self._error is None:
+                    self._file.write(chunk[:n].tobytes())
+            except OSError as e:
+                self._error = e
+            self._free.put(chunk)
+            self._pending.task_done()
+
+
+def load_action_log(filepath):
+    """Load action log written by :class:`ActionLogWriter`.
+    Args:
+        filepath (str): Log file.
+    Returns:
+        tuple:
+        - records (np.memmap): Read-only structured array of records, so
+          ``records["robot_position"]`` is a (num_records, 9) view.
+        - metadata (dict): Metadata stored in the header.
+    """
+    with open(filepath, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("{} is not an action log".format(filepath))
+        (header_len,) = struct.unpack("<I", f.read(4))
+        header = json.loads(f.read(header_len).decode("utf-8"))
+        file_size = f.seek(0, 2)
+    offset = _header_size(header_len)
+
+    # JSON turns the descr tuples into lists
+    dtype = np.dtype([tuple(field[:2]) + tuple(tuple(shape) for shape in field[2:])
+                      for field in header["descr"]])
+    # Ignore a partially written last record
+    num_records = (file_size - offset) // dtype.itemsize
+    if num_records == 0:
+        return np.zeros(0, dtype=dtype), header["metadata"]
+    records = np.memmap(filepath, dtype=dtype, mode="r", offset=offset, shape=(num_records,))
+    return records, header["metadata"]
+
+
+def _header_size(header_len):
+    size = len(MAGIC) + 4 + header_len
+    return size + (-size) % HEADER_ALIGN
+
+
+def _make_header(metadata):
+    header = json.dumps({
+        "descr": np.lib.format.dtype_to_descr(ACTION_LOG_DTYPE),
+        "metadata": metadata or {},
+    }).encode("utf-8")
+    # Pad with spaces, so records start at an aligned offset
+    header += b" " * (_header_size(len(header)) - len(MAGIC) - 4 - len(header))
+    return MAGIC + struct.pack("<I", len(header)) + header
@@ -16,9 +16,43 @@ except ImportError:
 import trifinger_simulation
 import trifinger_simulation.visual_objects
 import rrc_iprl_package.pybullet_utils as pbutils
+from rrc_iprl_package.envs.action_log import ActionLogWriter
+from rrc_iprl_package.envs.platform_cache import PlatformCache
+from rrc_iprl_package.logging_utils import get_logger
 from trifinger_simulation import trifingerpro_limits
 from trifinger_simulation.tasks import move_cube
 
+logger = get_logger("envs.cube_env")
+
+
+def evaluate_state_batch(goal_pose, actual_pose, difficulty):
+    """Vectorized move_cube.evaluate_state, equal to it for each pair of poses.
+    Args:
+        goal_pose (dict): Goal poses, with positions of shape (..., 3) and
+            orientations of shape (..., 4).
+        actual_pose (dict): Actual poses, shaped like goal_pose.
+        difficulty (int): The difficulty level of the goal.
+    Returns:
+        Costs of shape (...).
+    """
+    # env_wrappers imports this module
+    from rrc_iprl_package.envs.env_wrappers import (compute_orientation_error_batch,
+                                                    compute_position_error_batch)
+
+    if difficulty not in (1, 2, 3, 4):
+        raise ValueError("Invalid difficulty %d" % difficulty)
+    goal_position = np.asarray(goal_pose["position"], dtype=float)
+    actual_position = np.asarray(actual_pose["position"], dtype=float)
+    xy_dist = compute_position_error_batch(goal_position[..., :2], actual_position[..., :2])
+    z_dist = np.abs(goal_position[..., 2] - actual_position[..., 2])
+    # weight xy- and z-parts by their expected range, as evaluate_state does
+    error = (xy_dist / (move_cube._ARENA_RADIUS * 2) + z_dist / move_cube._max_height) / 2
+    if difficulty == 4:
+        orientation_error = compute_orientation_error_batch(goal_pose["orientation"],
+                                                            actual_pose["orientation"])
+        error = (error + orientation_error / np.pi) / 2
+    return error
+
 
 class ActionType(enum.Enum):
     """Different action types that can be used to control the robot."""
@@ -42,6 +76,13 @@ class ActionType(enum.Enum):
 class RealRobotCubeEnv(gym.GoalEnv):
     """Gym environment for moving cubes with simulated TriFingerPro."""
 
+    # Reuse one simulated platform across episodes (see PlatformCache)
+    # instead of building a new one on every reset
+    FAST_RESET = True
+    # With frameskip, only build the observation of the last step, and only
+    # compute the reward when the object pose has changed
+    FAST_STEP = True
+
     def __init__(
         self,
         cube_goal_pose: dict,
@@ -64,6 +105,10 @@ class RealRobotCubeEnv(gym.GoalEnv):
                 See :class:`ActionType` for details.
             frameskip (int):  Number of actual control steps to be performed in
                 one call of step().
+            num_steps (int): Episode length in calls of step().
+            save_npz (str): If set, stream a binary action log of each episode
+                to this file.  Read it with
+                :func:`rrc_iprl_package.envs.action_log.load_action_log`.
         """
         # Basic initialization
         # ====================
@@ -89,6 +134,8 @@ class RealRobotCubeEnv(gym.GoalEnv):
         # will be initialized in reset()
         self.platform = None
         self.visualization = visualization
+        self.goal_marker = None
+        self._platform_cache = PlatformCache(visualization)
 
         # Create the action and observation spaces
         # ========================================
@@ -181,7 +228,7 @@ class RealRobotCubeEnv(gym.GoalEnv):
                 }
             )
         self.save_npz = save_npz
-        self.action_log = []
+        self.action_log = None # ActionLogWriter, opened on first logged step
 
     def compute_reward(self, achieved_goal, desired_goal, info):
         """Compute the reward for the given achieved and desired goal.
@@ -200,13 +247,33 @@ class RealRobotCubeEnv(gym.GoalEnv):
                     ob['desired_goal'],
                     info,
                 )
+            If the goals are batches, with positions of shape (B, 3) and
+            orientations of shape (B, 4), an array of B rewards.
         """
+        if np.ndim(achieved_goal["position"]) > 1:
+            return -evaluate_state_batch(desired_goal, achieved_goal, info["difficulty"])
         return -move_cube.evaluate_state(
             move_cube.Pose.from_dict(desired_goal),
             move_cube.Pose.from_dict(achieved_goal),
             info["difficulty"],
         )
 
+    def _compute_pose_reward(self, object_pose, goal_pose):
+        """Compute the reward for the given object pose, as compute_reward()
+        does for the corresponding achieved and desired goal.
+        Args:
+            object_pose: Current pose of the object, with attributes
+                ``position`` and ``orientation``.
+            goal_pose (move_cube.Pose): Goal pose of the object.
+        Returns:
+            float: The reward.
+        """
+        if type(self).compute_reward is not RealRobotCubeEnv.compute_reward:
+            achieved_goal = {"position": object_pose.position,
+                             "orientation": object_pose.orientation}
+            return self.compute_reward(achieved_goal, self.goal, self.info)
+        return -move_cube.evaluate_state(goal_pose, object_pose, self.info["difficulty"])
+
     def step(self, action):
         """Run one timestep of the environment's dynamics.
         When end of episode is reached, you are responsible for calling
@@ -241,23 +308,45 @@ class RealRobotCubeEnv(gym.GoalEnv):
             num_steps = max(1, num_steps - excess)
 
         reward = 0.0
-        for _ in range(num_steps):
-            # send action to robot
+        if self.FAST_STEP:
             robot_action = self._gym_action_to_robot_action(action)
-            t = self.platform.append_desired_action(robot_action)
-
+            goal_pose = move_cube.Pose.from_dict(self.goal)
+            object_pose = pose_reward = None
+            for _ in range(num_steps):
+                # send action to robot
+                t = self.platform.append_desired_action(robot_action)
+
+                # the object pose is only updated with the camera rate, until
+                # then the reward is the same as in the previous step
+                camera_object_pose = self.platform.get_camera_observation(t).object_pose
+                if camera_object_pose is not object_pose:
+                    object_pose = camera_object_pose
+                    pose_reward = self._compute_pose_reward(object_pose, goal_pose)
+                reward += pose_reward
+
+                self.step_count = t
+                # make sure to not exceed the episode length
+                if self.step_count >= self.episode_length:
+                    break
             observation = self._create_observation(t, action)
+        else:
+            for _ in range(num_steps):
+                # send action to robot
+                robot_action = self._gym_action_to_robot_action(action)
+                t = self.platform.append_desired_action(robot_action)
 
-            reward += self.compute_reward(
-                observation["achieved_goal"],
-                observation["desired_goal"],
-                self.info,
-            )
+                observation = self._create_observation(t, action)
+
+                reward += self.compute_reward(
+                    observation["achieved_goal"],
+                    observation["desired_goal"],
+                    self.info,
+                )
 
-            self.step_count = t
-            # make sure to not exceed the episode length
-            if self.step_count >= self.episode_length:
-                break
+                self.step_count = t
+                # make sure to not exceed the episode length
+                if self.step_count >= self.episode_length:
+                    break
 
         is_done = self.step_count >= self.episode_length
         self.write_action_log(observation, action, reward)
@@ -266,27 +355,48 @@ class RealRobotCubeEnv(gym.GoalEnv):
         return observation, reward, is_done, self.info
 
     def write_action_log(self, observation, action, reward):
-        if self.save_npz:
-            self.action_log.append(dict(
-                observation=observation, action=action, t=self.step_count,
-                reward=reward))
+        if not self.save_npz:
+            return
+        if self.action_log is None:
+            metadata = dict(
+                initial_pose={k: np.asarray(v).tolist() for k, v in self.initial_pose.to_dict().items()},
+                goal_pose={k: np.asarray(v).tolist() for k, v in self.goal.items()},
+                action_type=self.action_type.name)
+            self.action_log = ActionLogWriter(self.save_npz, metadata)
+
+        record = self.action_log.next_record()
+        record["t"] = self.step_count
+        if isinstance(action, dict):
+            record["action_torque"] = action["torque"]
+            record["action_position"] = action["position"]
+        elif self.action_type == ActionType.TORQUE:
+            record["action_torque"] = action
+            record["action_position"] = np.nan
+        else:
+            record["action_torque"] = np.nan
+            record["action_position"] = action
+        robot_observation = observation["observation"]
+        record["robot_position"] = robot_observation["position"]
+        record["robot_velocity"] = robot_observation["velocity"]
+        record["robot_torque"] = robot_observation["torque"]
+        record["object_position"] = observation["achieved_goal"]["position"]
+        record["object_orientation"] = observation["achieved_goal"]["orientation"]
+        record["goal_position"] = observation["desired_goal"]["position"]
+        record["goal_orientation"] = observation["desired_goal"]["orientation"]
+        record["reward"] = reward
+        record["cam0_timestamp"] = observation["cam0_timestamp"]
 
     def save_action_log(self):
-        if self.save_npz and self.action_log:
-            self.action_log.append(dict(initial_pose=self.initial_pose.to_dict(),
-                                   goal_pose=self.goal))
-
-            np.savez(self.save_npz, action_log=self.action_log, allow_pickle=True)
-            del self.action_log
-        self.action_log = []
+        if self.action_log is not None:
+            self.action_log.close()
+        self.action_log = None
 
     def reset(self):
         # By changing the `_reset_*` method below you can switch between using
         # the platform frontend, which is needed for the submission system, and
         # the direct simulation, which may be more convenient if you want to
         # pre-train locally in simulation.
-        if self.save_npz and self.action_log:
-            self.save_action_log()
+        self.save_action_log()
 
         if robot_fingers is not None:
             self._reset_platform_frontend()
@@ -310,9 +420,8 @@ class RealRobotCubeEnv(gym.GoalEnv):
                 cur_vel = observation["observation"]["velocity"]
                 cur_pos = observation["observation"]["position"]
 
-                print("cur vel: {}".format(cur_vel))
-                print("cur pos: {}".format(cur_pos))
-                print("default pos: {}".format(self.default_position))
+                logger.debug("cur vel: %s, cur pos: %s, default pos: %s",
+                             cur_vel, cur_pos, self.default_position)
         return observation
 
     def _reset_platform_frontend(self):
@@ -328,13 +437,18 @@ class RealRobotCubeEnv(gym.GoalEnv):
         With this the env can be used without backend.
         """
         # reset simulation
-        del self.platform
+        if self.FAST_RESET:
+            # goal marker must be removed before the saved simulation state is restored
+            self.goal_marker = None
+            self.platform = self._platform_cache.get(self.initial_pose)
+        else:
+            del self.platform
 
-        # initialize simulation
-        self.platform = trifinger_simulation.TriFingerPlatform(
-            visualization=self.visualization,
-            initial_object_pose=self.initial_pose,
-        )
+            # initialize simulation
+            self.platform = trifinger_simulation.TriFingerPlatform(
+                visualization=self.visualization,
+                initial_object_pose=self.initial_pose,
+            )
 
         # visualize the goal
         if self.visualization:
@@ -383,14 +497,13 @@ class RealRobotCubeEnv(gym.GoalEnv):
         if osp.exists("/output"):
             filtered_quat = camera_observation.filtered_object_pose.orientation
             filtered_quat_norm = np.linalg.norm(filtered_quat)
-            print("filtered pose:")
-            print(camera_observation.filtered_object_pose.position)
-            print(camera_observation.filtered_object_pose.orientation)
-            print("quat norm: {}".format(filtered_quat_norm))
+            logger.debug("filtered pose: %s %s, quat norm: %s",
+                         camera_observation.filtered_object_pose.position,
+                         filtered_quat, filtered_quat_norm)
             if filtered_quat_norm == 0:
                 quat = camera_observation.object_pose.orientation
             else:
-                print("USING FILTERED QUAT")
+                logger.debug("USING FILTERED QUAT")
                 quat = filtered_quat
                 
             observation["filtered_achieved_goal"] = {
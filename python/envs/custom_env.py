@@ -1,6 +1,7 @@
 """Custom Gym environment for the Real Robot Challenge Phase 1 (Simulation)."""
 import numpy as np
 import os.path as osp
+from collections import OrderedDict
 import gym
 import pybullet
 
@@ -24,6 +25,8 @@ from trifinger_simulation.tasks import move_cube
 import rrc_iprl_package.pybullet_utils as pbutils
 from rrc_iprl_package.envs import cube_env
 from rrc_iprl_package.envs.cube_env import ActionType
+from rrc_iprl_package.envs.obs_layout import ObservationLayout
+from rrc_iprl_package.envs.platform_cache import PlatformCache
 from rrc_iprl_package.control.controller_utils import PolicyMode
 from rrc_iprl_package.control.control_policy import HierarchicalControllerPolicy
 
@@ -78,6 +81,8 @@ class PushCubeEnv(gym.Env):
 
         # will be initialized in reset()
         self.platform = None
+        self._platform_cache = None
+        self.goal_marker = None
         self._prev_action = None
 
         # Create the action and observation spaces
@@ -186,15 +191,15 @@ class PushCubeEnv(gym.Env):
         # set this to false to disable pyBullet's simulation
         visualization = True
 
-        # reset simulation
-        del self.platform
+        # reset simulation, reusing the platform of the previous episode
+        if self._platform_cache is None:
+            self._platform_cache = PlatformCache(visualization)
+        # goal marker must be removed before the saved simulation state is restored
+        self.goal_marker = None
 
         # initialize simulation
         initial_object_pose = move_cube.sample_goal(difficulty=-1)
-        self.platform = trifinger_simulation.TriFingerPlatform(
-            visualization=visualization,
-            initial_object_pose=initial_object_pose,
-        )
+        self.platform = self._platform_cache.get(initial_object_pose)
 
         # visualize the goal
         if self.visualization:
@@ -325,6 +330,7 @@ class HierarchicalPolicyWrapper(ObservationWrapper):
     def __init__(self, env, policy):
         assert isinstance(env.unwrapped, cube_env.RealRobotCubeEnv), 'env expects type CubeEnv'
         self.env = env
+        self._policy_platform_cache = PlatformCache()
         self.reward_range = self.env.reward_range
         # set observation_space and action_space below
         spaces = trifinger_simulation.TriFingerPlatform.spaces
@@ -368,6 +374,7 @@ class HierarchicalPolicyWrapper(ObservationWrapper):
         if policy:
             self.rl_observation_names = policy.observation_names
             self.rl_observation_space = policy.rl_observation_space
+            self._rl_obs_layout = None
             obs_dict = {'impedance': self.env.observation_space}
             if self.rl_observation_space:
                 obs_dict['rl'] = self.rl_observation_space
@@ -399,8 +406,12 @@ class HierarchicalPolicyWrapper(ObservationWrapper):
             "goal_object_position": self.goal["position"],
             "goal_object_orientation": self.goal["orientation"],
         }
-        observation = np.concatenate([observation[k].flatten() for k in self.rl_observation_names])
-        return observation
+        if self._rl_obs_layout is None:
+            # float64 like np.concatenate of the fields, in rl_observation_names order
+            self._rl_obs_layout = ObservationLayout(gym.spaces.Dict(OrderedDict([
+                (k, gym.spaces.Box(-np.inf, np.inf, shape=np.shape(observation[k]), dtype=np.float64))
+                for k in self.rl_observation_names])))
+        return self._rl_obs_layout.flatten(observation)
 
     def process_observation_impedance(self, observation):
         return observation
@@ -410,15 +421,18 @@ class HierarchicalPolicyWrapper(ObservationWrapper):
         initial_object_pose = move_cube.Pose.from_dict(obs['impedance']['achieved_goal'])
         # initial_object_pose = move_cube.sample_goal(difficulty=-1)
 
-        self.policy.platform = trifinger_simulation.TriFingerPlatform(
-            visualization=False,
-            initial_object_pose=initial_object_pose,
-        )
+        self.policy.platform = self._policy_platform_cache.get(initial_object_pose)
         #import pdb; pdb.set_trace()
         self.policy.reset_policy(obs['impedance'])
         self.step_count = 0
         return obs
 
+    def close(self):
+        # Stops the async planner worker of the policy
+        if self.policy:
+            self.policy.close()
+        super(HierarchicalPolicyWrapper, self).close()
+
     def _step(self, action):
         if self.unwrapped.platform is None:
             raise RuntimeError("Call `reset()` before starting to step.")
@@ -436,6 +450,9 @@ class HierarchicalPolicyWrapper(ObservationWrapper):
             excess = step_count_after - move_cube.episode_length
             num_steps = max(1, num_steps - excess)
 
+        if self.unwrapped.FAST_STEP:
+            return self._fast_step(action, num_steps)
+
         reward = 0.0
         for _ in range(num_steps):
 
@@ -471,6 +488,38 @@ class HierarchicalPolicyWrapper(ObservationWrapper):
 
         return observation, reward, is_done, self.env.info
 
+    def _fast_step(self, action, num_steps):
+        """Same as the loop in _step(), but only builds the observation of the
+        last step, and only computes the reward when the object pose changes"""
+        env = self.unwrapped
+        # If running with backend, observe at t, without backend at t + 1 to
+        # avoid twitchiness
+        obs_offset = 0 if osp.exists("/output") else 1
+        robot_action = self._gym_action_to_robot_action(action)
+        goal_pose = move_cube.Pose.from_dict(env.goal)
+        object_pose = pose_reward = None
+
+        reward = 0.0
+        for _ in range(num_steps):
+            # send action to robot
+            self.step_count = t = env.platform.append_desired_action(robot_action)
+
+            camera_object_pose = env.platform.get_camera_observation(t + obs_offset).object_pose
+            if camera_object_pose is not object_pose:
+                object_pose = camera_object_pose
+                pose_reward = env._compute_pose_reward(object_pose, goal_pose)
+            reward += pose_reward
+
+            if self.step_count >= self.episode_length:
+                break
+
+        observation = env._create_observation(t + obs_offset, action)
+        env.write_action_log(observation, action, reward)
+
+        is_done = self.step_count == self.episode_length
+
+        return observation, reward, is_done, self.env.info
+
     def _gym_action_to_robot_action(self, gym_action):
         if self.action_type == ActionType.TORQUE:
             robot_action = Action(torque=gym_action, position=np.repeat(np.nan, 9))
@@ -500,6 +549,7 @@ class ResidualPolicyWrapper(ObservationWrapper):
         self.rl_cp_params = rl_cp_params
         self.goal_env = goal_env
         self.impedance_controller = None
+        self._mock_platform_cache = PlatformCache()
         self.observation_names = PushCubeEnv.observation_names
         self.make_obs_space()
         assert env.action_type in [ActionType.TORQUE,
@@ -580,15 +630,21 @@ class ResidualPolicyWrapper(ObservationWrapper):
     def process_observation_residual(self, observation):
         return observation
 
+    def close(self):
+        # Stops the async planner worker of the impedance controller
+        if self.impedance_controller is not None:
+            self.impedance_controller.close()
+        super(ResidualPolicyWrapper, self).close()
+
     def init_impedance_controller(self):
         init_pose, goal_pose = self.process_obs_init_goal(self._obs_dict['impedance'])
+        # A new controller is built every episode, with its own planner worker
+        if self.impedance_controller is not None:
+            self.impedance_controller.close()
         self.impedance_controller = ImpedanceControllerPolicy(
                 self.action_space, init_pose, goal_pose)
         self.impedance_controller.set_init_goal(init_pose, goal_pose)
-        mock_platform = trifinger_simulation.TriFingerPlatform(
-            visualization=False,
-            initial_object_pose=self.initial_pose,
-        )
+        mock_platform = self._mock_platform_cache.get(self.initial_pose)
         self.impedance_controller.mock_pinocchio_utils(mock_platform)
         self.impedance_controller.reset_policy(self.platform)
 
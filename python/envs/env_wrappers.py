@@ -17,6 +17,8 @@ from rrc_iprl_package.control import controller_utils as c_utils
 from rrc_iprl_package.control.custom_pinocchio_utils import CustomPinocchioUtils
 from rrc_iprl_package.envs.cube_env import CubeEnv, ActionType
 from rrc_iprl_package.envs.custom_env import PushCubeEnv, ActionType
+from rrc_iprl_package.envs.obs_layout import ObservationLayout
+from rrc_iprl_package.envs.platform_cache import PlatformCache
 
 from trifinger_simulation import TriFingerPlatform
 from trifinger_simulation import visual_objects
@@ -300,6 +302,8 @@ class PushCubeEnv(gym.Env):
 
         # will be initialized in reset()
         self.platform = None
+        self.goal_marker = None
+        self._platform_cache = PlatformCache(visualization)
 
         # Create the action and observation spaces
         # ========================================
@@ -355,8 +359,9 @@ class PushCubeEnv(gym.Env):
         return robot_action
 
     def reset(self):
-        # reset simulation
-        del self.platform
+        # reset simulation, reusing the platform of the previous episode
+        # goal marker must be removed before the saved simulation state is restored
+        self.goal_marker = None
 
         # initialize simulation
         if self.initializer is None:
@@ -384,11 +389,7 @@ class PushCubeEnv(gym.Env):
             initial_object_pose=self.initializer.get_initial_state()
             goal_object_pose = self.initializer.get_goal()
 
-        self.platform = TriFingerPlatform(
-            visualization=self.visualization,
-            initial_robot_position=initial_robot_position,
-            initial_object_pose=initial_object_pose,
-        )
+        self.platform = self._platform_cache.get(initial_object_pose, initial_robot_position)
 
         self.goal = {
             "position": goal_object_pose.position,
@@ -577,11 +578,12 @@ class SparseCubeEnv(CubeEnv):
         self.ori_thresh = ori_thresh
 
     def compute_reward(self, achieved_goal, desired_goal, info):
-        goal_pose = move_cube.Pose.from_dict(desired_goal)
-        obj_pose = move_cube.Pose.from_dict(achieved_goal)
-        pos_error = np.linalg.norm(goal_pose.position - obj_pose.position)
-        ori_error = compute_orientation_error(goal_pose, obj_pose, scale=False)
-        return float(pos_error < self.pos_thresh and ori_error < self.ori_thresh)
+        pos_error = compute_position_error_batch(desired_goal['position'],
+                                                 achieved_goal['position'])
+        ori_error = compute_orientation_error_batch(desired_goal['orientation'],
+                                                    achieved_goal['orientation'])
+        success = (pos_error < self.pos_thresh) & (ori_error < self.ori_thresh)
+        return np.asarray(success, dtype=float)[()]
 
 
 @configurable(pickleable=True)
@@ -779,6 +781,9 @@ class FlattenGoalWrapper(gym.ObservationWrapper):
             k: flatten_space(v)
             for k, v in env.observation_space.spaces.items()
             })
+        # observations are written into preallocated buffers, each key is a
+        # view of its slice
+        self._obs_layout = ObservationLayout(env.observation_space)
 
     def update_goal_sampler(self, goal_sampler):
         self._sample_goal_fun = goal_sampler
@@ -800,16 +805,10 @@ class FlattenGoalWrapper(gym.ObservationWrapper):
         self.unwrapped.goal = {'position': pos, 'orientation': ori}
 
     def compute_reward(self, achieved_goal, desired_goal, info):
+        # batches of goals, (B, 7), are passed on as dicts of (B, 3) positions
+        # and (B, 4) orientations
         if len(achieved_goal.shape) > 1:
-            r = []
             info = {"difficulty": self.initializer.difficulty}
-            for i in range(achieved_goal.shape[0]):
-                pos, ori = achieved_goal[i,:3], achieved_goal[i,3:]
-                ag = dict(position=pos, orientation=ori)
-                pos, ori = desired_goal[i,:3], desired_goal[i,3:]
-                dg = dict(position=pos, orientation=ori)
-                r.append(self.env.compute_reward(ag, dg, info))
-            return np.array(r)
         achieved_goal = dict(position=achieved_goal[...,:3], orientation=achieved_goal[...,3:])
         desired_goal = dict(position=desired_goal[...,:3], orientation=desired_goal[...,3:])
         return self.env.compute_reward(achieved_goal, desired_goal, info)
@@ -834,9 +833,7 @@ class FlattenGoalWrapper(gym.ObservationWrapper):
         return self.observation(obs)
 
     def observation(self, observation):
-        observation = {k: gym.spaces.flatten(self.env.observation_space[k], v)
-                for k, v in observation.items()}
-        return observation
+        return self._obs_layout.views(self._obs_layout.flatten(observation))
 
 
 # DEPRECATED, USE CubeRewardWrapper INSTEAD
@@ -937,6 +934,7 @@ class CubeRewardWrapper(gym.Wrapper):
         self._prev_obs = None
         self._augment_reward = augment_reward
         self.rew_fn = rew_fn
+        self._obs_layouts = {}
 
     @property
     def target_dist(self):
@@ -1007,54 +1005,67 @@ class CubeRewardWrapper(gym.Wrapper):
         return self._fingertip_coef * step_ftip_rew
 
     def compute_reward(self, achieved_goal, desired_goal, info):
+        """Goals are dicts of positions and orientations, or arrays of
+        positions and orientations concatenated, both either for one goal or
+        for a batch (leading dimension B), which gives a batch of rewards."""
         if isinstance(achieved_goal, dict):
             obj_pos, obj_ori = achieved_goal['position'], achieved_goal['orientation']
             goal_pos, goal_ori = desired_goal['position'], desired_goal['orientation']
         else:
-            obj_pos, obj_ori = achieved_goal[:3], achieved_goal[3:]
-            goal_pos, goal_ori = desired_goal[:3], desired_goal[3:]
-        goal_pose = move_cube.Pose(position=goal_pos, orientation=goal_ori)
-        object_pose = move_cube.Pose(position=obj_pos, orientation=obj_ori)
-        return self._compute_reward(goal_pose, object_pose, info=info)
+            obj_pos, obj_ori = achieved_goal[..., :3], achieved_goal[..., 3:]
+            goal_pos, goal_ori = desired_goal[..., :3], desired_goal[..., 3:]
+        return self._compute_reward_batch(goal_pos, goal_ori, obj_pos, obj_ori, info=info)
 
     def _compute_reward(self, goal_pose, object_pose, prev_object_pose=None, info=None):
-        info = info or self.unwrapped.info
-        pos_error = self.compute_position_error(goal_pose, object_pose)
+        prev_obj_pos = prev_obj_ori = None
         if prev_object_pose is not None:
-            prev_pos_error = self.compute_position_error(goal_pose, prev_object_pose)
-            step_rew = step_pos_rew = prev_pos_error - pos_error
-        else:
-            step_rew = 0
-        if self.difficulty == 4 or self._ori_coef:
-            ori_error = compute_orientation_error(goal_pose, object_pose, scale=True)
-            if prev_object_pose is not None:
-                prev_ori_error = compute_orientation_error(goal_pose, prev_object_pose, scale=True)
-                step_ori_rew = prev_ori_error - ori_error
-                step_rew = (step_pos_rew * self._pos_coef +
-                            step_ori_rew * self._ori_coef)
-            else:
-                step_rew = 0
+            prev_obj_pos, prev_obj_ori = prev_object_pose.position, prev_object_pose.orientation
+        return self._compute_reward_batch(goal_pose.position, goal_pose.orientation,
+                                          object_pose.position, object_pose.orientation,
+                                          prev_obj_pos, prev_obj_ori, info)
+
+    def _compute_reward_batch(self, goal_pos, goal_ori, obj_pos, obj_ori,
+                              prev_obj_pos=None, prev_obj_ori=None, info=None):
+        """Vectorized _compute_reward, for poses given as positions (..., 3) and
+        orientations (..., 4). Returns rewards of shape (...), info values are
+        of the same shape."""
+        info = info or self.unwrapped.info
+        use_ori = self.difficulty == 4 or self._ori_coef
+        pos_error = compute_position_error_batch(goal_pos, obj_pos)
+        if use_ori:
+            ori_error = compute_orientation_error_batch(goal_ori, obj_ori, scale=True)
+        step_rew = 0
+        if prev_obj_pos is not None:
+            step_rew = compute_position_error_batch(goal_pos, prev_obj_pos) - pos_error
+            if use_ori:
+                prev_ori_error = compute_orientation_error_batch(goal_ori, prev_obj_ori, scale=True)
+                step_rew = (step_rew * self._pos_coef +
+                            (prev_ori_error - ori_error) * self._ori_coef)
         if self.rew_fn == 'lin':
             rew = self._pos_coef * (1 - pos_error/self.target_dist)
-            if self.difficulty == 4 or self._ori_coef:
-                rew += self._ori_coef * (1 - ori_error)
+            if use_ori:
+                rew = rew + self._ori_coef * (1 - ori_error)
         elif self.rew_fn == 'exp':
             rew = self._pos_coef * np.exp(-pos_error/self.target_dist)
-            if self.difficulty == 4 or self._ori_coef:
-                rew += self._ori_coef * np.exp(-ori_error)
+            if use_ori:
+                rew = rew + self._ori_coef * np.exp(-ori_error)
+        else:
+            raise ValueError("Invalid rew_fn {}".format(self.rew_fn))
 
         ac_penalty = -np.linalg.norm(self._prev_action) * self._ac_norm_pen
         info['ac_penalty'] = ac_penalty
-        if step_rew:
+        if np.any(step_rew):
             info['step_rew'] = step_rew
         info['rew'] = rew
         info['pos_error'] = pos_error
-        if self.difficulty == 4 or self._ori_coef:
+        if use_ori:
             info['ori_error'] = ori_error
         total_rew = step_rew * 3 + rew + ac_penalty
-        if pos_error < DIST_THRESH or ori_error < ORI_THRESH:
-            return 2.5 * ((pos_error < DIST_THRESH) + (ori_error < ORI_THRESH))
-        return total_rew
+        # fixed reward when close to the goal position or orientation
+        is_success = pos_error < DIST_THRESH
+        if use_ori:
+            is_success = is_success | (ori_error < ORI_THRESH)
+        return np.where(is_success, 2.5, total_rew)[()]
 
     def unflatten_observation(self, observation, obs_space=None):
         filter_keys = []
@@ -1066,9 +1077,12 @@ class CubeRewardWrapper(gym.Wrapper):
 
         obs_space = obs_space or self.unwrapped.observation_space
         if isinstance(obs_space, gym.spaces.Dict):
-            if filter_keys:
-                obs_space = gym.spaces.Dict({obs_space[k] for k in filter_keys})
-            observation = utils.unflatten(obs_space, observation)
+            layout_key = (id(obs_space), tuple(filter_keys))
+            if layout_key not in self._obs_layouts:
+                if filter_keys:
+                    obs_space = gym.spaces.Dict({k: obs_space[k] for k in filter_keys})
+                self._obs_layouts[layout_key] = ObservationLayout(obs_space, n_buffers=0)
+            observation = self._obs_layouts[layout_key].unflatten(observation)
         return observation
 
     def get_goal_object_pose(self, observation):
@@ -1085,8 +1099,7 @@ class CubeRewardWrapper(gym.Wrapper):
         return goal_pose, object_pose
 
     def compute_position_error(self, goal_pose, object_pose):
-        pos_error = np.linalg.norm(object_pose.position - goal_pose.position)
-        return pos_error
+        return compute_position_error_batch(goal_pose.position, object_pose.position)
 
 
 class LogInfoWrapper(gym.Wrapper):
@@ -1179,26 +1192,47 @@ class StepRewardWrapper(gym.RewardWrapper):
 
 def compute_orientation_error(goal_pose, actual_pose, scale=False,
                               yaw_only=False, quad=False):
+    return compute_orientation_error_batch(goal_pose.orientation, actual_pose.orientation,
+                                           scale=scale, yaw_only=yaw_only, quad=quad)
+
+
+def compute_orientation_error_batch(goal_ori, actual_ori, scale=False,
+                                    yaw_only=False, quad=False):
+    """Vectorized compute_orientation_error, for quaternions goal_ori and
+    actual_ori of shape (..., 4). Returns errors of shape (...)."""
+    goal_ori, actual_ori = np.broadcast_arrays(np.asarray(goal_ori, dtype=float),
+                                               np.asarray(actual_ori, dtype=float))
+    shape = goal_ori.shape[:-1]
+    goal_ori, actual_ori = goal_ori.reshape(-1, 4), actual_ori.reshape(-1, 4)
     if yaw_only:
-        goal_ori = Rotation.from_quat(goal_pose.orientation).as_euler('xyz')
-        goal_ori[:2] = 0
+        goal_ori = Rotation.from_quat(goal_ori).as_euler('xyz')
+        goal_ori[:, :2] = 0
         goal_rot = Rotation.from_euler('xyz', goal_ori)
-        actual_ori = Rotation.from_quat(actual_pose.orientation).as_euler('xyz')
-        actual_ori[:2] = 0
+        actual_ori = Rotation.from_quat(actual_ori).as_euler('xyz')
+        actual_ori[:, :2] = 0
         actual_rot = Rotation.from_euler('xyz', actual_ori)
     else:
-        goal_rot = Rotation.from_quat(goal_pose.orientation)
-        actual_rot = Rotation.from_quat(actual_pose.orientation)
+        goal_rot = Rotation.from_quat(goal_ori)
+        actual_rot = Rotation.from_quat(actual_ori)
     error_rot = goal_rot.inv() * actual_rot
     orientation_error = error_rot.magnitude()
     # computes orientation error symmetric to 4 quadrants of the cube
     if quad:
         orientation_error = orientation_error % (np.pi/2)
-        if orientation_error > np.pi/4:
-            orientation_error = np.pi/2 - orientation_error
+        orientation_error = np.where(orientation_error > np.pi/4,
+                                     np.pi/2 - orientation_error, orientation_error)
     if scale:
         orientation_error = orientation_error / np.pi
-    return orientation_error
+    return orientation_error.reshape(shape)[()]
+
+
+def compute_position_error_batch(goal_pos, actual_pos):
+    """Euclidean distances between positions goal_pos and actual_pos of shape
+    (..., 3), equal to np.linalg.norm(actual_pos - goal_pos) of each pair.
+    Returns errors of shape (...)."""
+    diff = np.asarray(actual_pos, dtype=float) - np.asarray(goal_pos, dtype=float)
+    # batched dot products round like the dot product in np.linalg.norm
+    return np.sqrt((diff[..., None, :] @ diff[..., :, None])[..., 0, 0])
 
 
 def flatten_space(space):
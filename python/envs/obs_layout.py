@@ -0,0 +1,126 @@
+"""Compiled layout of flattened observations.
+
+``gym.spaces.flatten`` walks the space and concatenates newly allocated arrays
+on every call. ``ObservationLayout`` walks the space once, assigning each Box
+in it a slice of a flat array, in the same order. Observations are then
+flattened by writing each field into a preallocated buffer, and flat arrays
+are unflattened into views.
+"""
+from collections import OrderedDict
+
+import numpy as np
+from gym import spaces
+
+
+class ObservationLayout:
+    """Layout of observations of a space, flattened as by ``gym.spaces.flatten``.
+
+    Supports Box spaces, and Dict and Tuple spaces of them, nested. Unless an
+    output array is given, flatten() writes into one of ``n_buffers``
+    preallocated buffers in turn, so a returned array is only valid until
+    ``n_buffers`` more observations have been flattened (with the default of
+    2, the previous observation can be kept while the next one is used). Copy
+    it to keep it for longer.
+    """
+
+    def __init__(self, space, dtype=None, n_buffers=2):
+        """Initialize.
+        Args:
+            space (gym.Space): Observation space.
+            dtype: dtype of flattened observations, by default the result type
+                of the Boxes of space, as gym.spaces.flatten would give.
+            n_buffers (int): Number of buffers flatten() writes into in turn,
+                0 if observations are only unflattened or flattened into out.
+        """
+        self.space = space
+        self.fields = []  # (path of keys, slice, dtype) of each Box
+        self.slices = {}  # path of keys -> slice of each subspace
+        self._plan, self.size = self._compile(space, (), 0)
+        self.dtype = np.dtype(dtype or np.result_type(*[d for _, _, d in self.fields]))
+        # Values are cast to the dtype of their Box first, as in gym.spaces.flatten
+        self._flatten_plan = [(path, sl, None if dtype == self.dtype else dtype)
+                              for path, sl, dtype in self.fields]
+        # dtype of each top level subspace flattened by itself, None if that of self
+        self._key_slices = []
+        for key_path, sl in self.slices.items():
+            if len(key_path) == 1:
+                key_dtype = np.result_type(*[d for path, _, d in self.fields
+                                             if path[:1] == key_path])
+                self._key_slices.append((key_path[0], sl, None if key_dtype == self.dtype
+                                         else key_dtype))
+        self._buffers = [np.zeros(self.size, dtype=self.dtype) for _ in range(n_buffers)]
+        self._next_buffer = 0
+
+    def _compile(self, space, path, start):
+        """Assign slices to space and its subspaces, starting at offset start.
+        Returns:
+            The plan of space for unflatten(), and the offset where it ends.
+        """
+        end = start
+        if isinstance(space, spaces.Box):
+            end = start + int(np.prod(space.shape))
+            self.fields.append((path, slice(start, end), space.dtype))
+            plan = (slice(start, end), space.shape, space.dtype)
+        elif isinstance(space, spaces.Dict):
+            plan = OrderedDict()
+            for key, subspace in space.spaces.items():
+                plan[key], end = self._compile(subspace, path + (key,), end)
+        elif isinstance(space, spaces.Tuple):
+            plan = []
+            for i, subspace in enumerate(space.spaces):
+                subplan, end = self._compile(subspace, path + (i,), end)
+                plan.append(subplan)
+        else:
+            raise NotImplementedError("ObservationLayout does not support {}".format(space))
+        self.slices[path] = slice(start, end)
+        return plan, end
+
+    def flatten(self, observation, out=None):
+        """Flatten an observation of the space.
+        Args:
+            observation: Observation, with the structure of the space.
+            out (np.ndarray): Array of size self.size to write into, the next
+                preallocated buffer if None.
+        Returns:
+            out, equal to gym.spaces.flatten(self.space, observation).
+        """
+        if out is None:
+            out = self._buffers[self._next_buffer]
+            self._next_buffer = (self._next_buffer + 1) % len(self._buffers)
+        for path, sl, dtype in self._flatten_plan:
+            value = observation
+            for key in path:
+                value = value[key]
+            if dtype is not None:
+                value = np.asarray(value, dtype=dtype)
+            out[sl] = np.ravel(value)
+        return out
+
+    def unflatten(self, flat):
+        """Unflatten a flattened observation into views of it.
+
+        Like gym.spaces.unflatten, Boxes with another dtype than flat are
+        copies instead.
+        """
+        return self._unflatten(self._plan, flat)
+
+    def _unflatten(self, plan, flat):
+        if isinstance(plan, OrderedDict):
+            return OrderedDict([(key, self._unflatten(subplan, flat))
+                                for key, subplan in plan.items()])
+        if isinstance(plan, list):
+            return tuple(self._unflatten(subplan, flat) for subplan in plan)
+        sl, shape, dtype = plan
+        return np.asarray(flat[sl], dtype=dtype).reshape(shape)
+
+    def views(self, flat):
+        """Get views of the top level subspaces of a Dict space in flat, flattened.
+
+        Subspaces with another dtype than flat (when the dtypes of subspaces
+        differ) are copies instead.
+        Returns:
+            dict: Key -> view of flat, equal to gym.spaces.flatten of the
+                subspace and value of key.
+        """
+        return {key: flat[sl] if dtype is None else flat[sl].astype(dtype)
+                for key, sl, dtype in self._key_slices}
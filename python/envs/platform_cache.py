@@ -0,0 +1,125 @@
+"""Reuse one simulated TriFingerPlatform across episodes.
+
+Building a ``TriFingerPlatform`` loads the robot, table and cube URDFs into a
+new pybullet world, which takes hundreds of milliseconds. ``PlatformCache``
+builds the platform once, saves the pybullet state, and resets later episodes
+by restoring that state and moving the cube and fingers to their initial
+poses, which takes well under a millisecond.
+
+Fast reset also resets private bookkeeping of ``TriFingerPlatform`` and
+``SimFinger``, so it depends on their internals. The attributes it resets are
+checked when the platform is built, and a RuntimeError is raised if any is
+missing.
+
+scripts/benchmark_reset.py checks that rollouts on a restored platform match
+those on a newly built one (see the :class:`PlatformCache` docstring).
+"""
+import copy
+
+import pybullet
+import trifinger_simulation
+
+# Private attributes of TriFingerPlatform reset by fast reset
+_PLATFORM_ATTRS = (
+    "_next_camera_trigger_t",
+    "_next_camera_observation_ready_t",
+    "_action_log",
+    "_delayed_camera_observation",
+    "_camera_observation_t",
+    "_get_current_camera_observation",
+)
+# Private attributes of SimFinger reset by fast reset
+_SIMFINGER_ATTRS = ("_t", "_pybullet_client_id")
+# Set by SimFinger once an action is applied
+_APPLIED_TORQUE_ATTR = "_SimFinger__applied_torque"
+
+
+class PlatformCache:
+    """Owns one simulated TriFingerPlatform, reset in place between episodes.
+
+    Without fast reset, a new platform is built for every episode instead.
+    With it, the pybullet state is saved right after the platform is built, so restoring
+    it requires the same set of bodies: bodies added afterwards (e.g. goal
+    markers) must be removed before the next call to :meth:`get`.
+
+    Episodes are not bitwise equal to those of a newly built platform: pybullet
+    solver state that is not part of the saved state (e.g. warm started
+    impulses) carries over from earlier episodes, and contacts amplify the
+    difference. Restored rollouts differ from new platform rollouts no more
+    than new platform rollouts with the cube moved by 10 um do, as checked by
+    scripts/benchmark_reset.py.
+    """
+
+    def __init__(self, visualization=False, fast_reset=True):
+        """Initialize.
+        Args:
+            visualization (bool): If true, the platform runs the pyBullet GUI.
+            fast_reset (bool): If true, reuse the platform across episodes.
+                Otherwise, build a new platform on every call to :meth:`get`.
+        """
+        self.visualization = visualization
+        self.fast_reset = fast_reset
+        self.platform = None
+        self._state_id = None
+
+    def get(self, initial_object_pose, initial_robot_position=None):
+        """Get the platform, reset to the start of an episode.
+        Args:
+            initial_object_pose: Initial pose of the cube, with attributes
+                ``position`` and ``orientation``.
+            initial_robot_position: Initial joint positions, default position
+                of the robot if None.
+        Returns:
+            The TriFingerPlatform, the same object on every call with fast reset.
+        """
+        if initial_robot_position is None:
+            initial_robot_position = trifinger_simulation.TriFingerPlatform.spaces.robot_position.default
+
+        if self.platform is None or not self.fast_reset:
+            self.platform = None
+            self.platform = trifinger_simulation.TriFingerPlatform(
+                visualization=self.visualization,
+                initial_robot_position=initial_robot_position,
+                initial_object_pose=initial_object_pose,
+            )
+            if self.fast_reset:
+                _check_attrs(self.platform)
+                self._state_id = pybullet.saveState(physicsClientId=self.client_id)
+            return self.platform
+
+        platform = self.platform
+        if platform.simfinger._t >= 0 and _APPLIED_TORQUE_ATTR not in platform.simfinger.__dict__:
+            raise RuntimeError("PlatformCache: SimFinger has no attribute {} after applying actions, "
+                               "fast reset does not support this trifinger_simulation version"
+                               .format(_APPLIED_TORQUE_ATTR))
+        pybullet.restoreState(self._state_id, physicsClientId=self.client_id)
+        platform.cube.set_state(initial_object_pose.position, initial_object_pose.orientation)
+        platform.simfinger.reset_finger_positions_and_velocities(initial_robot_position)
+
+        # Reset time index, camera and log bookkeeping as in TriFingerPlatform.__init__
+        platform.simfinger._t = -1
+        # No torque applied yet, observations report zero torque
+        platform.simfinger.__dict__.pop(_APPLIED_TORQUE_ATTR, None)
+        platform._next_camera_trigger_t = 0
+        platform._next_camera_observation_ready_t = None
+        platform._action_log = {
+            "initial_robot_position": copy.copy(initial_robot_position),
+            "initial_object_pose": copy.copy(initial_object_pose),
+            "actions": [],
+        }
+        platform._delayed_camera_observation = platform._get_current_camera_observation(0)
+        platform._camera_observation_t = platform._delayed_camera_observation
+        return platform
+
+    @property
+    def client_id(self):
+        return self.platform.simfinger._pybullet_client_id
+
+
+def _check_attrs(platform):
+    """Raise RuntimeError if platform lacks an attribute reset by fast reset."""
+    missing = [name for name in _PLATFORM_ATTRS if not hasattr(platform, name)]
+    missing += ["simfinger." + name for name in _SIMFINGER_ATTRS if not hasattr(platform.simfinger, name)]
+    if missing:
+        raise RuntimeError("PlatformCache: TriFingerPlatform has no attributes {}, fast reset "
+                           "does not support this trifinger_simulation version".format(", ".join(missing)))
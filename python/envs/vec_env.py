@@ -0,0 +1,288 @@
+"""Vectorized environment running one env per worker process, over shared memory.
+
+Each worker owns one environment (e.g. a ``PushCubeEnv`` or ``CubeEnv`` with
+its wrapper stack, each with its own pybullet DIRECT connection). Flattened
+observations, actions, rewards, dones and selected info values are exchanged
+through one preallocated shared memory block; the pipe to each worker only
+carries one byte commands and acknowledgements. Workers reset their env when
+an episode ends, so the parent never waits for a separate reset.
+
+Attribute access and method calls on the envs (get_attr, set_attr, env_method)
+are pickled over the pipes, as in stable_baselines ``SubprocVecEnv``.
+"""
+import multiprocessing
+import pickle
+import struct
+import traceback
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+from gym import spaces
+from stable_baselines.common.vec_env import VecEnv
+
+# Worker commands and replies
+_STEP = b"s"
+_RESET = b"r"
+_SEED = b"d" # Followed by seed as int64
+_CALL = b"m" # Followed by pickled (kind, name, args, kwargs)
+_CLOSE = b"c"
+_OK = b"k" # Followed by pickled result, after _SEED and _CALL
+_ERROR = b"e" # Followed by traceback
+
+_ALIGN = 64
+
+
+class SharedMemoryVecEnv(VecEnv):
+    """Steps ``len(env_fns)`` environments in parallel worker processes.
+
+    Observations are returned as a ``(num_envs, obs_dim)`` array of flattened
+    observations (see ``gym.spaces.flatten``), and actions are passed as a
+    ``(num_envs, act_dim)`` array of flattened actions, so ``observation_space``
+    and ``action_space`` are the flattened Box spaces. The spaces of the
+    wrapped envs are ``env_observation_space`` and ``env_action_space``. When
+    an episode ends, the returned observation is the first of the next
+    episode, with the last one in ``infos[i]["terminal_observation"]``.
+    """
+
+    def __init__(self, env_fns, info_keys=(), seed=None):
+        """Initialize.
+        Args:
+            env_fns (list): Picklable functions without arguments which
+                create the envs, called in the worker processes, as for
+                ``SubprocVecEnv``.
+            info_keys (list): Keys of scalar info values to pass back from
+                step(); other info values are not sent. NaN if missing.
+            seed (int): Env i, and numpy's global random state in its worker,
+                are seeded with seed + i at startup. Random if None.
+        """
+        self.info_keys = list(info_keys)
+        self.closed = False
+        if seed is None:
+            seed = np.random.randint(2**31)
+
+        # Workers are started with forkserver rather than forked, because the
+        # logging thread of this process could hold a lock at fork time, and a
+        # forked child has no thread draining its log queue. The resource
+        # tracker is started first, so workers share it, and attaching to the
+        # shared memory block does not make them unlink it when they exit
+        resource_tracker.ensure_running()
+        ctx = multiprocessing.get_context("forkserver")
+        self._conns = []
+        self._processes = []
+        for i, env_fn in enumerate(env_fns):
+            conn, child_conn = ctx.Pipe()
+            process = ctx.Process(target=_worker_loop,
+                                  args=(env_fn, child_conn, i, self.info_keys, seed + i),
+                                  daemon=True)
+            process.start()
+            child_conn.close()
+            self._conns.append(conn)
+            self._processes.append(process)
+
+        # Spaces are only pickled once, to size the shared arrays
+        self.env_observation_space, self.env_action_space = self._conns[0].recv()
+        for conn in self._conns[1:]:
+            conn.recv()
+        VecEnv.__init__(self, len(env_fns), spaces.flatten_space(self.env_observation_space),
+                        spaces.flatten_space(self.env_action_space))
+        self.obs_dim = spaces.flatdim(self.env_observation_space)
+        self.act_dim = spaces.flatdim(self.env_action_space)
+
+        n = self.num_envs
+        self._specs = [
+            ("obs", (n, self.obs_dim), np.float64),
+            ("terminal_obs", (n, self.obs_dim), np.float64),
+            ("actions", (n, self.act_dim), np.float64),
+            ("rewards", (n,), np.float64),
+            ("dones", (n,), np.bool_),
+            ("infos", (n, len(self.info_keys)), np.float64),
+        ]
+        self._shm = shared_memory.SharedMemory(create=True, size=_layout_nbytes(self._specs))
+        self._arrays = _get_arrays(self._shm.buf, self._specs)
+        for conn in self._conns:
+            conn.send((self._shm.name, self._specs))
+        self._wait()
+
+    def reset(self):
+        """Reset all envs, and return their flattened observations."""
+        self._send_all(_RESET)
+        self._wait()
+        return self._arrays["obs"].copy()
+
+    def step_async(self, actions):
+        """Start stepping all envs with (num_envs, act_dim) flattened actions."""
+        self._arrays["actions"][:] = actions
+        self._send_all(_STEP)
+
+    def step_wait(self):
+        """Wait for step_async() to finish.
+        Returns:
+            obs, rewards, dones, infos as in stable_baselines ``VecEnv.step``.
+        """
+        self._wait()
+        obs = self._arrays["obs"].copy()
+        rewards = self._arrays["rewards"].copy()
+        dones = self._arrays["dones"].copy()
+        infos = [dict(zip(self.info_keys, row)) for row in self._arrays["infos"].tolist()]
+        for i in np.flatnonzero(dones):
+            infos[i]["terminal_observation"] = self._arrays["terminal_obs"][i].copy()
+        return obs, rewards, dones, infos
+
+    def seed(self, seed=None):
+        """Seed env i, and numpy's global random state in its worker, with seed + i.
+        Returns:
+            List of values returned by the env seed() methods.
+        """
+        if seed is None:
+            seed = np.random.randint(2**31)
+        for i, conn in enumerate(self._conns):
+            conn.send_bytes(_SEED + struct.pack("<q", seed + i))
+        return self._wait()
+
+    def get_attr(self, attr_name, indices=None):
+        """Get list of attribute attr_name of envs in indices (all if None)."""
+        return self._call(indices, "get_attr", attr_name)
+
+    def set_attr(self, attr_name, value, indices=None):
+        """Set attribute attr_name of envs in indices (all if None) to value."""
+        self._call(indices, "set_attr", attr_name, value)
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        """Get list of results of method_name of envs in indices (all if None)."""
+        return self._call(indices, "env_method", method_name, *method_args, **method_kwargs)
+
+    def get_images(self, *args, **kwargs):
+        """Get list of rgb_array renders of all envs."""
+        return self._call(None, "env_method", "render", *args, mode="rgb_array", **kwargs)
+
+    def unflatten_observation(self, obs):
+        """Get observation of the wrapped envs from flattened observation obs."""
+        return spaces.unflatten(self.env_observation_space, obs)
+
+    def flatten_action(self, action):
+        """Get flattened action from action of the wrapped envs."""
+        return spaces.flatten(self.env_action_space, action)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        for conn in self._conns:
+            try:
+                conn.send_bytes(_CLOSE)
+            except (BrokenPipeError, OSError):
+                pass
+        for process in self._processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        for conn in self._conns:
+            conn.close()
+        self._arrays = None
+        self._shm.close()
+        self._shm.unlink()
+
+    def _send_all(self, command):
+        for conn in self._conns:
+            conn.send_bytes(command)
+
+    def _call(self, indices, kind, name, *args, **kwargs):
+        indices = self._get_indices(indices)
+        command = _CALL + pickle.dumps((kind, name, args, kwargs))
+        for i in indices:
+            self._conns[i].send_bytes(command)
+        return self._wait(indices)
+
+    def _wait(self, indices=None):
+        """Wait for replies of envs in indices (all if None).
+        Returns:
+            List of results, None for commands without one.
+        """
+        errors = []
+        results = []
+        for i in self._get_indices(indices):
+            reply = self._conns[i].recv_bytes()
+            if reply[:1] == _ERROR:
+                errors.append("env {}:\n{}".format(i, reply[1:].decode()))
+            elif len(reply) > 1:
+                results.append(pickle.loads(reply[1:]))
+            else:
+                results.append(None)
+        if errors:
+            raise RuntimeError("SharedMemoryVecEnv worker failed\n" + "\n".join(errors))
+        return results
+
+
+def _layout_nbytes(specs):
+    nbytes = 0
+    for _, shape, dtype in specs:
+        nbytes += -(-int(np.prod(shape)) * np.dtype(dtype).itemsize // _ALIGN) * _ALIGN
+    return max(nbytes, 1)
+
+
+def _get_arrays(buf, specs):
+    """Get dict of numpy views of arrays in specs, laid out in buffer buf."""
+    arrays = {}
+    offset = 0
+    for name, shape, dtype in specs:
+        count = int(np.prod(shape))
+        arrays[name] = np.frombuffer(buf, dtype=dtype, count=count, offset=offset).reshape(shape)
+        offset += -(-count * np.dtype(dtype).itemsize // _ALIGN) * _ALIGN
+    return arrays
+
+
+def _worker_loop(env_fn, conn, index, info_keys, seed):
+    np.random.seed(seed)
+    env = env_fn()
+    env.seed(seed)
+    conn.send((env.observation_space, env.action_space))
+    shm_name, specs = conn.recv()
+    shm = shared_memory.SharedMemory(name=shm_name)
+    arrays = _get_arrays(shm.buf, specs)
+    obs, terminal_obs = arrays["obs"][index], arrays["terminal_obs"][index]
+    actions, infos = arrays["actions"][index], arrays["infos"][index]
+    rewards, dones = arrays["rewards"], arrays["dones"]
+    conn.send_bytes(_OK)
+
+    while True:
+        try:
+            command = conn.recv_bytes()
+        except EOFError:
+            break
+        if command == _CLOSE:
+            break
+        try:
+            reply = _OK
+            if command == _STEP:
+                o, r, done, info = env.step(spaces.unflatten(env.action_space, actions))
+                rewards[index] = r
+                dones[index] = done
+                for k, key in enumerate(info_keys):
+                    infos[k] = info.get(key, np.nan)
+                if done:
+                    terminal_obs[:] = spaces.flatten(env.observation_space, o)
+                    o = env.reset()
+                obs[:] = spaces.flatten(env.observation_space, o)
+            elif command == _RESET:
+                obs[:] = spaces.flatten(env.observation_space, env.reset())
+            elif command[:1] == _SEED:
+                seed = struct.unpack("<q", command[1:])[0]
+                np.random.seed(seed)
+                reply = _OK + pickle.dumps(env.seed(seed))
+            elif command[:1] == _CALL:
+                kind, name, args, kwargs = pickle.loads(command[1:])
+                if kind == "get_attr":
+                    result = getattr(env, name)
+                elif kind == "set_attr":
+                    result = setattr(env, name, *args)
+                else:
+                    result = getattr(env, name)(*args, **kwargs)
+                reply = _OK + pickle.dumps(result)
+            conn.send_bytes(reply)
+        except Exception:
+            conn.send_bytes(_ERROR + traceback.format_exc().encode())
+
+    env.close()
+    del obs, terminal_obs, actions, infos, rewards, dones, arrays
+    shm.close()
+    conn.close()
@@ -0,0 +1,87 @@
+"""
+Logging for hot paths: levels, per call site rate limiting, and an off-thread sink
+
+Loggers from get_logger() send records through a queue to a background thread,
+which writes them to stdout. Messages use lazy %-style arguments, e.g.
+    logger.debug("x_delta: %s", x_delta)
+so disabled levels and rate limited records cost no string formatting.
+
+Environment variables:
+    RRC_LOG_LEVEL:  minimum level, default INFO
+    RRC_LOG_PERIOD: minimum seconds between records from one call site, default 1.0.
+                    Only applies to DEBUG records, which per-step messages use;
+                    INFO and above are never dropped
+"""
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+
+ROOT_LOGGER_NAME = "rrc_iprl_package"
+
+_listener = None
+
+
+class RateLimitFilter(logging.Filter):
+    """Pass at most one record per call site (file, line) every period seconds.
+    The next record passed from a call site reports how many were suppressed.
+    Records above max_level always pass.
+    """
+
+    def __init__(self, period, max_level=logging.DEBUG):
+        super().__init__()
+        self.period = period
+        self.max_level = max_level
+        self._last = {} # (pathname, lineno) -> [time of last passed record, suppressed count]
+
+    def filter(self, record):
+        if record.levelno > self.max_level:
+            return True
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        state = self._last.get(key)
+        if state is None:
+            self._last[key] = [now, 0]
+            return True
+        if now - state[0] < self.period:
+            state[1] += 1
+            return False
+        if state[1] > 0 and isinstance(record.args, tuple):
+            record.msg = "{} (%d similar suppressed)".format(record.msg)
+            record.args = record.args + (state[1],)
+        state[0] = now
+        state[1] = 0
+        return True
+
+
+def get_logger(name):
+    """Get logger rrc_iprl_package.<name>, setting up the shared sink on first use."""
+    _setup()
+    return logging.getLogger("{}.{}".format(ROOT_LOGGER_NAME, name))
+
+
+def _setup():
+    global _listener
+    if _listener is not None:
+        return
+
+    root = logging.getLogger(ROOT_LOGGER_NAME)
+    root.setLevel(os.environ.get("RRC_LOG_LEVEL", "INFO").upper())
+    root.propagate = False
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(logging.Formatter("[%(levelname)s %(name)s] %(message)s"))
+
+    q = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(q)
+    # Filter before the queue handler formats the record
+    queue_handler.addFilter(RateLimitFilter(float(os.environ.get("RRC_LOG_PERIOD", "1.0"))))
+    root.addHandler(queue_handler)
+
+    _listener = logging.handlers.QueueListener(q, stream_handler)
+    _listener.start()
+    # Write out queued records at exit
+    atexit.register(_listener.stop)
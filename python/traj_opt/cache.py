@@ -0,0 +1,10 @@
+"""
+Location of code-generated traj_opt artifacts (compiled NLP solvers and the
+generated kinematics module). Kept free of casadi imports so that modules
+loading cached code do not pull it in.
+"""
+import os
+
+# Directory of code-generated, compiled NLP solvers and kinematics functions
+CODEGEN_CACHE_DIR = os.environ.get("RRC_TRAJ_OPT_CACHE_DIR",
+                                   os.path.join(os.path.expanduser("~"), ".cache", "rrc_iprl_package", "traj_opt"))
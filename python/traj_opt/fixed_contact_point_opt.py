@@ -1,8 +1,30 @@
 import numpy as np
 from casadi import *
 
+from rrc_iprl_package.logging_utils import get_logger
+from rrc_iprl_package.traj_opt import utils
 from rrc_iprl_package.traj_opt.fixed_contact_point_system import FixedContactPointSystem
 
+logger = get_logger("traj_opt.fixed_contact_point_opt")
+
+# Bump when the problem formulation changes, to invalidate compiled solvers
+FORMULATION_VERSION = 1
+
+"""
+Process-wide cache of formulated problems, keyed by (nGrid, dt, fnum, warm_start, codegen)
+"""
+_OPT_CACHE = {}
+
+"""
+Get FixedContactPointOpt for given problem size, formulating it only on first call
+"""
+def get_fixed_contact_point_opt(nGrid, dt, fnum, warm_start = False, codegen = False):
+  key = (nGrid, dt, fnum, warm_start, codegen)
+  if key not in _OPT_CACHE:
+    _OPT_CACHE[key] = FixedContactPointOpt(nGrid = nGrid, dt = dt, fnum = fnum, warm_start = warm_start,
+                                           codegen = codegen)
+  return _OPT_CACHE[key]
+
 class FixedContactPointOpt:
   
   def __init__(self,
@@ -15,45 +37,45 @@ class FixedContactPointOpt:
                obj_shape    = None,
                obj_mass     = None,
                npz_filepath = None,
+               warm_start   = False,
+               codegen      = False,
                ):
 
     self.nGrid = nGrid
     self.dt = dt
+
+    # Warm start each solve from the previous solution and multipliers
+    self.warm_start = warm_start
+    self.z_prev = None
+    self.lam_x_prev = None
+    self.lam_g_prev = None
+    self.iter_count = None
+    self.iter_count_list = [] # IPOPT iterations of every solve
     
     # Define system
+    # x_goal, cp_params, obj_shape and obj_mass are problem parameters, set in solve_nlp()
     self.system = FixedContactPointSystem(
                                      nGrid     = nGrid,
                                      dt        = dt,
                                      fnum      = fnum,
-                                     cp_params = cp_params,
-                                     obj_shape = obj_shape,
-                                     obj_mass  = obj_mass,
                                     )
     
-    # Test various functions
-    #x = np.zeros((1,7))
-    #x[0,0:3] = obj_pose.position
-    #x[0,3] = obj_pose.orientation[3]
-    #x[0,4:7] = obj_pose.orientation[0:3]
-    ##print("x: {}".format(x))
-    #self.system.get_grasp_matrix(x)
-
     # Get decision variables
     self.t,self.s_flat,self.l_flat,self.a = self.system.dec_vars()
     # Pack t,x,u,l into a vector of decision variables
     self.z = self.system.decvar_pack(self.t,self.s_flat,self.l_flat,self.a)
 
-    #print(self.z)
-    #print(self.system.s_unpack(self.s_flat))
-
     # Formulate constraints
-    self.g, self.lbg, self.ubg = self.get_constraints(self.system, self.t, self.s_flat, self.l_flat,self.a,x_goal)
+    self.g, self.lbg, self.ubg = self.get_constraints(self.system, self.t, self.s_flat, self.l_flat,self.a,self.system.x_goal_param)
 
     # Get cost function
-    self.cost = self.cost_func(self.t,self.s_flat,self.l_flat,self.a,x_goal)
+    self.cost = self.cost_func(self.t,self.s_flat,self.l_flat,self.a,self.system.x_goal_param)
+
+    # Concatenate x_goal, contact point, and object params
+    self.p = self.system.get_param_vector()
 
     # Formulate nlp
-    problem = {"x":self.z, "f":self.cost, "g":self.g}
+    problem = {"x":self.z, "f":self.cost, "g":self.g, "p":self.p}
     options = {"ipopt.print_level":5,
                "ipopt.max_iter":10000,
                 "ipopt.tol": 1e-4,
@@ -63,57 +85,81 @@ class FixedContactPointOpt:
     #options = {"iteration_callback": MyCallback('callback',self.z.shape[0],self.g.shape[0],self.system)}
     #options["monitor"] = ["nlp_g"]
     #options = {"monitor":["nlp_f","nlp_g"]}
-    self.solver = nlpsol("S", "ipopt", problem, options)
-
-    # TODO: intial guess
-    self.z0 = self.system.get_initial_guess(self.z, x0, x_goal)
-    #t0, s0, l0 = self.system.decvar_unpack(self.z0)
-    #x0, dx0 = self.system.s_unpack(s0)
-    #self.get_constraints(self.system,t0,s0,l0)
-
-    #print("\nINITIAL TRAJECTORY")
-    #print("time: {}".format(t0))
-    #print("x: {}".format(x0))
-    #print("dx: {}".format(dx0))
-    #print("contact forces: {}".format(l0))
-  
-    # TODO: path constraints
-    #self.system.get_grasp_matrix(x0)
+    # With codegen, load NLP functions compiled to C, generating them on first use
+    cache_key = ("FixedContactPointOpt", FORMULATION_VERSION, nGrid, dt, fnum)
+    self.solver = utils.get_nlpsol("fixed_contact_point_opt", problem, options,
+                                   cache_key = cache_key, codegen = codegen)
+    # Re-solves with multipliers from the previous solve use warm start options
+    # The warm solver is only built on the first warm solve, see get_warm_solver()
+    self.warm_solver = None
+    self._nlp_args = (problem, dict(options, **utils.WARM_START_OPTIONS), cache_key, codegen)
+
+    # Solve right away if problem values are given, as before
+    if x_goal is not None:
+      self.solve_nlp(cp_params, x0, x_goal, obj_shape, obj_mass, npz_filepath = npz_filepath)
+
+  """
+  Solve problem for given initial object pose, goal pose, and contact points
+  x0 is set through the decision variable bounds, the rest through the parameter vector
+  n_shift: number of timesteps elapsed since the previous solve, used to shift the warm start
+  """
+  def solve_nlp(self,
+                cp_params,
+                x0,
+                x_goal,
+                obj_shape,
+                obj_mass,
+                npz_filepath = None,
+                n_shift      = 0,
+               ):
+
+    # Set x_goal, contact point, and object param values
+    p_val = self.system.get_param_values(x_goal, cp_params, obj_shape, obj_mass)
+
+    # Initial guess, and initial multipliers
+    is_warm = self.warm_start and self.z_prev is not None
+    if is_warm:
+      self.z0 = self.system.shift_decvar(self.z_prev, n_shift)
+      lam_x0 = self.system.shift_decvar(self.lam_x_prev, n_shift)
+      lam_g0 = self.shift_lam_g(self.lam_g_prev, n_shift)
+    else:
+      self.z0 = self.system.get_initial_guess(self.z, x0, x_goal)
+      lam_x0 = np.zeros(self.z.shape[0])
+      lam_g0 = np.zeros(self.g.shape[0])
 
     self.z_lb, self.z_ub = self.system.path_constraints(self.z, x0, x_goal=x_goal, dx0=np.zeros((1,6)), dx_end=np.zeros((1,6)))
 
     # Set upper and lower bounds for decision variables
-    r = self.solver(x0=self.z0,lbg=self.lbg,ubg=self.ubg,lbx=self.z_lb,ubx=self.z_ub)
+    solver = self.get_warm_solver() if is_warm else self.solver
+    r = solver(x0=self.z0,lam_x0=lam_x0,lam_g0=lam_g0,
+               lbg=self.lbg,ubg=self.ubg,lbx=self.z_lb,ubx=self.z_ub,p=p_val)
     z_soln = r["x"]
 
+    # Keep solution and multipliers to warm start next solve
+    self.z_prev = np.array(r["x"]).flatten()
+    self.lam_x_prev = np.array(r["lam_x"]).flatten()
+    self.lam_g_prev = np.array(r["lam_g"]).flatten()
+
+    # Report IPOPT iterations
+    self.iter_count = solver.stats()["iter_count"]
+    self.iter_count_list.append(self.iter_count)
+    logger.info("FixedContactPointOpt: %d iterations (warm start: %s)", self.iter_count, is_warm)
+
     # Final solution and cost
-    self.cost = r["f"]
+    self.cost_soln = r["f"]
     self.t_soln,self.s_soln,l_soln_flat,a_soln = self.system.decvar_unpack(z_soln)
     self.x_soln, self.dx_soln = self.system.s_unpack(self.s_soln)
     self.l_soln = self.system.l_unpack(l_soln_flat)
 
-    # Check that all quaternions are unit quaternions
-    #print("Check quaternion magnitudes")
-    #for i in range(self.nGrid):
-    #  quat = self.x_soln[i, 3:]
-    #  print(np.linalg.norm(quat))
-  
     # Transform contact forces from contact point frame to world frame
     self.l_wf_soln = np.zeros(self.l_soln.shape)
     for t_i in range(self.l_soln.shape[0]):
       for f_i in range(self.system.fnum):
-        #print(self.l_soln[t_i, :])
-        #print("FINGER {}".format(f_i))
         l_of = self.system.get_R_cp_2_o(self.system.cp_list[f_i]) @ (self.l_soln[t_i, f_i*self.system.l_i:f_i*self.system.l_i + self.system.l_i]).T
-        #print(l_of)
         l_wf = self.system.get_R_o_2_w(self.x_soln[t_i, :]) @ l_of
-        #print(l_wf)
 
         for d in range(self.system.l_i):
           self.l_wf_soln[t_i, f_i*self.system.l_i + d] = l_wf[:, 0].elements()[d].__float__()
-    # Final distance to goal
-    #eef_final = self.system.get_eef_pos_world(self.q_soln)[-1, 0:2]
-    #self.final_dist = norm_2(eef_final - eef_goal)
 
     # Save solver time
     statistics = self.solver.stats()
@@ -132,8 +178,28 @@ class FixedContactPointOpt:
                  l_of      = self.l_soln,
                  l_wf      = self.l_wf_soln,
                  cp_params = cp_params,
+                 iter_count = self.iter_count,
                 )
 
+  """
+  Get solver with warm start options, building it on first use
+  """
+  def get_warm_solver(self):
+    if self.warm_solver is None:
+      problem, options, cache_key, codegen = self._nlp_args
+      self.warm_solver = utils.get_nlpsol("fixed_contact_point_opt", problem, options,
+                                          cache_key = cache_key, codegen = codegen)
+    return self.warm_solver
+
+  """
+  Shift constraint multipliers lam_g forward in time by n_shift timesteps
+  Collocation constraints are shifted, x_goal constraints are not
+  """
+  def shift_lam_g(self, lam_g, n_shift):
+    n_dyn = (self.nGrid - 1) * (self.system.x_dim + self.system.dx_dim)
+    lam_g_dyn = utils.shift_time_major(lam_g[:n_dyn], self.nGrid - 1, n_shift)
+    return np.concatenate((lam_g_dyn, lam_g[n_dyn:]))
+
   """
   Computes cost
   """
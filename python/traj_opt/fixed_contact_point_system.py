@@ -35,8 +35,23 @@ class FixedContactPointSystem:
 
     self.gravity = -10
     
+    # Numeric contact points, only used to post-process solutions
     self.cp_params = cp_params
-    self.cp_list = self.get_contact_points_from_cp_params(self.cp_params)
+    self.cp_list = None
+    if cp_params is not None:
+      self.cp_list = self.get_contact_points_from_cp_params(self.cp_params)
+
+    # Problem parameters, so one solver can be reused across solves
+    # object goal pose [x, y, z, qx, qy, qz, qw]
+    self.x_goal_param = SX.sym("x_goal", 1, self.x_dim)
+    # contact point params [cp1_x, cp1_y, cp1_z, ..., cpN_z]
+    self.cp_params_param = SX.sym("cp_params", 3*self.fnum)
+    # contact point frame orientations w.r.t. object frame [cp1_qx, ..., cpN_qw]
+    self.cp_quat_param = SX.sym("cp_quat", 4*self.fnum)
+    # object mass and shape (width, length, height)
+    self.obj_mass_param = SX.sym("obj_mass")
+    self.obj_shape_param = SX.sym("obj_shape", 3)
+    self.cp_sym_list = self.get_contact_points_from_params()
 
     # Contact model force selection matrix
     l_i = 3
@@ -185,6 +200,24 @@ class FixedContactPointSystem:
     l = reshape(l_flat,self.l_i*fnum,nGrid).T
     return l
 
+  """
+  Shift decision variable values z forward in time by n_shift timesteps
+  Used to warm start a new solve from a previous solution
+  Also works on lam_x, which has the same layout as z
+  Times t and slack variables a are not shifted
+  """
+  def shift_decvar(self, z, n_shift):
+    nGrid = self.nGrid
+    t, s_flat, l_flat, a = self.decvar_unpack(np.asarray(z).flatten())
+
+    x_flat = s_flat[:nGrid*self.x_dim]
+    dx_flat = s_flat[nGrid*self.x_dim:]
+    s_shifted = np.concatenate((utils.shift_time_major(x_flat, nGrid, n_shift),
+                                utils.shift_time_major(dx_flat, nGrid, n_shift)))
+    l_shifted = utils.shift_time_major(l_flat, nGrid, n_shift)
+
+    return np.concatenate((t, s_shifted, l_shifted, a))
+
 ################################################################################
 # End of decision variable help functions
 ################################################################################
@@ -206,45 +239,49 @@ class FixedContactPointSystem:
     x, dx  = self.s_unpack(s_flat)
     l = self.l_unpack(l_flat)
 
-    new_dx_list = []
-    ddx_list = []
-    for t_ind in range(self.nGrid):
-      x_i = x[t_ind, :]
-      dx_i = dx[t_ind, :]
-
-      # Compute dx at each collocation point
-      # dx is a (7x1) vector
-      new_dx_i = SX.zeros((7,1))
-      # First 3 elements are position time-derivatives
-      new_dx_i[0:3, :] = dx_i[0, 0:3]
-      # Last 4 elements are quaternion time-derivatives
-      ## Transform angular velocities dx into quaternion time-derivatives
-      quat_i = x_i[0, 3:]
-      dquat_i = 0.5 * self.get_dx_to_dquat_matrix(quat_i) @ dx_i[0, 3:].T
-      new_dx_i[3:, :] = dquat_i
-      new_dx_list.append(new_dx_i)
-
-      # Compute ddx at each collocation point
-      Mo = self.get_M_obj()
-      G = self.get_grasp_matrix(x_i)
-      gapp = self.get_gapp()
-      l_i = l[t_ind, :].T
-      #print("t_ind: {}".format(t_ind))
-      #print(x_i)
-      #print(l_i)
-      #print(inv(Mo))
-      #print("gapp: {}".format(gapp))
-      #print(G.shape)
-      #print((gapp + G@l_i).shape)
-      ddx_i = inv(Mo) @ (gapp + G @ l_i)
-      ddx_list.append(ddx_i)
-
-    new_dx = horzcat(*new_dx_list).T
-    ddx = horzcat(*ddx_list).T
-
-    ds = self.s_pack(new_dx, ddx)
+    # Apply single knot dynamics to all timesteps, one column per timestep
+    params = [self.cp_params_param, self.cp_quat_param, self.obj_mass_param, self.obj_shape_param]
+    params = [repmat(p, 1, self.nGrid) for p in params]
+    new_dx, ddx = self.get_knot_dynamics_func().map(self.nGrid)(x.T, dx.T, l.T, *params)
+
+    ds = self.s_pack(new_dx.T, ddx.T)
     return ds
 
+  """
+  Get casadi Function for system dynamics at a single timestep
+  Inputs: x_i (7x1), dx_i (6x1), l_i (fnum*l_i x 1), and contact point and object params
+  Outputs: new_dx_i (7x1) pose time-derivative, ddx_i (6x1) twist time-derivative
+  """
+  def get_knot_dynamics_func(self):
+    x_i = SX.sym("x_i", self.x_dim)
+    dx_i = SX.sym("dx_i", self.dx_dim)
+    l_i = SX.sym("l_i", self.fnum*self.l_i)
+
+    # Object mass matrix is diagonal, so invert it elementwise
+    Mo = self.get_M_obj()
+    Mo_inv = diag(1 / diag(Mo))
+    gapp = self.get_gapp()
+
+    # Compute dx
+    # dx is a (7x1) vector
+    new_dx_i = SX.zeros((7,1))
+    # First 3 elements are position time-derivatives
+    new_dx_i[0:3, :] = dx_i[0:3]
+    # Last 4 elements are quaternion time-derivatives
+    ## Transform angular velocities dx into quaternion time-derivatives
+    quat_i = x_i[3:]
+    dquat_i = 0.5 * self.get_dx_to_dquat_matrix(quat_i) @ dx_i[3:]
+    new_dx_i[3:, :] = dquat_i
+
+    # Compute ddx
+    G = self.get_grasp_matrix(x_i.T)
+    ddx_i = Mo_inv @ (gapp + G @ l_i)
+
+    return Function("knot_dynamics",
+                    [x_i, dx_i, l_i,
+                     self.cp_params_param, self.cp_quat_param, self.obj_mass_param, self.obj_shape_param],
+                    [new_dx_i, ddx_i])
+
   """
   Get matrix to transform angular velocity to quaternion time derivative
   Input:
@@ -276,34 +313,46 @@ class FixedContactPointSystem:
   def friction_cone_constraints(self,l_flat):
     l = self.l_unpack(l_flat)
 
+    # Apply single knot constraints to all timesteps, one column per timestep
+    f1_constraints, f2_constraints = self.get_knot_friction_cone_func().map(self.nGrid)(l.T)
+
+    f_constraints = vertcat(f1_constraints.T, f2_constraints.T)
+    return f_constraints
+
+  """
+  Get casadi Function for linearized friction cone constraints at a single timestep
+  Input: l_i (fnum*l_i x 1) contact forces
+  Outputs: positive and negative bound constraints (fnum*2 x 1)
+  """
+  def get_knot_friction_cone_func(self):
+    l_i = SX.sym("l_i", self.fnum*self.l_i)
+
     # Positive bound
-    f1_constraints = SX.zeros((self.nGrid, self.fnum*2))
+    f1_constraints = SX.zeros((self.fnum*2, 1))
     # Negative bound
-    f2_constraints = SX.zeros((self.nGrid, self.fnum*2))
+    f2_constraints = SX.zeros((self.fnum*2, 1))
 
     mu = np.sqrt(2) * self.obj_mu # Inner approximation of cone
 
     for col in range(self.fnum):
       # abs(fy) <= mu * fx
-      f1_constraints[:,2*col] = mu * l[:,col*self.l_i] + l[:,col*self.l_i + 1]
-      f2_constraints[:,2*col] = -1 * l[:,col*self.l_i + 1] + mu * l[:,col*self.l_i]
+      f1_constraints[2*col] = mu * l_i[col*self.l_i] + l_i[col*self.l_i + 1]
+      f2_constraints[2*col] = -1 * l_i[col*self.l_i + 1] + mu * l_i[col*self.l_i]
 
       # abs(fz) <= mu * fx
-      f1_constraints[:,2*col+1] = mu * l[:,col*self.l_i] + l[:,col*self.l_i + 2]
-      f2_constraints[:,2*col+1] = -1 * l[:,col*self.l_i + 2] + mu * l[:,col*self.l_i]
+      f1_constraints[2*col+1] = mu * l_i[col*self.l_i] + l_i[col*self.l_i + 2]
+      f2_constraints[2*col+1] = -1 * l_i[col*self.l_i + 2] + mu * l_i[col*self.l_i]
 
-    f_constraints = vertcat(f1_constraints, f2_constraints)
-    #print(l)
-    #print("friction cones: {}".format(f_constraints))
-    #quit()
-    return f_constraints
+    return Function("knot_friction_cone", [l_i], [f1_constraints, f2_constraints])
 
   """
   Constrain state at end of trajectory to be at x_goal
   With a slack variable
   First, just add tolerance
   """
-  def x_goal_constraint(self, s_flat,a, x_goal):
+  def x_goal_constraint(self, s_flat,a, x_goal = None):
+    if x_goal is None:
+      x_goal = self.x_goal_param
     x, dx  = self.s_unpack(s_flat)
     x_end = x[-1, :]
 
@@ -349,17 +398,19 @@ class FixedContactPointSystem:
     G_list = []
 
     # Calculate G_i (grasp matrix for each finger)
-    for c in self.cp_list:
+    for c in self.cp_sym_list:
       cp_pos_of = c["position"] # Position of contact point in object frame
       quat_cp_2_o = c["orientation"] # Orientation of contact point frame w.r.t. object frame
 
-      S = np.array([
-                   [0, -cp_pos_of[2], cp_pos_of[1]],
-                   [cp_pos_of[2], 0, -cp_pos_of[0]],
-                   [-cp_pos_of[1], cp_pos_of[0], 0]
-                   ])
+      S = SX.zeros((3,3))
+      S[0,1] = -cp_pos_of[2]
+      S[0,2] = cp_pos_of[1]
+      S[1,0] = cp_pos_of[2]
+      S[1,2] = -cp_pos_of[0]
+      S[2,0] = -cp_pos_of[1]
+      S[2,1] = cp_pos_of[0]
 
-      P_i = np.eye(6)
+      P_i = SX.eye(6)
       P_i[3:6,0:3] = S
 
       # Orientation of cp frame w.r.t. world frame
@@ -384,18 +435,20 @@ class FixedContactPointSystem:
   Get 6x6 object inertia matrix
   """
   def get_M_obj(self):
-    M = np.zeros((6, 6))
-    M[0,0] = M[1,1] = M[2,2] = self.obj_mass
-    M[3,3] = self.obj_mass * (self.obj_shape[0]**2 + self.obj_shape[2]**2) / 12
-    M[4,4] = self.obj_mass * (self.obj_shape[1]**2 + self.obj_shape[2]**2) / 12
-    M[5,5] = self.obj_mass * (self.obj_shape[0]**2 + self.obj_shape[1]**2) / 12
+    m = self.obj_mass_param
+    shape = self.obj_shape_param
+    M = SX.zeros((6, 6))
+    M[0,0] = M[1,1] = M[2,2] = m
+    M[3,3] = m * (shape[0]**2 + shape[2]**2) / 12
+    M[4,4] = m * (shape[1]**2 + shape[2]**2) / 12
+    M[5,5] = m * (shape[0]**2 + shape[1]**2) / 12
     return M
 
   """
   Compute external gravity force on object, in -z direction
   """
   def get_gapp(self):
-    gapp = np.array([[0],[0], [self.gravity * self.obj_mass], [0], [0], [0]])
+    gapp = vertcat(0, 0, self.gravity * self.obj_mass_param, 0, 0, 0)
     return gapp
 
   """
@@ -472,6 +525,48 @@ class FixedContactPointSystem:
       cp_list.append(cp)
     return cp_list
       
+  """
+  Get list of symbolic contact point dicts from cp_params_param and cp_quat_param
+  Each contact point is: {"position", "orientation"}, in object frame
+  """
+  def get_contact_points_from_params(self):
+    cp_list = []
+    for f_i in range(self.fnum):
+      cp_param = self.cp_params_param[3*f_i:3*f_i+3]
+      # Same as cp_param_to_cp_of: -shape/2 + (param+1)*shape/2
+      pos_of = cp_param * self.obj_shape_param / 2
+      quat_of = [self.cp_quat_param[4*f_i + d] for d in range(4)]
+      cp = {"position": pos_of, "orientation": quat_of}
+      cp_list.append(cp)
+    return cp_list
+
+  """
+  Get numeric values of problem parameters, ordered as in get_param_vector()
+  """
+  def get_param_values(self, x_goal, cp_params, obj_shape, obj_mass):
+    self.obj_shape = obj_shape
+    self.obj_mass = obj_mass
+    self.cp_params = cp_params
+    self.cp_list = self.get_contact_points_from_cp_params(cp_params)
+
+    cp_quat = np.concatenate([np.asarray(cp["orientation"]) for cp in self.cp_list])
+    p_val = np.concatenate((np.asarray(x_goal).flatten(),
+                            np.asarray(cp_params).flatten(),
+                            cp_quat,
+                            [obj_mass],
+                            np.asarray(obj_shape).flatten()))
+    return p_val
+
+  """
+  Concatenate all problem parameters into a single vector
+  """
+  def get_param_vector(self):
+    return vertcat(self.x_goal_param.T,
+                   self.cp_params_param,
+                   self.cp_quat_param,
+                   self.obj_mass_param,
+                   self.obj_shape_param)
+
   """
   Get contact point position and orientation in object frame (OF)
   Input:
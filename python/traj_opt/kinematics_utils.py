@@ -1,120 +1,218 @@
+import hashlib
+import importlib.util
+import os
+import tempfile
+
 import numpy as np
-from sympy import *
+
+from rrc_iprl_package.logging_utils import get_logger
+from rrc_iprl_package.traj_opt.cache import CODEGEN_CACHE_DIR
+
+logger = get_logger("traj_opt.kinematics_utils")
 
 """
 Compute forward kinematics and Jacobian analytically
+
+The homogeneous transforms are derived symbolically with sympy, then simplified
+with common subexpression elimination and written out as a python module, cached
+on disk under a hash of the model constants. The generated module is loaded on
+first use, and its expressions are evaluated with NumPy, or traced into CasADi
+Functions. sympy is only imported when the cache does not exist yet.
 """
 
 BASE_ANGLE_DEGREES = [0, -120, -240]
 
 # Fixed values from URDF
-theta_base = symbols("theta_base")
-
 # joint origin xyz values w.r.t previous joint
+j0_z = 0.29 # finger base w.r.t. center holder
 j1_xyz = [0, 0, 0] # joint 1
 j2_xyz = [0.01685, 0.0505, 0] # joint 2
 j3_xyz = [0.04922, 0, -0.16] # joint 3
 j4_xyz = [0.0185, 0, -0.1626] # joint 4
+j5_z = -0.0095 # very end of fingertip w.r.t. joint 4 # TODO HARDCODED
+
+# Bump when the generated code changes, to invalidate cached modules
+CODEGEN_VERSION = 1
+
+# Generated expressions, functions of (q1, q2, q3, theta_base)
+EXPR_NAMES = ["eef_pos", "H_5_wrt_0", "R_4_wrt_0"]
+
+_generated = None # Loaded generated module
+_casadi_functions = {} # name -> casadi.Function
+
+"""
+Build sympy expressions of EXPR_NAMES for one finger
+"""
+def _build_sympy_exprs():
+    from sympy import symbols, cos, sin, Matrix
+
+    theta_base = symbols("theta_base")
+    q1, q2, q3 = symbols("q1 q2 q3")
+
+    H_0_wrt_base = Matrix([
+                        [cos(theta_base), -sin(theta_base), 0, 0],
+                        [sin(theta_base), cos(theta_base), 0, 0],
+                        [0, 0, 1, j0_z],
+                        [0, 0, 0, 1],
+                        ])
+
+    # Frame 1 w.r.t. frame 0
+    # Rotation around y axis
+    H_1_wrt_0 = Matrix([
+                        [cos(q1),       0, sin(q1), j1_xyz[0]],
+                        [0,             1,       0, j1_xyz[1]],
+                        [-sin(q1),      0, cos(q1), j1_xyz[2]],
+                        [0, 0, 0, 1],
+                        ])
+
+    # Frame 2 w.r.t. frame 1
+    # Rotation around x axis
+    H_2_wrt_1 = Matrix([
+                      [1,       0,        0, j2_xyz[0]],
+                      [0, cos(q2), -sin(q2), j2_xyz[1]],
+                      [0, sin(q2),  cos(q2), j2_xyz[2]],
+                      [0,       0,        0,         1],
+                      ])
+
+    # Frame 3 w.r.t. frame 2
+    # Rotation around x axis
+    H_3_wrt_2 = Matrix([
+                      [1,       0,        0, j3_xyz[0]],
+                      [0, cos(q3), -sin(q3), j3_xyz[1]],
+                      [0, sin(q3),  cos(q3), j3_xyz[2]],
+                      [0,       0,        0,         1],
+                      ])
+
+    # Transformation from frame 3 to 4
+    # Fixed
+    H_4_wrt_3 = Matrix([
+                      [1, 0, 0, j4_xyz[0]],
+                      [0, 1, 0, j4_xyz[1]],
+                      [0, 0, 1, j4_xyz[2]],
+                      [0, 0, 0,         1],
+                      ])
+
+    H_4_wrt_0 = H_0_wrt_base @ H_1_wrt_0 @ H_2_wrt_1 @ H_3_wrt_2 @ H_4_wrt_3
+
+    # Reference frame 5 attached to very end of fingertip
+    # Transformation from frame 4 to 5
+    # Fixed
+    H_5_wrt_4 = Matrix([
+                      [1, 0, 0, 0],
+                      [0, 1, 0, 0],
+                      [0, 0, 1, j5_z],
+                      [0, 0, 0, 1],
+                      ])
+
+    H_5_wrt_0 = H_4_wrt_0 @ H_5_wrt_4
+
+    # Orientation of frame 4 w.r.t frame 0
+    R_4_wrt_0 = H_4_wrt_0[:3,:3]
+
+    return {
+            "eef_pos": H_4_wrt_0[:3, 3],
+            "H_5_wrt_0": H_5_wrt_0,
+            "R_4_wrt_0": R_4_wrt_0,
+           }
+
+"""
+Generate python source of EXPR_NAMES, one function per expression:
+    def <name>(q1, q2, q3, theta_base, ops)
+where ops provides cos, sin and matrix (builds a matrix from a list of rows)
+"""
+def _generate_source():
+    from sympy import cse
+
+    exprs = _build_sympy_exprs()
+    lines = ["# Generated by rrc_iprl_package.traj_opt.kinematics_utils, do not edit", ""]
+    for name in EXPR_NAMES:
+        expr = exprs[name]
+        subexprs, (reduced,) = cse(expr)
+        lines.append("def {}(q1, q2, q3, theta_base, ops):".format(name))
+        lines.append("    cos, sin = ops.cos, ops.sin")
+        for sym, subexpr in subexprs:
+            lines.append("    {} = {}".format(sym, subexpr))
+        rows = ["[{}]".format(", ".join(str(reduced[i, j]) for j in range(reduced.cols)))
+                for i in range(reduced.rows)]
+        lines.append("    return ops.matrix([{}])".format(", ".join(rows)))
+        lines.append("")
+    return "\n".join(lines)
+
+"""
+Load generated module, generating and caching it on disk first if needed
+"""
+def _load():
+    global _generated
+    if _generated is not None:
+        return _generated
+
+    key_str = repr((CODEGEN_VERSION, EXPR_NAMES, j0_z, j1_xyz, j2_xyz, j3_xyz, j4_xyz, j5_z))
+    key_hash = hashlib.sha1(key_str.encode("utf-8")).hexdigest()[:16]
+    path = os.path.join(CODEGEN_CACHE_DIR, "kinematics_utils_{}.py".format(key_hash))
+
+    if not os.path.exists(path):
+        logger.info("kinematics_utils: generating %s", path)
+        source = _generate_source()
+        # Write to a temporary file and move into place, so concurrent runs
+        # never load a partially written module
+        os.makedirs(CODEGEN_CACHE_DIR, exist_ok=True)
+        with tempfile.NamedTemporaryFile("w", dir=CODEGEN_CACHE_DIR, suffix=".py",
+                                         delete=False) as f:
+            f.write(source)
+        os.replace(f.name, path)
+
+    spec = importlib.util.spec_from_file_location("_kinematics_utils_generated", path)
+    _generated = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(_generated)
+    return _generated
+
+
+class _NumpyOps:
+    cos = staticmethod(np.cos)
+    sin = staticmethod(np.sin)
+    matrix = staticmethod(np.array)
+
+
+class _CasadiOps:
+    def __init__(self):
+        import casadi
+        self.cos = casadi.cos
+        self.sin = casadi.sin
+        self.matrix = lambda rows: casadi.vertcat(*[casadi.horzcat(*row) for row in rows])
+
+"""
+Evaluate generated expression name for finger f_i at joint positions q with NumPy
+"""
+def _eval(name, q, f_i):
+    theta = BASE_ANGLE_DEGREES[f_i] * (np.pi/180)
+    return getattr(_load(), name)(q[3*f_i + 0], q[3*f_i + 1], q[3*f_i + 2], theta, _NumpyOps)
 
-# Joint values
-q1, q2, q3 = symbols("q1 q2 q3")
-
-H_0_wrt_base = Matrix([
-                    [cos(theta_base), -sin(theta_base), 0, 0],
-                    [sin(theta_base), cos(theta_base), 0, 0],
-                    [0, 0, 1, 0.29],
-                    [0, 0, 0, 1],
-                    ])
-
-# Frame 1 w.r.t. frame 0
-# Rotation around y axis
-H_1_wrt_0 = Matrix([
-                    [cos(q1),       0, sin(q1), j1_xyz[0]],
-                    [0,             1,       0, j1_xyz[1]],
-                    [-sin(q1),      0, cos(q1), j1_xyz[2]],
-                    [0, 0, 0, 1],
-                    ])
-
-# Frame 2 w.r.t. frame 1
-# Rotation around x axis
-H_2_wrt_1 = Matrix([
-                  [1,       0,        0, j2_xyz[0]],
-                  [0, cos(q2), -sin(q2), j2_xyz[1]],
-                  [0, sin(q2),  cos(q2), j2_xyz[2]],
-                  [0,       0,        0,         1],
-                  ])
-
-# Frame 3 w.r.t. frame 2
-# Rotation around x axis
-H_3_wrt_2 = Matrix([
-                  [1,       0,        0, j3_xyz[0]],
-                  [0, cos(q3), -sin(q3), j3_xyz[1]],
-                  [0, sin(q3),  cos(q3), j3_xyz[2]],
-                  [0,       0,        0,         1],
-                  ])
-
-# Transformation from frame 3 to 4
-# Fixed
-H_4_wrt_3 = Matrix([
-                  [1, 0, 0, j4_xyz[0]],
-                  [0, 1, 0, j4_xyz[1]],
-                  [0, 0, 1, j4_xyz[2]],
-                  [0, 0, 0,         1],
-                  ])
-
-H_4_wrt_0 = H_0_wrt_base @ H_1_wrt_0 @ H_2_wrt_1 @ H_3_wrt_2 @ H_4_wrt_3
-
-# Reference frame 5 attached to very end of fingertip
-# Transformation from frame 4 to 5
-# Fixed
-H_5_wrt_4 = Matrix([
-                  [1, 0, 0, 0],
-                  [0, 1, 0, 0],
-                  [0, 0, 1, -0.0095], # TODO HARDCODED
-                  [0, 0, 0, 1],
-                  ])
-
-H_5_wrt_0 = H_4_wrt_0 @ H_5_wrt_4
-
-# Compose rotations to get orientation of frame 4 w.r.t frame 0
-R_0_wrt_base = H_0_wrt_base[:3,:3]
-R_1_wrt_0 = H_1_wrt_0[:3,:3]
-R_2_wrt_1 = H_2_wrt_1[:3,:3]
-R_3_wrt_2 = H_3_wrt_2[:3,:3]
-R_4_wrt_3 = H_4_wrt_3[:3,:3]
-
-R_4_wrt_0 = R_0_wrt_base @ R_1_wrt_0 @ R_2_wrt_1 @ R_3_wrt_2 @ R_4_wrt_3
-
-print("{}".format(R_4_wrt_0).replace("cos", "np.cos").replace("sin", "np.sin").replace("theta_base", "theta"))
-
-p = np.array([[0],[0],[0],[1]])
+"""
+Get casadi.Function of generated expression name, with inputs q (3 joint
+positions of one finger) and theta_base (finger base angle, radians)
+"""
+def get_casadi_function(name):
+    if name not in _casadi_functions:
+        import casadi
+        q = casadi.SX.sym("q", 3)
+        theta_base = casadi.SX.sym("theta_base")
+        expr = getattr(_load(), name)(q[0], q[1], q[2], theta_base, _CasadiOps())
+        _casadi_functions[name] = casadi.Function(name, [q, theta_base], [expr])
+    return _casadi_functions[name]
 
 """
 Compute forward kinematics for all fingers given joint positions q
 """
 def FK(q):
     ft_pos = []
-    for fplit
-i, angle in enumerate(BASE_ANGLE_DEGREES):
-        theta = angle * (np.pi/180)
-        q1_val = q[3*f_i + 0]
-        q2_val = q[3*f_i + 1]
-        q3_val = q[3*f_i + 2]
-        eef_wf = H_4_wrt_0 @ p
-        eef_wf = eef_wf[0:3, :]
-        p_wf = eef_wf.subs({"q1": q1_val, "q2": q2_val, "q3": q3_val, "theta_base": theta})
-        ft_pos += flatten(p_wf)
+    for f_i in range(len(BASE_ANGLE_DEGREES)):
+        ft_pos += list(_eval("eef_pos", q, f_i).flatten())
     return ft_pos
 
 def get_H_5_wrt_0(q):
     H_list = []
-    for f_i, angle in enumerate(BASE_ANGLE_DEGREES):
-        theta = angle * (np.pi/180)
-        q1_val = q[3*f_i + 0]
-        q2_val = q[3*f_i + 1]
-        q3_val = q[3*f_i + 2]
-        H = H_5_wrt_0.subs({"q1": q1_val, "q2": q2_val, "q3": q3_val, "theta_base": theta})
-        H_list.append(H)
+    for f_i in range(len(BASE_ANGLE_DEGREES)):
+        H_list.append(_eval("H_5_wrt_0", q, f_i))
     return H_list
 
 """
@@ -122,37 +220,6 @@ Get fingertip reference frame orientation for all fingers
 """
 def get_ft_R_sympy(q):
     R_list = []
-    for f_i, angle in enumerate(BASE_ANGLE_DEGREES):
-        theta = angle * (np.pi/180)
-        q1_val = q[3*f_i + 0]
-        q2_val = q[3*f_i + 1]
-        q3_val = q[3*f_i + 2]
-        R = R_4_wrt_0.subs({"q1": q1_val, "q2": q2_val, "q3": q3_val, "theta_base": theta})
-        R_list.append(R)
+    for f_i in range(len(BASE_ANGLE_DEGREES)):
+        R_list.append(_eval("R_4_wrt_0", q, f_i))
     return R_list
-
-#dq1 = eef_wf.diff(q1)
-#dq2 = eef_wf.diff(q2)
-#dq3 = eef_wf.diff(q3)
-#
-## Compute jacobian
-#J = dq1.row_join(dq2).row_join(dq3)
-##print("sympy J")
-##print(J)
-#
-#############################################
-## Test forward kinematics , and Jacobian for one finger
-#############################################
-#f_id = 0
-#theta_base_deg = 0 # Fixed andle of finger base w.r.t. center holder {0, 120, 240} degrees
-#theta_base_val = theta_base_deg * (np.pi/180)
-#
-#q1_val = 0
-#q2_val = 0.7
-#q3_val = -1.7
-#
-#q_all = np.array([q1_val, q2_val, q3_val,q1_val, q2_val, q3_val,q1_val, q2_val, q3_val])
-#
-#
-#print("eef_wf analytical: {}".format(p_wf))
-
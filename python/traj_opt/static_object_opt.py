@@ -5,17 +5,34 @@ from datetime import date, datetime
 import os
 
 from trifinger_simulation.tasks import move_cube
+from rrc_iprl_package.logging_utils import get_logger
+from rrc_iprl_package.traj_opt import utils
 from rrc_iprl_package.traj_opt.static_object_system import StaticObjectSystem
 
+logger = get_logger("traj_opt.static_object_opt")
+
+# Bump when the problem formulation changes, to invalidate compiled solvers
+FORMULATION_VERSION = 1
+
 class StaticObjectOpt:
   def __init__(self,
                nGrid     = 100,
                dt        = 0.1,
                obj_shape = None,
+               warm_start = False,
+               codegen   = False,
                ):
 
     self.nGrid = nGrid
     self.dt = dt
+
+    # Warm start each solve from the previous solution and multipliers
+    self.warm_start = warm_start
+    self.z_prev = None
+    self.lam_x_prev = None
+    self.lam_g_prev = None
+    self.iter_count = None
+    self.iter_count_list = [] # IPOPT iterations of every solve
     # Define system
     self.system = StaticObjectSystem(
                                      nGrid     = nGrid,
@@ -37,11 +54,14 @@ class StaticObjectOpt:
     #print(self.system.get_jacobian(test_q))
     #print(self.system.FK(q[0,:]))
 
+    # Fingertip positions at every timestep, shared by cost and constraints
+    self.ft = self.system.get_ft_pos(self.s_flat)
+
     # Formulate constraints
-    self.g, self.lbg, self.ubg = self.get_constraints(self.system, self.t, self.s_flat, self.a)
+    self.g, self.lbg, self.ubg = self.get_constraints(self.system, self.t, self.s_flat, self.a, ft=self.ft)
 
     # Get cost function
-    self.cost = self.cost_func(self.t,self.s_flat,self.a)
+    self.cost = self.cost_func(self.t,self.s_flat,self.a, ft=self.ft)
 
     # Concatenate ft_goal and obj_pose params
     self.p =  vertcat(self.system.ft_goal_param, self.system.obj_pose_param)
@@ -55,21 +75,40 @@ class StaticObjectOpt:
               }
     #options["monitor"] = ["nlp_g"]
     #options = {"monitor":["nlp_f","nlp_g"]}
-    self.solver = nlpsol("S", "ipopt", problem, options)
+    # With codegen, load NLP functions compiled to C, generating them on first use
+    cache_key = ("StaticObjectOpt", FORMULATION_VERSION, nGrid, dt, self.system.fnum,
+                 tuple(np.asarray(obj_shape).flatten()) if obj_shape is not None else None)
+    self.solver = utils.get_nlpsol("static_object_opt", problem, options,
+                                   cache_key = cache_key, codegen = codegen)
+    # Re-solves with multipliers from the previous solve use warm start options
+    # The warm solver is only built on the first warm solve, see get_warm_solver()
+    self.warm_solver = None
+    self._nlp_args = (problem, dict(options, **utils.WARM_START_OPTIONS), cache_key, codegen)
 
+  """
+  Solve for finger trajectory to ft_goal
+  n_shift: number of timesteps elapsed since the previous solve, used to shift the warm start
+  """
   def solve_nlp(self,
                ft_goal, 
                q0,
                obj_pose  = move_cube.Pose(),
-               npz_filepath = None
+               npz_filepath = None,
+               n_shift = 0,
                ):
                 
     qnum = self.system.qnum
 
-    # Get initial guess
-    self.z0 = self.system.get_initial_guess(self.z, q0)
-    t0, s0, a0 = self.system.decvar_unpack(self.z0)
-    self.system.collision_constraint(s0)
+    # Get initial guess, and initial multipliers
+    is_warm = self.warm_start and self.z_prev is not None
+    if is_warm:
+      self.z0 = self.system.shift_decvar(self.z_prev, n_shift)
+      lam_x0 = self.system.shift_decvar(self.lam_x_prev, n_shift)
+      lam_g0 = self.shift_lam_g(self.lam_g_prev, n_shift)
+    else:
+      self.z0 = self.system.get_initial_guess(self.z, q0)
+      lam_x0 = np.zeros(self.z.shape[0])
+      lam_g0 = np.zeros(self.g.shape[0])
 
     # Path constraints
     self.z_lb, self.z_ub = self.system.path_constraints(self.z, q0, dq0=np.zeros((1,9)), dq_end=np.zeros((1,9)))
@@ -79,9 +118,21 @@ class StaticObjectOpt:
     p_val = np.concatenate((ft_goal, obj_pose_val))
     
     # Set upper and lower bounds for decision variables
-    r = self.solver(x0=self.z0,lbg=self.lbg,ubg=self.ubg,lbx=self.z_lb,ubx=self.z_ub,p=p_val)
+    solver = self.get_warm_solver() if is_warm else self.solver
+    r = solver(x0=self.z0,lam_x0=lam_x0,lam_g0=lam_g0,
+               lbg=self.lbg,ubg=self.ubg,lbx=self.z_lb,ubx=self.z_ub,p=p_val)
     z_soln = r["x"]
 
+    # Keep solution and multipliers to warm start next solve
+    self.z_prev = np.array(r["x"]).flatten()
+    self.lam_x_prev = np.array(r["lam_x"]).flatten()
+    self.lam_g_prev = np.array(r["lam_g"]).flatten()
+
+    # Report IPOPT iterations
+    self.iter_count = solver.stats()["iter_count"]
+    self.iter_count_list.append(self.iter_count)
+    logger.info("StaticObjectOpt: %d iterations (warm start: %s)", self.iter_count, is_warm)
+
     # Final solution and cost
     self.cost = r["f"]
     self.t_soln,self.s_soln,self.a_soln = self.system.decvar_unpack(z_soln)
@@ -102,7 +153,7 @@ class StaticObjectOpt:
       for f_i in range(self.system.fnum):
         self.ft_pos_soln[t_i, f_i * qnum: f_i * qnum + qnum] = ft_pos_list[f_i].T
 
-    print("SLACK VARS: {}".format(self.a_soln))
+    logger.debug("SLACK VARS: %s", self.a_soln)
 
     # Save solver time
     #statistics = self.solver.stats()
@@ -120,17 +171,44 @@ class StaticObjectOpt:
                  q      = self.q_soln,
                  dq     = self.dq_soln,
                  a      = self.a_soln,
+                 iter_count = self.iter_count,
                 )
 
+  """
+  Get solver with warm start options, building it on first use
+  """
+  def get_warm_solver(self):
+    if self.warm_solver is None:
+      problem, options, cache_key, codegen = self._nlp_args
+      self.warm_solver = utils.get_nlpsol("static_object_opt", problem, options,
+                                          cache_key = cache_key, codegen = codegen)
+    return self.warm_solver
+
+  """
+  Shift constraint multipliers lam_g forward in time by n_shift timesteps
+  Collocation and arena constraints are shifted, ft_goal constraints are not
+  """
+  def shift_lam_g(self, lam_g, n_shift):
+    nGrid = self.system.nGrid
+    n_dyn = (nGrid - 1) * self.system.fnum * self.system.qnum
+    n_goal = 3 * self.system.fnum
+    lam_g_dyn = utils.shift_time_major(lam_g[:n_dyn], nGrid - 1, n_shift)
+    lam_g_arena = lam_g[n_dyn+n_goal:]
+    if self.system.n_arena_knots > 0:
+      lam_g_arena = utils.shift_time_major(lam_g_arena, self.system.n_arena_knots, n_shift)
+    return np.concatenate((lam_g_dyn, lam_g[n_dyn:n_dyn+n_goal], lam_g_arena))
+
   """
   Computes cost
   """
-  def cost_func(self,t,s_flat,a):
+  def cost_func(self,t,s_flat,a,ft=None):
     cost = 0
     R = np.eye(self.system.fnum * self.system.qnum) * 0.01
     Q = np.eye(self.system.qnum) * 6 # Increase to encourage moving to ft_goal
 
     q,dq = self.system.s_unpack(s_flat)
+    if ft is None:
+      ft = self.system.get_ft_pos(s_flat)
 
     qnum = self.system.qnum
 
@@ -140,10 +218,8 @@ class StaticObjectOpt:
 
     # Add the current distance to fingertip goal
     for i in range(t.shape[0]):
-      q_cur = q[i, :]
-      ft_cur = self.system.FK(q_cur)
       for f_i in range(self.system.fnum):
-        delta = self.system.ft_goal_param[3*f_i:3*f_i+3] - np.squeeze(ft_cur[f_i])
+        delta = self.system.ft_goal_param[3*f_i:3*f_i+3] - ft[i, 3*f_i:3*f_i+3].T
         cost += 0.5 * delta.T @ Q @ delta
 
     # Add dq to cost, minimize joint velocity..? What is the control input here?
@@ -156,27 +232,26 @@ class StaticObjectOpt:
     #collision_weight = 0.03 # Increase to encourage collision avoidance
     pnorm_min = 1.2
     alpha = 8
+    # Skip building collision cost terms when they have no weight
+    if collision_weight == 0:
+      return cost
+
     for t_i in range(t.shape[0]):
-      q_cur = q[t_i, :]
       for f_i in range(self.system.fnum): # Each finger
-        centers = self.system.fingers[f_i].get_sphere_centers_wf(q_cur[qnum*f_i:qnum*f_i+qnum])
-        for l_i in [3]:  # Each link
-          # radius of spheres on link
-          r = self.system.fingers[f_i].r_list[l_i]
-          for i in range(centers[l_i].shape[0]): # For each sphere center on link
-            c = centers[l_i][i,:]
-            pnorm = self.system.get_pnorm_of_pos_wf(c)
-            #penalty = fmax(collision_weight * (pnorm_min - pnorm), 0) 
-            # smooth max
-            penalty = ((pnorm_min - pnorm) * np.e**(alpha*(pnorm_min - pnorm)))/(1 + np.e**(alpha*(pnorm_min - pnorm)))
-            cost += penalty * collision_weight
+        # Fingertip link has a single bounding sphere, centered at the fingertip
+        c = ft[t_i, 3*f_i:3*f_i+3]
+        pnorm = self.system.get_pnorm_of_pos_wf(c)
+        #penalty = fmax(collision_weight * (pnorm_min - pnorm), 0) 
+        # smooth max
+        penalty = ((pnorm_min - pnorm) * np.e**(alpha*(pnorm_min - pnorm)))/(1 + np.e**(alpha*(pnorm_min - pnorm)))
+        cost += penalty * collision_weight
 
     return cost
 
   """
   Formulates collocation constraints
   """
-  def get_constraints(self,system,t,s,a):
+  def get_constraints(self,system,t,s,a,ft=None):
 
     q,dq = system.s_unpack(s)
 
@@ -195,15 +270,15 @@ class StaticObjectOpt:
         lbg.append(0)
         ubg.append(0)
 
-    ft_goal_constraints = system.ft_goal_constraint(s, a)
+    ft_goal_constraints = system.ft_goal_constraint(s, a, ft)
     for r in range(ft_goal_constraints.shape[0]):
       for c in range(ft_goal_constraints.shape[1]):
         g.append(ft_goal_constraints[r,c])
         lbg.append(0)
         ubg.append(np.inf)
 
-    # Collision constraint
-    #coll_constraints = system.collision_constraint(s) 
+    # Collision constraint, disabled
+    #coll_constraints = system.collision_constraint(s, ft) 
     #for r in range(coll_constraints.shape[0]):
     #  for c in range(coll_constraints.shape[1]):
     #    g.append(coll_constraints[r,c])
@@ -211,7 +286,7 @@ class StaticObjectOpt:
     #    ubg.append(np.inf)
 
     # Fingertip radius constraint
-    ft_r_constraints = system.arena_constraint(s) 
+    ft_r_constraints = system.arena_constraint(s, ft) 
     for r in range(ft_r_constraints.shape[0]):
       for c in range(ft_r_constraints.shape[1]):
         g.append(ft_r_constraints[r,c])
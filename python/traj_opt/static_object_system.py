@@ -2,9 +2,12 @@ import numpy as np
 from casadi import *
 import pybullet
 
+from rrc_iprl_package.logging_utils import get_logger
 from rrc_iprl_package.traj_opt import utils
 from rrc_iprl_package.traj_opt.finger_model import FingerModel
 
+logger = get_logger("traj_opt.static_object_system")
+
 """
 Fingers and static object
 For collision avoidance
@@ -17,7 +20,7 @@ class StaticObjectSystem:
                obj_shape = None,
                log_file  = None,
               ):
-    print("Initialize static object system")
+    logger.debug("Initialize static object system")
     
     # Time parameters
     self.nGrid = nGrid
@@ -58,6 +61,15 @@ class StaticObjectSystem:
 
     # maximum fingertip radius
     self.MAX_FT_R = 0.195
+    # Arena constraint applies to timesteps ARENA_START_KNOT to nGrid
+    self.ARENA_START_KNOT = 10
+    self.n_arena_knots = max(nGrid - self.ARENA_START_KNOT, 0)
+
+    # (finger, link, sphere) pairs of the collision constraint
+    self.collision_pairs = self.get_collision_pairs()
+
+    # Fingertip positions at a single timestep
+    self.knot_fk_func = self.get_knot_fk_func()
 
 
 ################################################################################
@@ -157,6 +169,24 @@ class StaticObjectSystem:
 
     return vertcat(q_flat,dq_flat)
 
+  """
+  Shift decision variable values z forward in time by n_shift timesteps
+  Used to warm start a new solve from a previous solution
+  Also works on lam_x, which has the same layout as z
+  Times t and slack variables a are not shifted
+  """
+  def shift_decvar(self, z, n_shift):
+    nGrid = self.nGrid
+    dim = self.qnum * self.fnum
+    t, s_flat, a = self.decvar_unpack(np.asarray(z).flatten())
+
+    q_flat = s_flat[:nGrid*dim]
+    dq_flat = s_flat[nGrid*dim:]
+    s_shifted = np.concatenate((utils.shift_time_major(q_flat, nGrid, n_shift),
+                                utils.shift_time_major(dq_flat, nGrid, n_shift)))
+
+    return np.concatenate((t, s_shifted, a))
+
 ################################################################################
 # End of decision variable help functions
 ################################################################################
@@ -165,63 +195,133 @@ class StaticObjectSystem:
 # Constraint functions
 ################################################################################
 
+  """
+  Get fingertip positions in world frame at every timestep
+  FK is applied to all timesteps as a single knot Function mapped over the horizon,
+  so the result can be shared by the cost and all constraints
+  Return:
+  ft: (nGrid x fnum*3) matrix, each row is [finger1_x, finger1_y, finger1_z, ..., fingerN_z]
+  """
+  def get_ft_pos(self, s_flat):
+    q, dq  = self.s_unpack(s_flat)
+    ft = self.knot_fk_func.map(self.nGrid)(q.T)
+    return ft.T
+
+  """
+  Get casadi Function for fingertip positions at a single timestep
+  Input: q_i (fnum*qnum x 1)
+  Output: ft_i (fnum*3 x 1) fingertip positions in world frame
+  """
+  def get_knot_fk_func(self):
+    q_i = SX.sym("q_i", self.fnum*self.qnum)
+    ft_list = self.FK(q_i.T)
+    ft_i = vertcat(*[vertcat(*ft[:,0]) for ft in ft_list])
+    return Function("knot_fk", [q_i], [ft_i])
+
   """
   Constrain fingertip positions at end of trajectory to be at ft_goal
   With a slack variable
+  ft: fingertip positions from get_ft_pos(), computed if not given
   """
-  def ft_goal_constraint(self, s_flat,a):
-    q, dq  = self.s_unpack(s_flat)
-    q_end = q[-1, :]
+  def ft_goal_constraint(self, s_flat, a, ft = None):
+    if ft is None:
+      ft = self.get_ft_pos(s_flat)
+    ft_end = ft[-1, :]
 
-    # Get list of ft positions at q_end
-    ft_end = self.FK(q_end)
     con_list = []
     for f_i in range(self.fnum):
       for d_i in range(3): # x y z dimensions
-        f = a[f_i*3 + d_i] - (self.ft_goal_param[f_i*3 + d_i] - ft_end[f_i][d_i,0]) ** 2
+        f = a[f_i*3 + d_i] - (self.ft_goal_param[f_i*3 + d_i] - ft_end[0, f_i*3 + d_i]) ** 2
         con_list.append(f)
     return horzcat(*con_list)
 
   """
   Collision constraint
+  Only includes the (finger, link, sphere) pairs in self.collision_pairs
+  ft: fingertip positions from get_ft_pos(), computed if not given
   """
-  def collision_constraint(self, s_flat):
-    con_list = []
+  def collision_constraint(self, s_flat, ft = None):
     q, dq  = self.s_unpack(s_flat)
+    if ft is None:
+      ft = self.get_ft_pos(s_flat)
 
-    # TODO: for now, just consider fingertip
-    for t_i in range(self.nGrid):
-      q_cur = q[t_i, :]
-      for f_i in range(self.fnum): # Each finger
-        centers = self.fingers[f_i].get_sphere_centers_wf(q_cur[self.qnum*f_i:self.qnum*f_i+self.qnum])
-        for l_i in [2,3]:  # Each link
-          # radius of spheres on link
-          r = self.fingers[f_i].r_list[l_i]
-          for i in range(centers[l_i].shape[0]): # For each sphere center on link
-            c = centers[l_i][i,:]
-            pnorm = self.get_pnorm_of_pos_wf(c)
-
-            f = pnorm - r - 1 
-            con_list.append(f)
-    return horzcat(*con_list)
+    # Apply single knot constraints to all timesteps, one column per timestep
+    obj_pose = repmat(self.obj_pose_param, 1, self.nGrid)
+    con = self.get_knot_collision_func().map(self.nGrid)(q.T, ft.T, obj_pose)
+    return reshape(con, 1, con.numel())
+
+  """
+  Get casadi Function for collision constraints at a single timestep
+  Inputs: q_i (fnum*qnum x 1), ft_i (fnum*3 x 1), obj_pose (7x1)
+  Output: one constraint per pair in self.collision_pairs
+  """
+  def get_knot_collision_func(self):
+    q_i = SX.sym("q_i", self.fnum*self.qnum)
+    ft_i = SX.sym("ft_i", self.fnum*3)
+
+    con_list = []
+    for f_i in range(self.fnum): # Each finger
+      pairs = [(l_i, c_i) for (f, l_i, c_i) in self.collision_pairs if f == f_i]
+      if not pairs:
+        continue
+      centers = self.fingers[f_i].get_sphere_centers_wf(q_i[self.qnum*f_i:self.qnum*f_i+self.qnum])
+      for l_i, c_i in pairs:
+        # radius of spheres on link
+        r = self.fingers[f_i].r_list[l_i]
+        if l_i == 3:
+          c = ft_i[3*f_i:3*f_i+3].T # Fingertip sphere is at FK fingertip position
+        else:
+          c = centers[l_i][c_i,:]
+        pnorm = self.get_pnorm_of_pos_wf(c)
+
+        f = pnorm - r - 1 
+        con_list.append(f)
+    return Function("knot_collision", [q_i, ft_i, self.obj_pose_param], [vertcat(*con_list)])
+
+  """
+  Get list of (finger, link, sphere) collision pairs to constrain
+  Every sphere on links 2 and 3 of every finger
+  """
+  def get_collision_pairs(self):
+    pairs = []
+    for f_i in range(self.fnum): # Each finger
+      finger = self.fingers[f_i]
+      for l_i in [2,3]: # Each link
+        for c_i in range(finger.sphere_centers_lf[l_i].shape[0]): # For each sphere center on link
+          pairs.append((f_i, l_i, c_i))
+    return pairs
 
   """
   Constraint to keep end effectors within a pre-defined radius
+  ft: fingertip positions from get_ft_pos(), computed if not given
   """
-  def arena_constraint(self, s_flat):
-    q, dq  = self.s_unpack(s_flat)
-    # Get list of ft positions at q_end
+  def arena_constraint(self, s_flat, ft = None):
+    if ft is None:
+      ft = self.get_ft_pos(s_flat)
+
+    if self.n_arena_knots == 0:
+      return SX(1, 0)
+
+    # Apply single knot constraints to timesteps ARENA_START_KNOT to nGrid, one column per timestep
+    con = self.get_knot_arena_func().map(self.n_arena_knots)(ft[self.ARENA_START_KNOT:, :].T)
+    return reshape(con, 1, con.numel())
+
+  """
+  Get casadi Function for arena constraints at a single timestep
+  Input: ft_i (fnum*3 x 1) fingertip positions in world frame
+  Output: (fnum*2 x 1), [max xy radius, above ground] for each finger
+  """
+  def get_knot_arena_func(self):
+    ft_i = SX.sym("ft_i", self.fnum*3)
     con_list = []
-    for t_i in range(10,self.nGrid):
-      ft = self.FK(q[t_i,:])
-      for f_i in range(self.fnum):
-        r = norm_2(ft[f_i][0:2,0])
-        z = ft[f_i][2,0]
-        con_list.append(self.MAX_FT_R - r) # within max xy radius 
+    for f_i in range(self.fnum):
+      r = norm_2(ft_i[3*f_i:3*f_i+2])
+      z = ft_i[3*f_i+2]
+      con_list.append(self.MAX_FT_R - r) # within max xy radius 
         
-        # z coord is above ground
-        con_list.append(z - 0.01)
-    return horzcat(*con_list)
+      # z coord is above ground
+      con_list.append(z - 0.01)
+    return Function("knot_arena", [ft_i], [vertcat(*con_list)])
 ################################################################################
 # End of constraint functions
 ################################################################################
@@ -1,5 +1,24 @@
 import numpy as np
 from casadi import *
+import casadi
+import hashlib
+import os
+import subprocess
+import tempfile
+
+from rrc_iprl_package.logging_utils import get_logger
+from rrc_iprl_package.traj_opt.cache import CODEGEN_CACHE_DIR
+
+logger = get_logger("traj_opt.utils")
+
+# IPOPT options for solves started from a previous solution and its multipliers.
+# Only useful with nonzero multipliers, so cold solves use a solver without them
+WARM_START_OPTIONS = {"ipopt.warm_start_init_point": "yes",
+                      "ipopt.warm_start_bound_push": 1e-6,
+                      "ipopt.warm_start_slack_bound_push": 1e-6,
+                      "ipopt.warm_start_mult_bound_push": 1e-6,
+                      }
+
 """
 Multiple 2 quaternions
 return q * n
@@ -71,3 +90,74 @@ def invert_transform(p, quat):
 
   return p_inv, quat_inv
   
+
+"""
+Shift a time-major flat vector forward in time by n_shift timesteps
+Each timestep is one block of the vector, and the last block is repeated
+to fill the end of the horizon
+Inputs:
+v: flat vector with n_blocks blocks of equal size
+n_shift: number of timesteps to shift by
+"""
+def shift_time_major(v, n_blocks, n_shift):
+  v = np.reshape(np.asarray(v), (n_blocks, -1))
+  n_shift = int(np.clip(n_shift, 0, n_blocks - 1))
+  shifted = np.concatenate((v[n_shift:], np.repeat(v[-1:], n_shift, axis=0)))
+  return shifted.flatten()
+
+"""
+Get nlpsol solver for problem, optionally with C code-generated NLP functions
+With codegen, the objective, constraints, and their derivatives are generated as C
+and compiled to a shared library, cached on disk under a hash of cache_key.
+Later calls with the same cache_key load the library instead of re-deriving them.
+Inputs:
+name: solver name
+problem: nlpsol problem dict with x, f, g, p
+options: nlpsol options
+cache_key: tuple identifying the formulation, ie. (class name, version, nGrid, dt, ...)
+codegen: use compiled NLP functions
+"""
+def get_nlpsol(name, problem, options, cache_key = None, codegen = False):
+  if not codegen:
+    return nlpsol(name, "ipopt", problem, options)
+
+  key_str = repr((cache_key, casadi.__version__))
+  key_hash = hashlib.sha1(key_str.encode("utf-8")).hexdigest()[:16]
+  lib_path = os.path.join(CODEGEN_CACHE_DIR, "{}_{}.so".format(name, key_hash))
+
+  if not os.path.exists(lib_path):
+    try:
+      compile_nlpsol(name, problem, lib_path)
+    except (OSError, subprocess.CalledProcessError) as e:
+      logger.warning("get_nlpsol: codegen failed (%s), using non-compiled solver", e)
+      return nlpsol(name, "ipopt", problem, options)
+  else:
+    logger.info("get_nlpsol: loading compiled solver %s", lib_path)
+
+  return nlpsol(name, "ipopt", lib_path, options)
+
+"""
+Generate C code for the NLP functions of problem and compile it to lib_path
+The C file is generated and compiled in a private temporary directory, and the
+library moved into place, so concurrent runs never share a C file or load a
+partially written library
+"""
+def compile_nlpsol(name, problem, lib_path):
+  os.makedirs(os.path.dirname(lib_path), exist_ok=True)
+  solver = nlpsol(name, "ipopt", problem)
+  with tempfile.TemporaryDirectory(dir=os.path.dirname(lib_path)) as tmp_dir:
+    c_name = name + ".c"
+    tmp_lib = os.path.join(tmp_dir, os.path.basename(lib_path))
+    # Same functions as solver.generate_dependencies(), which can only write to
+    # the working directory: the NLP oracle, and the derivatives IPOPT uses
+    cg = CodeGenerator(c_name, {"with_header": False})
+    cg.add(solver.oracle())
+    for f_name in solver.get_function():
+      cg.add(solver.get_function(f_name))
+    cg.generate(tmp_dir + os.sep)
+
+    logger.info("get_nlpsol: compiling %s", lib_path)
+    cc = os.environ.get("CC", "gcc")
+    subprocess.check_call([cc, "-fPIC", "-shared", "-O1",
+                           os.path.join(tmp_dir, c_name), "-o", tmp_lib])
+    os.replace(tmp_lib, lib_path)
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""Cross-check and benchmark the analytic kinematics backend against pinocchio.
+
+Compares fingertip positions, orientations and Jacobians, and gravity torques
+of KinematicsSnapshot with the "pinocchio" and "analytic" backends at random
+joint positions, then times one snapshot per control tick with each backend,
+and batched AnalyticKinematics.compute() calls.
+
+Usage: benchmark_analytic_kinematics.py [n_ticks] [batch_size]
+"""
+import pathlib
+import sys
+import time
+
+import numpy as np
+import robot_properties_fingers
+from trifinger_simulation.finger_types_data import get_finger_urdf
+
+from rrc_iprl_package.control.custom_pinocchio_utils import CustomPinocchioUtils, KinematicsSnapshot
+
+CONTROL_PERIOD_US = 1000.0 # 1 kHz
+TIP_LINK_NAMES = ["finger_tip_link_0", "finger_tip_link_120", "finger_tip_link_240"]
+N_CHECK = 1000
+
+
+def main():
+    n_ticks = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    rng = np.random.default_rng(0)
+
+    urdf_path = str(pathlib.Path(robot_properties_fingers.__file__).parent / "urdf" /
+                    get_finger_urdf("trifingerpro"))
+    pin_utils = CustomPinocchioUtils(urdf_path, TIP_LINK_NAMES, backend="pinocchio")
+    analytic_utils = CustomPinocchioUtils(urdf_path, TIP_LINK_NAMES, backend="analytic")
+
+    # Cross-check
+    Q = rng.uniform(-np.pi, np.pi, size=(N_CHECK, 9))
+    errs = {"tip_pos": 0, "tip_R": 0, "tip_jacobians": 0, "g_list": 0}
+    for q in Q:
+        ref = KinematicsSnapshot(pin_utils, q)
+        snap = KinematicsSnapshot(analytic_utils, q)
+        for name in errs:
+            err = np.max(np.abs(np.array(getattr(snap, name)) - np.array(getattr(ref, name))))
+            errs[name] = max(errs[name], err)
+    batch = analytic_utils.analytic.compute(Q)
+    errs["batch"] = max(np.max(np.abs(batch["tip_jacobians"][i] -
+                                      analytic_utils.analytic.compute(q)["tip_jacobians"]))
+                        for i, q in enumerate(Q[:100]))
+    for name, err in errs.items():
+        print("max {} difference: {:.2e}".format(name, err))
+
+    # Per tick snapshot, as in ImpedanceControllerPolicy.predict()
+    times = {}
+    for name, utils in [("pinocchio", pin_utils), ("analytic", analytic_utils)]:
+        t_start = time.perf_counter()
+        for i in range(n_ticks):
+            KinematicsSnapshot(utils, Q[i % N_CHECK])
+        times[name] = (time.perf_counter() - t_start) / n_ticks * 1e6
+
+    Q_batch = rng.uniform(-np.pi, np.pi, size=(batch_size, 9))
+    n_batches = max(1, n_ticks // batch_size)
+    t_start = time.perf_counter()
+    for _ in range(n_batches):
+        analytic_utils.analytic.compute(Q_batch)
+    t_batch = (time.perf_counter() - t_start) / (n_batches * batch_size) * 1e6
+
+    print("{:>32} {:>10} {:>16}".format("", "us/config", "% of 1 kHz tick"))
+    for name, t in times.items():
+        print("{:>32} {:>10.1f} {:>15.1f}%".format("KinematicsSnapshot " + name, t,
+                                                   100 * t / CONTROL_PERIOD_US))
+    print("{:>32} {:>10.2f} {:>15.2f}%".format("analytic batch of {}".format(batch_size),
+                                               t_batch, 100 * t_batch / CONTROL_PERIOD_US))
+
+
+if __name__ == "__main__":
+    main()
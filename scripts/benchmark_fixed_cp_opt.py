@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""Benchmark FixedContactPointOpt problem build and solve times.
+
+Compares the per-timestep python loop formulation of the object dynamics
+against the mapped single knot casadi Function, and checks that both give
+the same dynamics and friction cone constraints.
+
+Usage: benchmark_fixed_cp_opt.py [nGrid ...]
+"""
+import sys
+import time
+
+import numpy as np
+from casadi import *
+
+from rrc_iprl_package.control import controller_utils as c_utils
+from rrc_iprl_package.traj_opt.fixed_contact_point_opt import FixedContactPointOpt
+from rrc_iprl_package.traj_opt.fixed_contact_point_system import FixedContactPointSystem
+
+TF = 2.0 # Trajectory length, seconds
+FNUM = 3
+CP_PARAMS = [[1, 0, 0], [0, 1, 0], [0, -1, 0]]
+X0 = np.array([[0, 0, 0.0325, 0, 0, 0, 1]])
+X_GOAL = np.array([[0, 0, 0.0825, 0, 0, 0, 1]])
+
+
+def dynamics_loop(self, s_flat, l_flat):
+    """Reference per-timestep loop formulation of FixedContactPointSystem.dynamics"""
+    x, dx = self.s_unpack(s_flat)
+    l = self.l_unpack(l_flat)
+
+    Mo = self.get_M_obj()
+    Mo_inv = diag(1 / diag(Mo))
+    gapp = self.get_gapp()
+
+    new_dx_list = []
+    ddx_list = []
+    for t_ind in range(self.nGrid):
+        x_i = x[t_ind, :]
+        dx_i = dx[t_ind, :]
+
+        new_dx_i = SX.zeros((7, 1))
+        new_dx_i[0:3, :] = dx_i[0, 0:3]
+        quat_i = x_i[0, 3:]
+        new_dx_i[3:, :] = 0.5 * self.get_dx_to_dquat_matrix(quat_i) @ dx_i[0, 3:].T
+        new_dx_list.append(new_dx_i)
+
+        G = self.get_grasp_matrix(x_i)
+        ddx_list.append(Mo_inv @ (gapp + G @ l[t_ind, :].T))
+
+    new_dx = horzcat(*new_dx_list).T
+    ddx = horzcat(*ddx_list).T
+    return self.s_pack(new_dx, ddx)
+
+
+def friction_cone_constraints_loop(self, l_flat):
+    """Reference formulation of FixedContactPointSystem.friction_cone_constraints"""
+    l = self.l_unpack(l_flat)
+    f1_constraints = SX.zeros((self.nGrid, self.fnum * 2))
+    f2_constraints = SX.zeros((self.nGrid, self.fnum * 2))
+    mu = np.sqrt(2) * self.obj_mu
+    for col in range(self.fnum):
+        f1_constraints[:, 2*col] = mu * l[:, col*self.l_i] + l[:, col*self.l_i + 1]
+        f2_constraints[:, 2*col] = -1 * l[:, col*self.l_i + 1] + mu * l[:, col*self.l_i]
+        f1_constraints[:, 2*col+1] = mu * l[:, col*self.l_i] + l[:, col*self.l_i + 2]
+        f2_constraints[:, 2*col+1] = -1 * l[:, col*self.l_i + 2] + mu * l[:, col*self.l_i]
+    return vertcat(f1_constraints, f2_constraints)
+
+
+def check_constraints(nGrid, dt):
+    """Return max abs difference between loop and mapped formulations at random values"""
+    system = FixedContactPointSystem(nGrid=nGrid, dt=dt, fnum=FNUM)
+    t, s_flat, l_flat, a = system.dec_vars()
+    p = system.get_param_vector()
+    args = [s_flat, l_flat, p]
+
+    f_map = Function("f_map", args, [system.dynamics(s_flat, l_flat),
+                                     system.friction_cone_constraints(l_flat)])
+    f_loop = Function("f_loop", args, [dynamics_loop(system, s_flat, l_flat),
+                                       friction_cone_constraints_loop(system, l_flat)])
+
+    rng = np.random.default_rng(0)
+    p_val = system.get_param_values(X_GOAL, CP_PARAMS, c_utils.OBJ_SIZE, c_utils.OBJ_MASS)
+    vals = [rng.standard_normal(s_flat.shape[0]), rng.standard_normal(l_flat.shape[0]), p_val]
+
+    err = 0
+    for out_map, out_loop in zip(f_map(*vals), f_loop(*vals)):
+        err = max(err, np.max(np.abs(np.array(out_map) - np.array(out_loop))))
+    return err
+
+
+def time_build_and_solve(nGrid, dt):
+    t_start = time.perf_counter()
+    opt = FixedContactPointOpt(nGrid=nGrid, dt=dt, fnum=FNUM)
+    t_build = time.perf_counter() - t_start
+
+    t_start = time.perf_counter()
+    opt.solve_nlp(CP_PARAMS, X0, X_GOAL, c_utils.OBJ_SIZE, c_utils.OBJ_MASS)
+    t_solve = time.perf_counter() - t_start
+    return t_build, t_solve, opt.iter_count
+
+
+def main():
+    nGrid_list = [int(n) for n in sys.argv[1:]] or [50, 100, 200]
+
+    results = []
+    for nGrid in nGrid_list:
+        dt = TF / (nGrid - 1)
+        err = check_constraints(nGrid, dt)
+
+        mapped_dynamics = FixedContactPointSystem.dynamics
+        FixedContactPointSystem.dynamics = dynamics_loop
+        try:
+            loop_times = time_build_and_solve(nGrid, dt)
+        finally:
+            FixedContactPointSystem.dynamics = mapped_dynamics
+        map_times = time_build_and_solve(nGrid, dt)
+
+        results.append((nGrid, err, loop_times, map_times))
+
+    print("\n{:>6} {:>10} {:>12} {:>12} {:>12} {:>12}".format(
+          "nGrid", "max err", "build loop", "build map", "solve loop", "solve map"))
+    for nGrid, err, loop_times, map_times in results:
+        print("{:>6} {:>10.2e} {:>11.3f}s {:>11.3f}s {:>11.3f}s {:>11.3f}s".format(
+              nGrid, err, loop_times[0], map_times[0], loop_times[1], map_times[1]))
+
+
+if __name__ == "__main__":
+    main()
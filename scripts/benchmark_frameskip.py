@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""Benchmark RealRobotCubeEnv.step() with FAST_STEP on and off.
+
+Steps two envs with the same initial and goal pose and the same random
+position actions, one with FAST_STEP and one without, checks that rewards and
+observations are equal, and reports simulation steps per second of each mode
+for several frameskip values.
+
+Usage: benchmark_frameskip.py [n_steps] [frameskip ...]
+"""
+import sys
+import time
+
+import numpy as np
+from trifinger_simulation.tasks import move_cube
+
+from rrc_iprl_package.envs import cube_env
+
+
+def flatten(observation):
+    if isinstance(observation, dict):
+        return np.concatenate([flatten(observation[k]) for k in sorted(observation)])
+    return np.asarray(observation, dtype=float).flatten()
+
+
+def main():
+    n_steps = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    frameskips = [int(f) for f in sys.argv[2:]] or [1, 5, 10, 25]
+    initial_pose = move_cube.sample_goal(difficulty=-1).to_dict()
+    goal_pose = move_cube.sample_goal(difficulty=4).to_dict()
+
+    print("{:>10} {:>16} {:>16} {:>8} {:>12}".format(
+        "frameskip", "sim steps/s", "FAST_STEP", "speedup", "equal"))
+    for frameskip in frameskips:
+        rng = np.random.default_rng(0)
+        envs = {}
+        for fast_step in [False, True]:
+            env = cube_env.RealRobotCubeEnv(goal_pose, initial_pose, goal_difficulty=4,
+                                            visualization=False, frameskip=frameskip)
+            env.FAST_STEP = fast_step
+            env.reset()
+            envs[fast_step] = env
+
+        times = {False: 0.0, True: 0.0}
+        equal = True
+        for _ in range(n_steps):
+            action = np.clip(envs[False].default_position + 0.3 * rng.standard_normal(9),
+                             envs[False].action_space.low, envs[False].action_space.high)
+            results = {}
+            for fast_step, env in envs.items():
+                t_start = time.perf_counter()
+                results[fast_step] = env.step(action)
+                times[fast_step] += time.perf_counter() - t_start
+            (obs, reward, done, _), (fast_obs, fast_reward, fast_done, _) = results[False], results[True]
+            equal &= (reward == fast_reward and done == fast_done and
+                      np.array_equal(flatten(obs), flatten(fast_obs)))
+            if done:
+                break
+
+        sim_steps = envs[False].step_count
+        print("{:>10} {:>16.0f} {:>16.0f} {:>8.2f} {:>12}".format(
+            frameskip, sim_steps / times[False], sim_steps / times[True],
+            times[False] / times[True], str(equal)))
+        for env in envs.values():
+            env.close()
+
+
+if __name__ == "__main__":
+    main()
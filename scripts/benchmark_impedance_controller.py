@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""Microbenchmark of the impedance control law at 1 kHz.
+
+Compares per-tick cost of controller_utils.impedance_controller (one call per
+finger, gain matrices built on every call) with the batched
+controller_utils.ImpedanceController, on the same kinematics snapshot. Only the
+control law is timed; the snapshot itself is computed once per tick by both.
+
+Usage: benchmark_impedance_controller.py [n_ticks]
+"""
+import sys
+import time
+import types
+
+import numpy as np
+
+from rrc_iprl_package.control import controller_utils as c_utils
+from rrc_iprl_package.control.control_policy import ImpedanceControllerPolicy
+
+CONTROL_PERIOD_US = 1000.0 # 1 kHz
+
+
+def random_snapshot(rng):
+    """Kinematics snapshot with random block diagonal fingertip Jacobians"""
+    tip_jacobians = []
+    g_list = []
+    for finger_id in range(3):
+        J = np.zeros((6, 9))
+        J[:, finger_id*3:finger_id*3+3] = rng.standard_normal((6, 3)) * 0.1
+        tip_jacobians.append(J)
+        g = np.zeros(9)
+        g[finger_id*3:finger_id*3+3] = rng.standard_normal(3) * 0.01
+        g_list.append(g)
+    tip_pos = [rng.standard_normal(3) * 0.1 for _ in range(3)]
+    return types.SimpleNamespace(tip_pos=tip_pos, tip_jacobians=tip_jacobians, g_list=g_list)
+
+
+def main():
+    n_ticks = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    rng = np.random.default_rng(0)
+
+    kinematics = random_snapshot(rng)
+    pinocchio_utils = types.SimpleNamespace(get_snapshot=lambda q: kinematics)
+    KP = ImpedanceControllerPolicy.KP
+    KV = ImpedanceControllerPolicy.KV
+
+    q = rng.standard_normal(9)
+    dq = rng.standard_normal(9)
+    ft_pos = [list(rng.standard_normal(3) * 0.1) for _ in range(3)]
+    ft_vel = [list(rng.standard_normal(3) * 0.01) for _ in range(3)]
+    ft_force = rng.standard_normal(9)
+
+    controller = c_utils.ImpedanceController(KP, KV)
+
+    # Check both give the same torques
+    torque_ref = c_utils.impedance_controller(ft_pos, ft_vel, q, dq, pinocchio_utils,
+                                              tip_forces_wf=ft_force, Kp=KP, Kv=KV)
+    torque = controller.compute(ft_pos, ft_vel, dq, kinematics, tip_forces_wf=ft_force)
+    err = np.max(np.abs(torque - torque_ref))
+
+    t_start = time.perf_counter()
+    for _ in range(n_ticks):
+        c_utils.impedance_controller(ft_pos, ft_vel, q, dq, pinocchio_utils,
+                                     tip_forces_wf=ft_force, Kp=KP, Kv=KV)
+    t_before = (time.perf_counter() - t_start) / n_ticks * 1e6
+
+    t_start = time.perf_counter()
+    for _ in range(n_ticks):
+        controller.set_gains(KP, KV)
+        controller.compute(ft_pos, ft_vel, dq, kinematics, tip_forces_wf=ft_force)
+    t_after = (time.perf_counter() - t_start) / n_ticks * 1e6
+
+    print("max torque difference: {:.2e}".format(err))
+    print("{:>28} {:>10} {:>16}".format("", "us/tick", "% of 1 kHz tick"))
+    print("{:>28} {:>10.1f} {:>15.1f}%".format("impedance_controller", t_before,
+                                               100 * t_before / CONTROL_PERIOD_US))
+    print("{:>28} {:>10.1f} {:>15.1f}%".format("ImpedanceController.compute", t_after,
+                                               100 * t_after / CONTROL_PERIOD_US))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""Benchmark episode resets with PlatformCache against building a new platform.
+
+Times building a TriFingerPlatform against PlatformCache.get(), and
+RealRobotCubeEnv.reset() with FAST_RESET on and off (which also steps the robot
+until it settles at its default position). Then checks that rollouts on a
+restored platform match those on a newly built platform for the same actions
+(see check_equivalence), and exits with status 1 if they do not.
+
+Usage: benchmark_reset.py [n_resets]
+"""
+import copy
+import sys
+import time
+
+import numpy as np
+from trifinger_simulation import TriFingerPlatform
+from trifinger_simulation.tasks import move_cube
+
+from rrc_iprl_package.envs import cube_env
+from rrc_iprl_package.envs.platform_cache import PlatformCache
+
+N_STEPS = 500
+# Cube offset of the new platform rollouts restored rollouts are compared with
+PERTURBATION = 1e-5
+
+
+def run(platform):
+    """Get robot and cube states while moving the fingers through the arena."""
+    default = TriFingerPlatform.spaces.robot_position.default
+    states = []
+    for i in range(N_STEPS):
+        action = platform.Action(position=default + 0.4 * np.sin(i / 40.0))
+        t = platform.append_desired_action(action)
+        robot_obs = platform.get_robot_observation(t)
+        object_pose = platform.get_camera_observation(t).object_pose
+        states.append(np.concatenate([robot_obs.position, robot_obs.velocity, robot_obs.torque,
+                                      object_pose.position, object_pose.orientation]))
+    return np.array(states)
+
+
+def time_per_call(fn, n):
+    """Get mean time of fn(i) for i in range(n), in ms."""
+    t_start = time.perf_counter()
+    for i in range(n):
+        fn(i)
+    return (time.perf_counter() - t_start) / n * 1e3
+
+
+def main():
+    n_resets = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    poses = [move_cube.sample_goal(difficulty=-1) for _ in range(n_resets)]
+    cache = PlatformCache()
+    cache.get(poses[0])
+
+    print("{:>40} {:>10}".format("", "ms/reset"))
+    print("{:>40} {:>10.2f}".format("TriFingerPlatform()", time_per_call(
+        lambda i: TriFingerPlatform(initial_object_pose=poses[i]), n_resets)))
+    print("{:>40} {:>10.2f}".format("PlatformCache.get()", time_per_call(
+        lambda i: cache.get(poses[i]), n_resets)))
+    for fast_reset in [False, True]:
+        env = cube_env.RealRobotCubeEnv(move_cube.sample_goal(difficulty=1).to_dict(),
+                                        poses[0].to_dict(), visualization=False)
+        env.FAST_RESET = fast_reset
+        env.reset()
+        print("{:>40} {:>10.2f}".format("RealRobotCubeEnv.reset(), FAST_RESET={}".format(fast_reset),
+                                        time_per_call(lambda i: env.reset(), n_resets)))
+        env.close()
+
+    if not check_equivalence(poses):
+        sys.exit(1)
+
+
+def check_equivalence(poses):
+    """Check that episodes on a restored platform match those on a new platform.
+
+    Rollouts are not bitwise equal: solver state pybullet keeps across steps
+    (e.g. warm started impulses) survives a restore, and contacts amplify such
+    differences. The simulator is as sensitive to its initial state though:
+    moving the cube by PERTURBATION (10 um) on a new platform changes a rollout
+    about as much. So restored rollouts match if their median difference to
+    new platform rollouts is no larger than that of perturbed ones. Each
+    restore follows an episode from another pose, so that state left over from
+    earlier episodes is included.
+    Returns:
+        True if restored rollouts match.
+    """
+    cache = PlatformCache()
+    cache.get(poses[-1])
+
+    print("\n{:>40} {:>14} {:>14}".format("max state difference to new platform", "restored",
+                                           "cube moved"))
+    restored_diffs = []
+    moved_diffs = []
+    for pose in poses:
+        run(cache.get(poses[-1]))
+        restored = run(cache.get(pose))
+        reference = run(TriFingerPlatform(initial_object_pose=pose))
+        moved_pose = copy.deepcopy(pose)
+        moved_pose.position = moved_pose.position + PERTURBATION
+        moved = run(TriFingerPlatform(initial_object_pose=moved_pose))
+
+        restored_diffs.append(np.abs(restored - reference).max())
+        moved_diffs.append(np.abs(moved - reference).max())
+        print("{:>40} {:>14.2e} {:>14.2e}".format(
+            "cube at {}".format(np.round(pose.position, 3)), restored_diffs[-1], moved_diffs[-1]))
+
+    match = np.median(restored_diffs) <= np.median(moved_diffs)
+    print("{:>40} {:>14.2e} {:>14.2e}".format("median", np.median(restored_diffs),
+                                              np.median(moved_diffs)))
+    print("restored rollouts {} new platform rollouts".format("match" if match else "DO NOT match"))
+    return match
+
+
+if __name__ == "__main__":
+    main()
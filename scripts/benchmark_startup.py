@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""Benchmark cold start of the control policy, up to the first action.
+
+Each measurement runs in a fresh python process, so nothing is already
+imported. Reports import time of the control modules, and which heavy
+dependencies they pulled in, then time-to-first-action of a
+HierarchicalControllerPolicy in TRAJ_OPT mode (no RL load_dir), in simulation:
+import, policy construction, reset_policy() (first plan), and first predict().
+
+Usage: benchmark_startup.py [n_runs]
+"""
+import json
+import subprocess
+import sys
+
+IMPORT_MODULES = [
+    "rrc_iprl_package.control.controller_utils",
+    "rrc_iprl_package.control.control_policy",
+]
+HEAVY_MODULES = ["casadi", "torch", "joblib", "sympy", "scipy.optimize",
+                 "scipy.interpolate", "pinocchio", "pybullet", "gym"]
+
+IMPORT_CHILD = """
+import json, sys, time
+t = time.perf_counter()
+import {module}
+dt = time.perf_counter() - t
+print(json.dumps({{"import_s": dt, "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+FIRST_ACTION_CHILD = """
+import json, sys, time
+t_start = time.perf_counter()
+phases = {}
+
+import numpy as np
+from trifinger_simulation import TriFingerPlatform
+from trifinger_simulation.tasks import move_cube
+from rrc_iprl_package.control.controller_utils import PolicyMode
+from rrc_iprl_package.control.control_policy import HierarchicalControllerPolicy
+phases["import"] = time.perf_counter()
+
+initial_pose = move_cube.Pose(position=np.array([0.0, 0.0, move_cube._CUBOID_SIZE[2] / 2]),
+                              orientation=np.array([0, 0, 0, 1]))
+goal_pose = move_cube.Pose(position=np.array([0.0, 0.0, 0.08]), orientation=np.array([0, 0, 0, 1]))
+platform = TriFingerPlatform(visualization=False, initial_object_pose=initial_pose)
+phases["platform"] = time.perf_counter()
+
+action_space = {"torque": TriFingerPlatform.spaces.robot_torque.gym}
+policy = HierarchicalControllerPolicy(action_space=action_space, initial_pose=initial_pose,
+                                      goal_pose=goal_pose, load_dir="", difficulty=1,
+                                      start_mode=PolicyMode.TRAJ_OPT)
+phases["policy"] = time.perf_counter()
+
+robot_observation = platform.get_robot_observation(0)
+camera_observation = platform.get_camera_observation(0)
+object_pose = camera_observation.object_pose
+impedance_observation = {
+    "observation": {"position": robot_observation.position,
+                    "velocity": robot_observation.velocity},
+    "achieved_goal": {"position": object_pose.position, "orientation": object_pose.orientation},
+    "desired_goal": goal_pose.to_dict(),
+    "cam0_timestamp": 0.0,
+}
+policy.reset_policy(impedance_observation, platform)
+phases["reset_policy"] = time.perf_counter()
+
+policy.impedance_controller.predict(impedance_observation)
+phases["first_action"] = time.perf_counter()
+
+print(json.dumps({k: v - t_start for k, v in phases.items()}))
+policy.close()
+"""
+
+
+def run_child(source):
+    out = subprocess.run([sys.executable, "-c", source], check=True,
+                         stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                         universal_newlines=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    n_runs = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+
+    print("{:>44} {:>10}  heavy modules loaded".format("import", "s"))
+    for module in IMPORT_MODULES:
+        results = [run_child(IMPORT_CHILD.format(module=module, heavy=HEAVY_MODULES))
+                   for _ in range(n_runs)]
+        print("{:>44} {:>10.3f}  {}".format(module, min(r["import_s"] for r in results),
+                                            ", ".join(results[0]["loaded"])))
+
+    results = [run_child(FIRST_ACTION_CHILD) for _ in range(n_runs)]
+    print("\n{:>44} {:>10}".format("time-to-first-action, cumulative", "s"))
+    for phase in results[0]:
+        print("{:>44} {:>10.3f}".format(phase, min(r[phase] for r in results)))
+
+
+if __name__ == "__main__":
+    main()
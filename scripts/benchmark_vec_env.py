@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""Benchmark env steps/sec of SharedMemoryVecEnv against number of worker envs.
+
+Steps PushCubeEnv instances (pybullet DIRECT) with random actions, serially in
+this process, then with SharedMemoryVecEnv for each number of envs. Speedup
+with more envs than cores only measures the IPC overhead, not scaling, so the
+results say so.
+
+Near-linear scaling with cores has NOT been measured: the development box has
+a single core. There, with a toy env, SharedMemoryVecEnv adds about 70 us of
+IPC per step, and more envs only share the one core.
+
+Usage: benchmark_vec_env.py [n_steps] [num_envs ...]
+"""
+import multiprocessing
+import sys
+import time
+
+import numpy as np
+
+from rrc_iprl_package.envs import custom_env
+from rrc_iprl_package.envs.vec_env import SharedMemoryVecEnv
+
+FRAMESKIP = 10
+
+
+def make_env():
+    return custom_env.PushCubeEnv(frameskip=FRAMESKIP, visualization=False)
+
+
+def main():
+    n_steps = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    num_envs_list = [int(n) for n in sys.argv[2:]] or \
+        sorted({1, 2, 4, multiprocessing.cpu_count()})
+
+    env = make_env()
+    env.reset()
+    t_start = time.perf_counter()
+    for _ in range(n_steps):
+        _, _, done, _ = env.step(env.action_space.sample())
+        if done:
+            env.reset()
+    serial = n_steps / (time.perf_counter() - t_start)
+    env.close()
+
+    n_cores = multiprocessing.cpu_count()
+    print("{} cores".format(n_cores))
+    print("{:>10} {:>12} {:>10}".format("num_envs", "steps/s", "speedup"))
+    print("{:>10} {:>12.1f} {:>10.2f}".format("serial", serial, 1.0))
+    for num_envs in num_envs_list:
+        vec_env = SharedMemoryVecEnv([make_env] * num_envs)
+        vec_env.reset()
+        actions = np.stack([vec_env.action_space.sample() for _ in range(num_envs)])
+        t_start = time.perf_counter()
+        for _ in range(n_steps):
+            vec_env.step(actions)
+        steps_per_s = num_envs * n_steps / (time.perf_counter() - t_start)
+        vec_env.close()
+        print("{:>10} {:>12.1f} {:>10.2f}{}".format(num_envs, steps_per_s, steps_per_s / serial,
+              "  (more envs than cores, scaling not measured)" if num_envs > n_cores else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""Compare IPOPT iterations and solve times of warm started and cold traj opt re-solves.
+
+Solves StaticObjectOpt and FixedContactPointOpt, with the problem sizes the
+policy uses, for a sequence of nearby problems, with and without warm_start.
+The first solve is cold in both cases. Re-solves of StaticObjectOpt are shifted
+by n_shift knots, as if part of the previous trajectory had been executed.
+
+Usage: benchmark_warm_start.py [n_solves]
+"""
+import sys
+import time
+
+import numpy as np
+from trifinger_simulation.tasks import move_cube
+
+from rrc_iprl_package.control import controller_utils as c_utils
+from rrc_iprl_package.traj_opt.fixed_contact_point_opt import FixedContactPointOpt
+from rrc_iprl_package.traj_opt.static_object_opt import StaticObjectOpt
+
+FT_GOAL = np.array([-0.0325, 0, 0.03, -0.0278, -0.0816, 0.0798, -0.0568, 0.0649, 0.0798])
+Q0 = np.array([[0, 0.9, -1.7, 0, 0.9, -1.7, 0, 0.9, -1.7]])
+CP_PARAMS = [[1, 0, 0], [-1, 0, 0], [0, 1, 0]]
+X0 = np.array([[0, 0, 0.0325, 0, 0, 0, 1]])
+X_GOAL = np.array([[0.02, 0.01, 0.08, 0, 0, 0, 1]])
+
+
+def static_object_solves(opt, n_solves, n_shift):
+    """Solve for fingertip goals moving by 5 mm, starting where the previous solution is after n_shift knots"""
+    q0 = Q0
+    times = []
+    for k in range(n_solves):
+        obj_pose = move_cube.Pose(position=np.array([0.005 * k, 0, 0.0325]))
+        t_start = time.perf_counter()
+        opt.solve_nlp(FT_GOAL + 0.005 * k, q0, obj_pose=obj_pose, n_shift=0 if k == 0 else n_shift)
+        times.append(time.perf_counter() - t_start)
+        q0 = np.array(opt.q_soln)[n_shift:n_shift + 1]
+    return opt.iter_count_list, times
+
+
+def fixed_cp_solves(opt, n_solves):
+    """Solve for initial object poses moving by 2 mm"""
+    times = []
+    for k in range(n_solves):
+        t_start = time.perf_counter()
+        opt.solve_nlp(CP_PARAMS, X0 + 0.002 * k, X_GOAL, c_utils.OBJ_SIZE, c_utils.OBJ_MASS)
+        times.append(time.perf_counter() - t_start)
+    return opt.iter_count_list, times
+
+
+def main():
+    n_solves = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+
+    results = []
+    for n_shift in [0, 10, 39]:
+        for warm_start in [False, True]:
+            opt = StaticObjectOpt(nGrid=40, dt=0.04, obj_shape=c_utils.OBJ_SIZE, warm_start=warm_start)
+            results.append(("StaticObjectOpt, n_shift {}".format(n_shift), warm_start,
+                            *static_object_solves(opt, n_solves, n_shift)))
+    for warm_start in [False, True]:
+        opt = FixedContactPointOpt(nGrid=50, dt=0.08, fnum=3, warm_start=warm_start)
+        results.append(("FixedContactPointOpt", warm_start, *fixed_cp_solves(opt, n_solves)))
+
+    print("\n{:>30} {:>6} {:>24} {:>12} {:>14}".format(
+          "problem", "warm", "iterations", "re-solves", "re-solve time"))
+    for name, warm_start, iters, times in results:
+        print("{:>30} {:>6} {:>24} {:>12} {:>13.3f}s".format(
+              name, str(warm_start), str(iters), sum(iters[1:]), sum(times[1:])))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""Check ObservationLayout against gym.spaces.flatten/unflatten, and time it.
+
+For random observations of PushCubeEnv and of a goal env space built from it
+(nested Dicts, as wrapped by FlattenGoalWrapper), and of a Tuple space, checks
+bitwise that:
+- ObservationLayout.flatten equals gym.spaces.flatten,
+- ObservationLayout.unflatten equals gym.spaces.unflatten,
+- FlattenGoalWrapper.observation equals gym.spaces.flatten of each key, as
+  before it used a layout,
+- CubeRewardWrapper.unflatten_observation equals gym.spaces.unflatten.
+Then times FlattenGoalWrapper.observation and unflattening with gym and with
+the layout.
+
+Usage: check_obs_layout.py [n_observations]
+"""
+import sys
+import time
+from collections import OrderedDict
+
+import gym
+import numpy as np
+
+from rrc_iprl_package.envs.env_wrappers import CubeRewardWrapper, FlattenGoalWrapper, PushCubeEnv
+from rrc_iprl_package.envs.obs_layout import ObservationLayout
+
+
+class GoalSpaceEnv(gym.Env):
+    """Env with a goal env observation space, which is never stepped."""
+    def __init__(self, observation_space):
+        self.observation_space = gym.spaces.Dict(OrderedDict([
+            ('observation', observation_space),
+            ('achieved_goal', gym.spaces.Box(-1, 1, shape=(7,))),
+            ('desired_goal', gym.spaces.Box(-1, 1, shape=(7,))),
+        ]))
+        self.action_space = gym.spaces.Box(-1, 1, shape=(9,))
+
+
+def equal(a, b):
+    if isinstance(a, dict):
+        return list(a) == list(b) and all(equal(a[k], b[k]) for k in a)
+    if isinstance(a, tuple):
+        return len(a) == len(b) and all(equal(x, y) for x, y in zip(a, b))
+    return a.dtype == b.dtype and a.shape == b.shape and np.array_equal(a, b)
+
+
+def check(name, ok):
+    print("{:<60} {}".format(name, "equal" if ok else "DIFFERENT"))
+    return ok
+
+
+def time_per_call(fn, observations):
+    t_start = time.perf_counter()
+    for o in observations:
+        fn(o)
+    return (time.perf_counter() - t_start) / len(observations) * 1e6
+
+
+def main():
+    n_observations = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    env = PushCubeEnv()
+    goal_env = GoalSpaceEnv(env.observation_space)
+    tuple_space = gym.spaces.Tuple([env.observation_space, gym.spaces.Box(-1, 1, shape=(2, 3),
+                                                                          dtype=np.float64)])
+    ok = True
+
+    for name, space in [("PushCubeEnv", env.observation_space),
+                        ("goal env", goal_env.observation_space), ("Tuple", tuple_space)]:
+        space.seed(0)
+        layout = ObservationLayout(space)
+        observations = [space.sample() for _ in range(n_observations)]
+        ok &= check("flatten, " + name, all(
+            equal(layout.flatten(o), gym.spaces.flatten(space, o)) for o in observations))
+        ok &= check("unflatten, " + name, all(
+            equal(layout.unflatten(gym.spaces.flatten(space, o)),
+                  gym.spaces.unflatten(space, gym.spaces.flatten(space, o))) for o in observations))
+
+    # previous observation is kept, as in CubeRewardWrapper
+    prev = layout.flatten(observations[0])
+    layout.flatten(observations[1])
+    ok &= check("previous observation valid", equal(prev, gym.spaces.flatten(space, observations[0])))
+
+    space = goal_env.observation_space
+    wrapper = FlattenGoalWrapper(gym.wrappers.TimeLimit(goal_env, max_episode_steps=10))
+    observations = [space.sample() for _ in range(n_observations)]
+    ok &= check("FlattenGoalWrapper.observation", all(
+        equal(wrapper.observation(o), {k: gym.spaces.flatten(space[k], v) for k, v in o.items()})
+        for o in observations))
+    reward_wrapper = CubeRewardWrapper(env)
+    flat_observations = [gym.spaces.flatten(env.observation_space, env.observation_space.sample())
+                         for _ in range(n_observations)]
+    ok &= check("CubeRewardWrapper.unflatten_observation", all(
+        equal(reward_wrapper.unflatten_observation(o), gym.spaces.unflatten(env.observation_space, o))
+        for o in flat_observations))
+
+    print("\n{:>40} {:>10} {:>10}".format("us/observation", "gym", "layout"))
+    print("{:>40} {:>10.1f} {:>10.1f}".format("FlattenGoalWrapper.observation", time_per_call(
+        lambda o: {k: gym.spaces.flatten(space[k], v) for k, v in o.items()}, observations),
+        time_per_call(wrapper.observation, observations)))
+    print("{:>40} {:>10.1f} {:>10.1f}".format("unflatten_observation", time_per_call(
+        lambda o: gym.spaces.unflatten(env.observation_space, o), flat_observations),
+        time_per_call(reward_wrapper.unflatten_observation, flat_observations)))
+
+    print("\nall equal" if ok else "\nMISMATCH")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""Check batched reward computation against the scalar path, and time it.
+
+For random batches of achieved and desired goals (some close enough to the goal
+for the success reward), checks that:
+- compute_orientation_error_batch equals compute_orientation_error of each pair,
+  and the implementation it replaced, for all options,
+- CubeRewardWrapper.compute_reward of a (B, 7) batch, directly and through
+  FlattenGoalWrapper, equals compute_reward of each row, and the
+  implementation it replaced,
+- RealRobotCubeEnv.compute_reward of a batch equals compute_reward, and
+  move_cube.evaluate_state, of each pair, for all difficulties,
+all bitwise, for several reward configurations. Then times batched against
+per-row compute_reward, as used for HER relabeling.
+
+Usage: check_reward_batch.py [batch_size]
+"""
+import itertools
+import sys
+import time
+
+import gym
+import numpy as np
+from scipy.spatial.transform import Rotation
+from trifinger_simulation.tasks import move_cube
+
+from rrc_iprl_package.envs.cube_env import RealRobotCubeEnv
+from rrc_iprl_package.envs.env_wrappers import (DIST_THRESH, ORI_THRESH, CubeRewardWrapper,
+                                                FlattenGoalWrapper, PushCubeEnv,
+                                                ReorientInitializer, compute_orientation_error,
+                                                compute_orientation_error_batch)
+
+
+def reference_orientation_error(goal_pose, actual_pose, scale=False, yaw_only=False, quad=False):
+    """compute_orientation_error before it was vectorized"""
+    if yaw_only:
+        goal_ori = Rotation.from_quat(goal_pose.orientation).as_euler('xyz')
+        goal_ori[:2] = 0
+        goal_rot = Rotation.from_euler('xyz', goal_ori)
+        actual_ori = Rotation.from_quat(actual_pose.orientation).as_euler('xyz')
+        actual_ori[:2] = 0
+        actual_rot = Rotation.from_euler('xyz', actual_ori)
+    else:
+        goal_rot = Rotation.from_quat(goal_pose.orientation)
+        actual_rot = Rotation.from_quat(actual_pose.orientation)
+    orientation_error = (goal_rot.inv() * actual_rot).magnitude()
+    if quad:
+        orientation_error = orientation_error % (np.pi/2)
+        if orientation_error > np.pi/4:
+            orientation_error = np.pi/2 - orientation_error
+    if scale:
+        orientation_error = orientation_error / np.pi
+    return orientation_error
+
+
+def reference_reward(wrapper, goal_pose, object_pose, info):
+    """CubeRewardWrapper._compute_reward before it was vectorized, without a
+    previous object pose, for configurations which use the orientation"""
+    pos_error = np.linalg.norm(object_pose.position - goal_pose.position)
+    ori_error = reference_orientation_error(goal_pose, object_pose, scale=True)
+    if wrapper.rew_fn == 'lin':
+        rew = wrapper._pos_coef * (1 - pos_error/wrapper.target_dist)
+        rew += wrapper._ori_coef * (1 - ori_error)
+    else:
+        rew = wrapper._pos_coef * np.exp(-pos_error/wrapper.target_dist)
+        rew += wrapper._ori_coef * np.exp(-ori_error)
+    ac_penalty = -np.linalg.norm(wrapper._prev_action) * wrapper._ac_norm_pen
+    total_rew = 0 * 3 + rew + ac_penalty
+    if pos_error < DIST_THRESH or ori_error < ORI_THRESH:
+        return 2.5 * ((pos_error < DIST_THRESH) + (ori_error < ORI_THRESH))
+    return total_rew
+
+
+def sample_goals(rng, batch_size):
+    """Sample (B, 7) achieved and desired goals, a quarter of them near the goal"""
+    desired = np.concatenate([rng.uniform(-0.1, 0.1, (batch_size, 3)),
+                              Rotation.random(batch_size, random_state=rng.integers(2**31)).as_quat()],
+                             axis=1)
+    achieved = np.concatenate([rng.uniform(-0.1, 0.1, (batch_size, 3)),
+                               Rotation.random(batch_size, random_state=rng.integers(2**31)).as_quat()],
+                              axis=1)
+    near = rng.random(batch_size) < 0.25
+    achieved[near, :3] = desired[near, :3] + rng.normal(0, DIST_THRESH / 2, (near.sum(), 3))
+    achieved[near, 3:] = (Rotation.from_quat(desired[near, 3:]) *
+                          Rotation.from_rotvec(rng.normal(0, ORI_THRESH / 2, (near.sum(), 3)))).as_quat()
+    return achieved, desired
+
+
+def pose(goal):
+    return move_cube.Pose(position=goal[:3], orientation=goal[3:])
+
+
+def goal_dict(goal):
+    return {"position": goal[..., :3], "orientation": goal[..., 3:]}
+
+
+def check(name, batch, scalar):
+    equal = np.array_equal(np.asarray(batch), np.asarray(scalar))
+    print("{:<60} {}".format(name, "equal" if equal else "DIFFERENT, max {:.2e}".format(
+        np.max(np.abs(np.asarray(batch) - np.asarray(scalar))))))
+    return equal
+
+
+def main():
+    batch_size = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+    rng = np.random.default_rng(0)
+    achieved, desired = sample_goals(rng, batch_size)
+    ok = True
+
+    for scale, yaw_only, quad in itertools.product([False, True], repeat=3):
+        batch = compute_orientation_error_batch(desired[:, 3:], achieved[:, 3:], scale, yaw_only, quad)
+        scalar = [compute_orientation_error(pose(d), pose(a), scale, yaw_only, quad)
+                  for a, d in zip(achieved, desired)]
+        reference = [reference_orientation_error(pose(d), pose(a), scale, yaw_only, quad)
+                     for a, d in zip(achieved, desired)]
+        flags = "scale={}, yaw_only={}, quad={}".format(scale, yaw_only, quad)
+        ok &= check("orientation error, " + flags, batch, scalar)
+        ok &= check("orientation error vs previous, " + flags, batch, reference)
+
+    for difficulty, rew_fn, ori_coef in itertools.product([1, 4], ['lin', 'exp'], [0., 1.]):
+        env = PushCubeEnv(initializer=ReorientInitializer(difficulty))
+        wrapper = CubeRewardWrapper(env, ori_coef=ori_coef, rew_fn=rew_fn, goal_env=True)
+        wrapper._prev_action = env.action_space.sample()
+        flat_wrapper = FlattenGoalWrapper(gym.wrappers.TimeLimit(wrapper, max_episode_steps=10))
+        info = {"difficulty": difficulty}
+        config = "difficulty={}, rew_fn={}, ori_coef={}".format(difficulty, rew_fn, ori_coef)
+
+        batch = wrapper.compute_reward(achieved, desired, dict(info))
+        scalar = [wrapper.compute_reward(a, d, dict(info)) for a, d in zip(achieved, desired)]
+        ok &= check("reward, " + config, batch, scalar)
+        ok &= check("reward via FlattenGoalWrapper, " + config,
+                    flat_wrapper.compute_reward(achieved, desired, dict(info)), scalar)
+        if difficulty == 4 or ori_coef:
+            reference = [reference_reward(wrapper, pose(d), pose(a), dict(info))
+                         for a, d in zip(achieved, desired)]
+            ok &= check("reward vs previous, " + config, batch, reference)
+
+    # the goal of the environment is not used by compute_reward, but validated
+    goal = move_cube.sample_goal(difficulty=4)
+    robot_env = RealRobotCubeEnv({"position": goal.position, "orientation": goal.orientation},
+                                 visualization=False)
+    for difficulty in [1, 2, 3, 4]:
+        robot_info = {"difficulty": difficulty}
+        batch = robot_env.compute_reward(goal_dict(achieved), goal_dict(desired), robot_info)
+        scalar = [robot_env.compute_reward(goal_dict(a), goal_dict(d), robot_info)
+                  for a, d in zip(achieved, desired)]
+        reference = [-move_cube.evaluate_state(pose(d), pose(a), difficulty)
+                     for a, d in zip(achieved, desired)]
+        ok &= check("RealRobotCubeEnv reward, difficulty={}".format(difficulty), batch, scalar)
+        ok &= check("RealRobotCubeEnv reward vs evaluate_state, difficulty={}".format(difficulty),
+                    batch, reference)
+    robot_env.close()
+
+    n_runs = 20
+    t_start = time.perf_counter()
+    for _ in range(n_runs):
+        [wrapper.compute_reward(a, d, dict(info)) for a, d in zip(achieved, desired)]
+    t_scalar = (time.perf_counter() - t_start) / n_runs
+    t_start = time.perf_counter()
+    for _ in range(n_runs):
+        wrapper.compute_reward(achieved, desired, dict(info))
+    t_batch = (time.perf_counter() - t_start) / n_runs
+    print("\ncompute_reward of {} goals: per row {:.2f} ms, batched {:.3f} ms, {:.0f}x".format(
+        batch_size, t_scalar * 1e3, t_batch * 1e3, t_scalar / t_batch))
+
+    print("\nall equal" if ok else "\nMISMATCH")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -45,9 +45,9 @@ def main():
     initial_pose.orientation = np.array([0, 0, np.sin(theta/2), np.cos(theta/2)])
    
     if osp.exists('/output'):
-        save_path = '/output/action_log.npz'
+        save_path = '/output/action_log.bin'
     else:
-        save_path = 'action_log.npz'
+        save_path = 'action_log.bin'
     env = cube_env.RealRobotCubeEnv(
         goal, initial_pose.to_dict(), difficulty,
         cube_env.ActionType.TORQUE_AND_POSITION, frameskip=FRAMESKIP,
@@ -81,11 +81,14 @@ def main():
         print("Error encounted: {}. Saving logs and exiting".format(e))
         env.save_action_log()
         policy.impedance_controller.save_log()
+        env.close()
         raise e
 
     env.save_action_log()
     # Save control_policy_log
     policy.impedance_controller.save_log()
+    # Stop the async planner worker
+    env.close()
 
     #print("------")
     #print("Accumulated Reward: {:.3f}".format(accumulated_reward))
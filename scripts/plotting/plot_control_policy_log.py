@@ -2,16 +2,17 @@ import numpy as np
 import argparse
 import matplotlib.pyplot as plt
 import os.path as osp
+from rrc_iprl_package.control.column_log import load_column_log
 
 parser = argparse.ArgumentParser()
-parser.add_argument("filename", type=str)
+parser.add_argument("filename", type=str, help="control_policy_log directory, or npz file of older logs")
 args = parser.parse_args()
 
-output_dir = osp.dirname(args.filename)
-# Open npz file
-data = np.load(args.filename)
+output_dir = osp.dirname(osp.normpath(args.filename))
+# Open log
+data = load_column_log(args.filename)
 
-# Get arrays from npz file
+# Get arrays from log
 step_count        = data["step_count"]
 timestamp         = data["timestamp"]
 desired_ft_pos    = data["desired_ft_pos"]